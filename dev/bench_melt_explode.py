@@ -0,0 +1,140 @@
+"""Benchmark tags_melt, columns_melt and tags_explode against the row-wise originals.
+
+Builds a synthetic frame of feature rows with a few dense and many sparse
+``tags.<key>`` columns, runs the vectorized implementations of
+:mod:`earth_osm.utils` and the ``DataFrame.apply`` based versions they
+replaced on copies of it, and prints the timings and whether the outputs
+match. The original ``columns_melt`` dropped the tags melted from earlier
+columns in rows where a later column was missing, so its output is expected
+to differ. The original versions take minutes at the default size.
+
+Usage::
+
+    python dev/bench_melt_explode.py [--rows 100000] [--dense 31] [--sparse 170]
+"""
+
+import argparse
+import ast
+import json
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from earth_osm.utils import columns_melt, tags_explode, tags_melt
+
+
+def _legacy_tags_melt(df_exp, nan_threshold=0.75):
+    high_nan_cols = df_exp.columns[df_exp.isnull().mean() > nan_threshold]
+    df_high_nan = df_exp[high_nan_cols]
+    df_exp["other_tags"] = df_high_nan.apply(lambda x: x.dropna().to_dict(), axis=1)
+    df_exp["other_tags"] = df_exp["other_tags"].apply(lambda x: x if x != {} else None)
+    df_exp.drop(columns=high_nan_cols, inplace=True)
+    return df_exp
+
+
+def _legacy_columns_melt(df_exp, columns_to_move):
+    def concat_melt(row, col):
+        if str(row[col]) == "nan":
+            return None
+        if (
+            "other_tags" not in row.keys()
+            or row["other_tags"] == {}
+            or row["other_tags"] is None
+            or str(row["other_tags"]) == "nan"
+        ):
+            return {col: row[col]}
+        return {**row["other_tags"], col: row[col]}
+
+    for col in columns_to_move:
+        if col in df_exp.columns:
+            df_exp["other_tags"] = df_exp.apply(lambda x: concat_melt(x, col), axis=1)
+            df_exp.drop(columns=col, inplace=True)
+    return df_exp
+
+
+def _legacy_tags_explode(df_melt):
+    if df_melt["other_tags"].isnull().all():
+        df_melt.drop(columns=["other_tags"], inplace=True)
+        return df_melt
+    df_melt["other_tags"] = df_melt["other_tags"].apply(
+        lambda x: ast.literal_eval(x) if isinstance(x, str) else x
+    )
+    df_exploded = df_melt.join(pd.json_normalize(df_melt["other_tags"]))
+    df_exploded.drop(columns=["other_tags"], inplace=True)
+    return df_exploded
+
+
+def synthetic_frame(rows, dense, sparse, seed=0):
+    """Return ``rows`` features with ``dense`` common and ``sparse`` rare tag columns."""
+
+    rng = np.random.default_rng(seed)
+    data = {
+        "id": np.arange(rows, dtype=np.int64),
+        "Region": np.where(rng.random(rows) < 0.5, "AA", "BB"),
+        "Type": np.where(rng.random(rows) < 0.8, "way", "node"),
+    }
+    keys = [(f"tags.dense_{i}", 0.3 + 0.6 * rng.random()) for i in range(dense)]
+    keys += [(f"tags.sparse_{i}", 0.2 * rng.random()) for i in range(sparse)]
+    for column, share in keys:
+        values = np.full(rows, np.nan, dtype=object)
+        present = np.flatnonzero(rng.random(rows) < share)
+        values[present] = [f"v{value}" for value in rng.integers(0, 50, present.size)]
+        data[column] = values
+    return pd.DataFrame(data)
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def _same(left, right):
+    try:
+        pd.testing.assert_frame_equal(left, right)
+    except AssertionError:
+        return False
+    return True
+
+
+def _report(name, legacy, current, same):
+    verdict = "identical output" if same else "output differs"
+    print(f"{name:<26}{legacy:8.2f}s -> {current:.2f}s  ({verdict})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--dense", type=int, default=31)
+    parser.add_argument("--sparse", type=int, default=170)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.getLogger("eo.utils").setLevel(logging.ERROR)
+
+    frame = synthetic_frame(args.rows, args.dense, args.sparse, args.seed)
+    print(f"Synthetic frame: {frame.shape[0]} rows, {frame.shape[1]} columns")
+
+    old_melted, legacy = _timed(_legacy_tags_melt, frame.copy())
+    melted, current = _timed(tags_melt, frame.copy())
+    _report("tags_melt", legacy, current, _same(old_melted, melted))
+
+    moved = [column for column in melted.columns if column.startswith("tags.")]
+    old_moved, legacy = _timed(_legacy_columns_melt, melted.copy(), moved)
+    new_moved, current = _timed(columns_melt, melted.copy(), moved)
+    _report(f"columns_melt ({len(moved)} cols)", legacy, current, _same(old_moved, new_moved))
+
+    old_exploded, legacy = _timed(_legacy_tags_explode, new_moved.copy())
+    exploded, current = _timed(tags_explode, new_moved.copy())
+    _report("tags_explode (dicts)", legacy, current, _same(old_exploded, exploded))
+
+    text = new_moved.copy()
+    text["other_tags"] = [json.dumps(tags) if tags else None for tags in text["other_tags"]]
+    old_exploded, legacy = _timed(_legacy_tags_explode, text.copy())
+    exploded, current = _timed(tags_explode, text.copy())
+    _report("tags_explode (json text)", legacy, current, _same(old_exploded, exploded))
+
+
+if __name__ == "__main__":
+    main()
@@ -14,9 +14,11 @@ import sys
 import resource
 from typing import List, Optional
 
+from earth_osm.blockcache import DEFAULT_BLOCK_CACHE_MB
 from earth_osm.tagdata import get_feature_list, get_primary_list
 from earth_osm.eo import save_osm_data
 from earth_osm.gfk_data import get_all_valid_list, view_regions
+from earth_osm.overpass import MAX_CONCURRENT_REQUESTS
 
 
 def _get_peak_rss() -> Optional[int]:
@@ -72,10 +74,135 @@ def setup_extract_parser(subparsers):
     extract_parser.add_argument('--no_mp', action='store_true', help='Disable Multiprocessing')
     extract_parser.add_argument('--data_dir', type=str, help='Earth Data Directory')
     extract_parser.add_argument('--out_dir', type=str, help='Earth Output Directory')
-    extract_parser.add_argument('--out_format', nargs="*", type=str, choices=['csv', 'geojson'], default=['csv', 'geojson'], help='Export options')
+    extract_parser.add_argument(
+        '--out_format',
+        nargs="*",
+        type=str,
+        choices=['csv', 'geojson', 'geojsonseq', 'parquet', 'fgb', 'gpkg'],
+        default=['csv', 'geojson'],
+        help='Export options',
+    )
     extract_parser.add_argument('--source', type=str, choices=['geofabrik', 'overpass'], default='geofabrik', help='Data Source')
     extract_parser.add_argument('--legacy_pipeline', action='store_true', help='Use legacy in-memory pipeline instead of streaming (benchmark only)')
     extract_parser.add_argument('--cache_primary', action='store_true', help='Cache primary tag snapshot (disabled by default)')
+    extract_parser.add_argument(
+        '--from_parent',
+        action='store_true',
+        help='Cut regions out of a cached parent/planet PBF instead of downloading them',
+    )
+    extract_parser.add_argument(
+        '--parent_region',
+        type=str,
+        help='Scan this parent region PBF once and fan out to all requested regions',
+    )
+    extract_parser.add_argument(
+        '--bbox',
+        nargs=4,
+        type=float,
+        metavar=('MINLON', 'MINLAT', 'MAXLON', 'MAXLAT'),
+        help='Only extract features inside this bounding box',
+    )
+    extract_parser.add_argument(
+        '--polygon',
+        type=str,
+        help='Only extract features inside this polygon (WKT or path to a vector file)',
+    )
+    extract_parser.add_argument(
+        '--tag_filter',
+        type=str,
+        help='Additional tag predicate, e.g. "voltage>=110000 & !location=underground"',
+    )
+    extract_parser.add_argument(
+        '--spill_dir',
+        type=str,
+        help='Directory for temporary export spill files (default: system temp dir)',
+    )
+    extract_parser.add_argument(
+        '--single_pass',
+        action='store_true',
+        help='Plan output columns from recorded tag statistics and skip the spill file',
+    )
+    extract_parser.add_argument(
+        '--spill_compression',
+        type=str,
+        choices=['zlib', 'bz2', 'lzma', 'none'],
+        default='zlib',
+        help='Compression of the export spill files',
+    )
+    extract_parser.add_argument(
+        '--gpkg_path', type=str, help='Write all gpkg outputs as tables of this one GeoPackage'
+    )
+    extract_parser.add_argument(
+        '--gpkg_table', type=str, help='Append all gpkg outputs to this table of --gpkg_path'
+    )
+    extract_parser.add_argument(
+        '--shards', type=int, default=1, help='Split every output into this many shard files'
+    )
+    extract_parser.add_argument(
+        '--shard_by',
+        type=str,
+        choices=['id', 'cell'],
+        default='id',
+        help='Route rows to shards by id hash or spatial cell',
+    )
+    extract_parser.add_argument(
+        '--max_part_rows', type=int, help='Start a new part file of a shard every N rows'
+    )
+    extract_parser.add_argument(
+        '--spatial_order',
+        type=str,
+        choices=['hilbert', 'zorder'],
+        help='Sort output rows along a space-filling curve',
+    )
+    extract_parser.add_argument(
+        '--feature_store',
+        type=str,
+        help='Also upsert the exported rows into this SQLite feature store',
+    )
+    extract_parser.add_argument(
+        '--dedup',
+        type=str,
+        choices=['first', 'last'],
+        help=(
+            'Write features found in several regions once, labelled with the first or last '
+            'listed region'
+        ),
+    )
+    extract_parser.add_argument(
+        '--result_cache',
+        action='store_true',
+        help=(
+            'Skip the export when the cached PBFs and options match an earlier run whose '
+            'outputs are unchanged'
+        ),
+    )
+    extract_parser.add_argument(
+        '--resume',
+        action='store_true',
+        help=(
+            'Checkpoint the extraction in data_dir and continue an interrupted run of the '
+            'same command'
+        ),
+    )
+    extract_parser.add_argument(
+        '--block_cache',
+        type=int,
+        nargs='?',
+        const=DEFAULT_BLOCK_CACHE_MB,
+        metavar='MB',
+        help=(
+            'Cache per-block scan results in data_dir for reruns over the same PBFs, '
+            f'keeping up to MB MiB (default {DEFAULT_BLOCK_CACHE_MB})'
+        ),
+    )
+    extract_parser.add_argument(
+        '--overpass_slots',
+        type=int,
+        help=(
+            'Concurrent Overpass queries when a region is fetched as its countries '
+            f'(default {MAX_CONCURRENT_REQUESTS})'
+        ),
+    )
     
     agg_group = extract_parser.add_mutually_exclusive_group()
     agg_group.add_argument('--agg_feature', action='store_true', help='Aggregate Outputs by feature')
@@ -109,6 +236,8 @@ def ensure_directory(directory: str) -> str:
 
 def handle_extract(args):
     validate_regions(args.regions)
+    if args.parent_region:
+        validate_regions([args.parent_region])
     feature_list = validate_features(args.primary, args.features)
 
     data_dir = ensure_directory(args.data_dir or os.path.join(os.getcwd(), 'earth_data'))
@@ -130,6 +259,24 @@ def handle_extract(args):
         f'Data Source = {args.source}',
         f'Streaming Backend = {"enabled" if stream_backend else "disabled (legacy)"}',
     f'Primary Cache = {"enabled" if args.cache_primary else "disabled"}',
+        f'Derive From Parent = {args.from_parent}',
+        f'Parent Region = {args.parent_region or "none"}',
+        f'Bounding Box = {args.bbox or "none"}',
+        f'Polygon = {args.polygon or "none"}',
+        f'Tag Filter = {args.tag_filter or "none"}',
+        f'Spill Directory = {args.spill_dir or "system temp"} ({args.spill_compression})',
+        f'Single Pass = {args.single_pass}',
+        f'GeoPackage = {args.gpkg_path or "one per output"}'
+        + (f' (table {args.gpkg_table})' if args.gpkg_table else ''),
+        f'Shards = {args.shards} by {args.shard_by} '
+        f'(max part rows: {args.max_part_rows or "unlimited"})',
+        f'Spatial Order = {args.spatial_order or "id"}',
+        f'Feature Store = {args.feature_store or "none"}',
+        f'Deduplicate = {args.dedup or "off"}',
+        f'Result Cache = {"enabled" if args.result_cache else "disabled"}',
+        f'Resume = {args.resume}',
+        f'Block Cache = {f"{args.block_cache} MiB" if args.block_cache else "disabled"}',
+        f'Overpass Slots = {args.overpass_slots or MAX_CONCURRENT_REQUESTS}',
     ]))
 
     peak_before = _get_peak_rss()
@@ -147,6 +294,26 @@ def handle_extract(args):
         data_source=args.source,
         stream_backend=stream_backend,
     cache_primary=args.cache_primary,
+        from_parent=args.from_parent,
+        parent_region=args.parent_region,
+        bbox=args.bbox,
+        polygon=args.polygon,
+        tag_filter=args.tag_filter,
+        spill_dir=args.spill_dir,
+        spill_compression=None if args.spill_compression == 'none' else args.spill_compression,
+        single_pass=args.single_pass,
+        gpkg_path=args.gpkg_path,
+        gpkg_table=args.gpkg_table,
+        shards=args.shards,
+        shard_by=args.shard_by,
+        max_part_rows=args.max_part_rows,
+        spatial_order=args.spatial_order,
+        feature_store=args.feature_store,
+        dedup=args.dedup,
+        result_cache=args.result_cache,
+        resume=args.resume,
+        block_cache=args.block_cache,
+        overpass_slots=args.overpass_slots,
     )
 
     peak_after = _get_peak_rss()
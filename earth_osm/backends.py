@@ -9,15 +9,19 @@ from __future__ import annotations
 
 import logging
 import os
-from typing import Dict, Iterator, Tuple, Union
+from typing import Dict, Iterator, Optional, Tuple, Union
 
 import pandas as pd
 
+from earth_osm.blockcache import BlockCache
 from earth_osm.filter import get_filtered_data
-from earth_osm.overpass import iter_overpass_rows, rows_from_feature_dict
-from earth_osm.regions import download_region_pbf
+from earth_osm.frames import build_feature_frame
+from earth_osm.overpass import OverpassScheduler, iter_overpass_rows, rows_from_feature_dict
+from earth_osm.predicate import TagPredicate
+from earth_osm.spatial import SpatialFilter
 from earth_osm.stream import (
     primary_cache_path,
+    resolve_region_pbf,
     stream_cached_primary_features,
     stream_pbf_features,
 )
@@ -52,7 +56,7 @@ def geofabrik_legacy_backend(
         progress_bar=progress_bar,
     )
 
-    rows = list(
+    return build_feature_frame(
         rows_from_feature_dict(
             feature_dict,
             region.short,
@@ -60,10 +64,6 @@ def geofabrik_legacy_backend(
         )
     )
 
-    df_feature = pd.DataFrame(rows)
-    df_feature.dropna(axis=1, how="all", inplace=True)
-    return df_feature
-
 
 def geofabrik_stream_backend(
     region,
@@ -75,6 +75,11 @@ def geofabrik_stream_backend(
     data_dir: str,
     progress_bar: bool = True,
     cache_primary: bool = False,
+    from_parent: bool = False,
+    spatial: Optional[SpatialFilter] = None,
+    tag_filter: Optional[TagPredicate] = None,
+    checkpoint_dir: Optional[str] = None,
+    block_cache: Optional[BlockCache] = None,
 ) -> StreamPayload:
     """Yield flattened feature dictionaries using the streaming pipeline."""
 
@@ -86,9 +91,24 @@ def geofabrik_stream_backend(
         feature_name,
         os.path.basename(pbf_url),
     )
-    filename = download_region_pbf(region, update, data_dir, progress_bar=progress_bar)
+    user_spatial = spatial
+    filename, spatial = resolve_region_pbf(
+        region,
+        update,
+        data_dir,
+        progress_bar=progress_bar,
+        from_parent=from_parent,
+        spatial=spatial,
+    )
 
-    if cache_primary:
+    if cache_primary and (user_spatial is not None or tag_filter is not None):
+        logger.info(
+            "Region %s (%s=%s): spatial or tag filter given, bypassing the primary cache",
+            region.short,
+            primary_name,
+            feature_name,
+        )
+    elif cache_primary:
         cache_path = primary_cache_path(data_dir, region.short, primary_name, filename)
         return stream_cached_primary_features(
             filename,
@@ -98,6 +118,7 @@ def geofabrik_stream_backend(
             cache_path,
             multiprocess=mp,
             rebuild_cache=update,
+            spatial=spatial,
         )
 
     return stream_pbf_features(
@@ -106,6 +127,10 @@ def geofabrik_stream_backend(
         feature_name,
         region.short,
         multiprocess=mp,
+        spatial=spatial,
+        tag_filter=tag_filter,
+        checkpoint_dir=checkpoint_dir,
+        block_cache=block_cache,
     )
 
 
@@ -115,11 +140,11 @@ def overpass_backend(
     feature_name: str,
     *,
     data_dir: str,
+    scheduler: Optional[OverpassScheduler] = None,
 ) -> LegacyPayload:
-    rows = list(iter_overpass_rows(region, primary_name, feature_name, data_dir))
-    df_feature = pd.DataFrame(rows)
-    df_feature.dropna(axis=1, how="all", inplace=True)
-    return df_feature
+    return build_feature_frame(
+        iter_overpass_rows(region, primary_name, feature_name, data_dir, scheduler)
+    )
 
 
 def fetch_region_backend(
@@ -134,9 +159,18 @@ def fetch_region_backend(
     data_dir: str,
     progress_bar: bool = True,
     cache_primary: bool = False,
+    from_parent: bool = False,
+    spatial: Optional[SpatialFilter] = None,
+    tag_filter: Optional[TagPredicate] = None,
+    checkpoint_dir: Optional[str] = None,
+    block_cache: Optional[BlockCache] = None,
+    overpass_scheduler: Optional[OverpassScheduler] = None,
 ) -> BackendResult:
     """Select the appropriate backend and return a tagged payload.
 
+    Overpass requests go through ``overpass_scheduler`` when given, so
+    concurrent callers share its slots and rate limit pauses.
+
     Returns:
         A tuple where the first element is either ``"stream"`` or
         ``"dataframe"`` indicating the payload type, and the second element is
@@ -154,8 +188,15 @@ def fetch_region_backend(
                 data_dir=data_dir,
                 progress_bar=progress_bar,
                 cache_primary=cache_primary,
+                from_parent=from_parent,
+                spatial=spatial,
+                tag_filter=tag_filter,
+                checkpoint_dir=checkpoint_dir,
+                block_cache=block_cache,
             )
             return "stream", iterator
+        if spatial is not None or tag_filter is not None:
+            raise ValueError("Spatial and tag filters require the streaming pipeline")
         dataframe = geofabrik_legacy_backend(
             region,
             primary_name,
@@ -168,6 +209,10 @@ def fetch_region_backend(
         return "dataframe", dataframe
 
     if data_source == "overpass":
+        if spatial is not None or tag_filter is not None:
+            raise ValueError(
+                "Spatial and tag filters are not supported for the Overpass backend."
+            )
         if use_stream:
             raise ValueError(
                 "Streaming export is not supported for the Overpass backend."
@@ -177,6 +222,7 @@ def fetch_region_backend(
             primary_name,
             feature_name,
             data_dir=data_dir,
+            scheduler=overpass_scheduler,
         )
         return "dataframe", dataframe
 
@@ -0,0 +1,295 @@
+"""Cache of per-block scan results.
+
+The first pass of a scan decodes every block of a PBF and keeps the elements
+matching the scan predicate. Analysts often rerun slightly different feature
+sets against the same PBF, so a :class:`BlockCache` stores what each block
+yielded as ``<directory>/<pbf>/<filter>/<offset>.bin``:
+
+* ``<pbf>`` hashes the path of the PBF; its ``pbf.json`` records the size and
+  modification time, and the entries are dropped once the file changes;
+* ``<filter>`` hashes the normalized predicate (see
+  :func:`~earth_osm.predicate.normalize_predicate`) and the spatial filter,
+  both kept in its ``filter.json``.
+
+A scan with the same filter reads its blocks from the cache and never
+decompresses the PBF. A scan whose filter is narrower than a cached one
+(:func:`~earth_osm.predicate.predicate_implies`, with the same or no spatial
+filter) reads the cached candidates of that filter and keeps those it
+matches. Entries are ``.npz`` archives of :mod:`earth_osm.elementarrays`
+like the scan checkpoints of :mod:`earth_osm.checkpoint` (arrays with
+delta-encoded way refs, tags as JSON), read with ``allow_pickle=False``; the
+least recently used ones are deleted once the cache outgrows its size.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+from dataclasses import asdict, dataclass
+from typing import List, Optional, Set, Tuple
+
+from earth_osm.blockindex import BlockStats, file_signature
+from earth_osm.elementarrays import (
+    ARRAY_ERRORS,
+    dump_arrays,
+    json_array,
+    json_value,
+    load_arrays,
+    pack_nodes,
+    pack_ways,
+    unpack_nodes,
+    unpack_ways,
+)
+from earth_osm.osmpbf import Node, Way
+from earth_osm.predicate import (
+    TagPredicate,
+    normalize_predicate,
+    predicate_from_json,
+    predicate_implies,
+    predicate_to_json,
+)
+from earth_osm.spatial import SpatialFilter
+
+logger = logging.getLogger("eo.blockcache")
+
+BLOCK_CACHE_VERSION = 2
+DEFAULT_BLOCK_CACHE_MB = 1024
+
+_FILTER_FILE = "filter.json"
+_PBF_FILE = "pbf.json"
+_ENTRY_SUFFIX = ".bin"
+
+BlockResult = Tuple[List[Node], List[Way], Set[int], Tuple[int, BlockStats]]
+
+
+def _digest(payload: bytes) -> str:
+    return hashlib.sha256(payload).hexdigest()[:16]
+
+
+def spatial_key(spatial: Optional[SpatialFilter]) -> Optional[str]:
+    """Return a string identifying ``spatial`` (``None`` without a filter)."""
+
+    if spatial is None:
+        return None
+    payload = repr(tuple(spatial.bbox)).encode("utf-8")
+    if spatial.geometry is not None:
+        payload += spatial.geometry.wkb
+    return _digest(payload)
+
+
+def _encode(result: BlockResult) -> bytes:
+    nodes, ways, _, (_, stats) = result
+    return dump_arrays(
+        {
+            "meta": json_array({"version": BLOCK_CACHE_VERSION, "stats": asdict(stats)}),
+            **pack_nodes("nodes", nodes),
+            **pack_ways("ways", ways),
+        }
+    )
+
+
+def _decode(ofs: int, data: bytes) -> Optional[BlockResult]:
+    arrays = load_arrays(data)
+    meta = json_value(arrays["meta"])
+    if meta.get("version") != BLOCK_CACHE_VERSION:
+        return None
+    ways = unpack_ways("ways", arrays)
+    referenced = {ref for way in ways for ref in way.refs}
+    stats = BlockStats.from_dict(meta["stats"])
+    return unpack_nodes("nodes", arrays), ways, referenced, (ofs, stats)
+
+
+@dataclass(frozen=True)
+class BlockCacheScan:
+    """Cache access of one scan, handed to the block workers.
+
+    ``sources`` lists the filter directories to read from: the scan's own
+    directory first, then those of broader filters.
+    """
+
+    directory: str
+    sources: Tuple[str, ...]
+    predicate: TagPredicate
+    spatial: Optional[SpatialFilter]
+
+    def load(self, ofs: int) -> Optional[BlockResult]:
+        """Return the cached result of the block at ``ofs``, if any."""
+
+        for position, source in enumerate(self.sources):
+            path = os.path.join(source, f"{ofs}{_ENTRY_SUFFIX}")
+            try:
+                with open(path, "rb") as entry:
+                    result = _decode(ofs, entry.read())
+                os.utime(path)
+            except FileNotFoundError:
+                continue
+            except ARRAY_ERRORS as exc:
+                logger.debug("Ignoring unreadable block cache entry %s: %s", path, exc)
+                continue
+            if result is None:
+                continue
+            if position == 0:
+                return result
+            return self._narrow(result)
+        return None
+
+    def _narrow(self, result: BlockResult) -> BlockResult:
+        nodes, ways, _, stats = result
+        predicate, spatial = self.predicate, self.spatial
+        nodes = [
+            node
+            for node in nodes
+            if predicate.matches(node.tags)
+            and (spatial is None or spatial.contains(*node.lonlat))
+        ]
+        ways = [way for way in ways if predicate.matches(way.tags)]
+        return nodes, ways, {ref for way in ways for ref in way.refs}, stats
+
+    def store(self, result: BlockResult) -> None:
+        """Save the result of one scanned block."""
+
+        path = os.path.join(self.directory, f"{result[3][0]}{_ENTRY_SUFFIX}")
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "wb") as entry:
+                entry.write(_encode(result))
+            os.replace(temp_path, path)
+        except OSError as exc:
+            logger.debug("Could not write block cache entry %s: %s", path, exc)
+
+
+class BlockCache:
+    """Per-block scan results in ``directory``, limited to ``max_bytes``."""
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_BLOCK_CACHE_MB << 20):
+        if max_bytes <= 0:
+            raise ValueError("Block cache size must be positive")
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def _pbf_dir(self, filename: str) -> str:
+        path = os.path.abspath(filename)
+        directory = os.path.join(self.directory, _digest(path.encode("utf-8")))
+        signature = {"path": path, "version": BLOCK_CACHE_VERSION, **file_signature(filename)}
+        marker = os.path.join(directory, _PBF_FILE)
+        try:
+            with open(marker, "r", encoding="utf-8") as source:
+                recorded = json.load(source)
+        except (OSError, ValueError):
+            recorded = None
+        if recorded != signature:
+            if recorded is not None:
+                logger.info(
+                    "%s changed; dropping its cached block results", os.path.basename(filename)
+                )
+            shutil.rmtree(directory, ignore_errors=True)
+            os.makedirs(directory, exist_ok=True)
+            with open(marker, "w", encoding="utf-8") as target:
+                json.dump(signature, target)
+        return directory
+
+    def scan(
+        self,
+        filename: str,
+        predicate: TagPredicate,
+        spatial: Optional[SpatialFilter] = None,
+    ) -> BlockCacheScan:
+        """Prepare the cache for a scan of ``filename`` with ``predicate`` and ``spatial``."""
+
+        predicate = normalize_predicate(predicate)
+        region_key = spatial_key(spatial)
+        pbf_dir = self._pbf_dir(filename)
+        filter_key = (repr(predicate), region_key)
+        directory = os.path.join(pbf_dir, _digest(repr(filter_key).encode("utf-8")))
+
+        broader = []
+        for entry in sorted(os.scandir(pbf_dir), key=lambda item: item.name):
+            if not entry.is_dir() or entry.path == directory:
+                continue
+            try:
+                with open(
+                    os.path.join(entry.path, _FILTER_FILE), "r", encoding="utf-8"
+                ) as source:
+                    recorded = json.load(source)
+                cached_predicate = predicate_from_json(recorded["predicate"])
+                cached_spatial = recorded["spatial"]
+            except (OSError, KeyError, TypeError, ValueError):
+                continue
+            if cached_spatial not in (None, region_key):
+                continue
+            if predicate_implies(predicate, cached_predicate):
+                broader.append(entry.path)
+
+        if not os.path.exists(os.path.join(directory, _FILTER_FILE)):
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, _FILTER_FILE), "w", encoding="utf-8") as target:
+                json.dump(
+                    {"predicate": predicate_to_json(predicate), "spatial": region_key}, target
+                )
+        if broader:
+            logger.debug(
+                "Block cache: %d broader filters can serve %r", len(broader), predicate
+            )
+        return BlockCacheScan(directory, (directory, *broader), predicate, spatial)
+
+    def size(self) -> int:
+        """Total bytes of the cached block results."""
+
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def _entries(self) -> List[os.DirEntry]:
+        entries: List[os.DirEntry] = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for pbf_entry in os.scandir(self.directory):
+            if not pbf_entry.is_dir():
+                continue
+            for filter_entry in os.scandir(pbf_entry.path):
+                if not filter_entry.is_dir():
+                    continue
+                entries.extend(
+                    entry
+                    for entry in os.scandir(filter_entry.path)
+                    if entry.name.endswith(_ENTRY_SUFFIX)
+                )
+        return entries
+
+    def evict(self) -> int:
+        """Delete the least recently used entries beyond ``max_bytes``; return how many."""
+
+        entries = []
+        total = 0
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            total += stat.st_size
+
+        removed = 0
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        if removed:
+            logger.info("Block cache: evicted %d least recently used blocks", removed)
+        return removed
+
+
+__all__ = [
+    "BLOCK_CACHE_VERSION",
+    "BlockCache",
+    "BlockCacheScan",
+    "DEFAULT_BLOCK_CACHE_MB",
+    "spatial_key",
+]
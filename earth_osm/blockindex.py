@@ -0,0 +1,175 @@
+"""Per-block statistics for OpenStreetMap PBF archives.
+
+Every streaming scan decodes each block of a PBF once. While doing so it records
+a handful of cheap statistics (element counts, node id range and node bounding
+box) that are persisted next to the archive. Later scans of the same file use
+them to skip blocks that cannot contribute: node blocks outside a spatial
+filter during candidate collection, and blocks without any of the requested
+node ids while collecting way coordinates.
+"""
+
+from __future__ import annotations
+
+import bisect
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+from earth_osm.spatial import BBox
+
+logger = logging.getLogger("eo.blockindex")
+
+BLOCK_INDEX_SUFFIX = ".blocks.json"
+BLOCK_INDEX_VERSION = 1
+
+
+@dataclass
+class BlockStats:
+    """Summary of the elements stored in one PBF block."""
+
+    nodes: int = 0
+    ways: int = 0
+    relations: int = 0
+    min_node_id: Optional[int] = None
+    max_node_id: Optional[int] = None
+    bbox: Optional[BBox] = None
+
+    def add_node(self, node_id: int, lon: float, lat: float) -> None:
+        self.nodes += 1
+        if self.min_node_id is None or node_id < self.min_node_id:
+            self.min_node_id = node_id
+        if self.max_node_id is None or node_id > self.max_node_id:
+            self.max_node_id = node_id
+        if self.bbox is None:
+            self.bbox = (lon, lat, lon, lat)
+        else:
+            min_lon, min_lat, max_lon, max_lat = self.bbox
+            self.bbox = (
+                min(min_lon, lon),
+                min(min_lat, lat),
+                max(max_lon, lon),
+                max(max_lat, lat),
+            )
+
+    def add_nodes(self, ids: np.ndarray, lons: np.ndarray, lats: np.ndarray) -> None:
+        """Vectorised :meth:`add_node` for a decoded dense node group."""
+
+        if len(ids) == 0:
+            return
+        self.nodes += int(len(ids))
+        low, high = int(ids.min()), int(ids.max())
+        self.min_node_id = low if self.min_node_id is None else min(self.min_node_id, low)
+        self.max_node_id = high if self.max_node_id is None else max(self.max_node_id, high)
+        group_bbox = (
+            float(lons.min()),
+            float(lats.min()),
+            float(lons.max()),
+            float(lats.max()),
+        )
+        if self.bbox is None:
+            self.bbox = group_bbox
+        else:
+            self.bbox = (
+                min(self.bbox[0], group_bbox[0]),
+                min(self.bbox[1], group_bbox[1]),
+                max(self.bbox[2], group_bbox[2]),
+                max(self.bbox[3], group_bbox[3]),
+            )
+
+    @property
+    def node_only(self) -> bool:
+        return self.ways == 0 and self.relations == 0
+
+    def may_contain_node_ids(self, sorted_ids: Sequence[int]) -> bool:
+        """Return ``True`` when any id of ``sorted_ids`` lies in the block's node id range."""
+
+        if self.nodes == 0 or self.min_node_id is None or self.max_node_id is None:
+            return False
+        position = bisect.bisect_left(sorted_ids, self.min_node_id)
+        return position < len(sorted_ids) and sorted_ids[position] <= self.max_node_id
+
+    @classmethod
+    def from_dict(cls, payload: Dict[str, Any]) -> "BlockStats":
+        bbox = payload.get("bbox")
+        return cls(
+            nodes=int(payload.get("nodes", 0)),
+            ways=int(payload.get("ways", 0)),
+            relations=int(payload.get("relations", 0)),
+            min_node_id=payload.get("min_node_id"),
+            max_node_id=payload.get("max_node_id"),
+            bbox=tuple(bbox) if bbox is not None else None,
+        )
+
+
+BlockIndex = Dict[int, BlockStats]
+
+
+def block_index_path(filename: str) -> str:
+    return f"{filename}{BLOCK_INDEX_SUFFIX}"
+
+
+def file_signature(filename: str) -> Dict[str, int]:
+    """Return the size and modification time that identify ``filename``'s contents."""
+
+    stat = os.stat(filename)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_block_index(filename: str) -> Optional[BlockIndex]:
+    """Return the stored block index for ``filename`` when it is still valid."""
+
+    path = block_index_path(filename)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, "r", encoding="utf-8") as source:
+            payload = json.load(source)
+    except (OSError, ValueError):
+        logger.debug("Ignoring unreadable block index %s", path)
+        return None
+
+    if payload.get("version") != BLOCK_INDEX_VERSION:
+        return None
+    if payload.get("file") != file_signature(filename):
+        logger.debug("Block index %s is stale", path)
+        return None
+
+    return {
+        int(ofs): BlockStats.from_dict(stats)
+        for ofs, stats in payload.get("blocks", {}).items()
+    }
+
+
+def save_block_index(filename: str, index: BlockIndex) -> None:
+    """Persist ``index`` next to ``filename``; failures are logged and ignored."""
+
+    path = block_index_path(filename)
+    payload = {
+        "version": BLOCK_INDEX_VERSION,
+        "file": file_signature(filename),
+        "blocks": {str(ofs): asdict(stats) for ofs, stats in sorted(index.items())},
+    }
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, "w", encoding="utf-8") as target:
+            json.dump(payload, target)
+        os.replace(temp_path, path)
+    except OSError as exc:
+        logger.debug("Could not write block index %s: %s", path, exc)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+__all__ = [
+    "BlockIndex",
+    "BlockStats",
+    "block_index_path",
+    "file_signature",
+    "load_block_index",
+    "save_block_index",
+]
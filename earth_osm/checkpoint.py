@@ -0,0 +1,207 @@
+"""Checkpoints that let an interrupted export resume.
+
+An export with ``resume`` keeps its progress in one directory under
+``<data_dir>/checkpoints``, named after a hash of the export options:
+
+* every finished scan unit (a region, or a parent PBF fanned out to several
+  regions) stores the rows it produced in a spill file
+  (:mod:`earth_osm.spill`), so a rerun replays them instead of scanning the
+  PBF again;
+* while a unit is scanned, its pass-1 candidates (target nodes, target ways
+  and referenced node ids) and then the pass-2 result with the collected way
+  coordinates are saved as numpy arrays (``.npz``, tags as JSON), so a rerun
+  continues after the last pass that completed. They are loaded with
+  ``allow_pickle=False``: a file planted in the data directory cannot run
+  code.
+
+Scan checkpoints record the size and modification time of their PBF and are
+ignored once it changes. The directory is removed when the export finishes.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+from earth_osm.blockindex import file_signature
+from earth_osm.elementarrays import (
+    ARRAY_ERRORS,
+    dump_arrays,
+    json_array,
+    json_value,
+    load_arrays,
+    pack_nodes,
+    pack_ways,
+    unpack_nodes,
+    unpack_ways,
+)
+from earth_osm.spill import DEFAULT_SPILL_COMPRESSION, SpillWriter, iter_spill_records
+
+logger = logging.getLogger("eo.checkpoint")
+
+CHECKPOINT_VERSION = 2
+# Scan stages, in the order they complete.
+SCAN_STAGES = ("targets", "coordinates")
+
+# Spilled rows carry the feature they were matched for under this key.
+_FEATURE_KEY = "__feature__"
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def export_checkpoint_dir(data_dir: str, params: Dict[str, Any]) -> str:
+    """Return the checkpoint directory of the export described by ``params``."""
+
+    key = json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
+    return os.path.join(data_dir, "checkpoints", _digest(key))
+
+
+def _scan_path(checkpoint_dir: str, filename: str, label: str) -> str:
+    name = _digest(f"{os.path.basename(filename)}|{label}")
+    return os.path.join(checkpoint_dir, f"scan-{name}.npz")
+
+
+def load_scan_checkpoint(
+    checkpoint_dir: str,
+    filename: str,
+    label: str,
+) -> Tuple[Optional[str], Any]:
+    """Return ``(stage, data)`` saved for the scan of ``filename`` named ``label``.
+
+    ``stage`` is ``None`` when there is no valid checkpoint.
+    """
+
+    path = _scan_path(checkpoint_dir, filename, label)
+    if not os.path.exists(path):
+        return None, None
+    try:
+        with open(path, "rb") as source:
+            arrays = load_arrays(source.read())
+        meta = json_value(arrays["meta"])
+        if meta.get("version") != CHECKPOINT_VERSION or meta.get("file") != file_signature(
+            filename
+        ):
+            logger.info("Scan checkpoint %s is stale; scanning again", path)
+            return None, None
+        stage = meta["stage"]
+        target_nodes = {node.id: node for node in unpack_nodes("nodes", arrays)}
+        target_ways = unpack_ways("ways", arrays)
+        if stage == "targets":
+            data: Any = (target_nodes, target_ways, set(arrays["referenced"].tolist()))
+        else:
+            coordinate_nodes = dict(target_nodes)
+            coordinate_nodes.update((node.id, node) for node in unpack_nodes("extra", arrays))
+            data = (target_nodes, target_ways, coordinate_nodes)
+    except ARRAY_ERRORS as exc:
+        logger.warning("Ignoring unreadable scan checkpoint %s: %s", path, exc)
+        return None, None
+    return stage, data
+
+
+def save_scan_checkpoint(
+    checkpoint_dir: str, filename: str, label: str, stage: str, data: Any
+) -> None:
+    """Save the result of scan ``stage`` (one of :data:`SCAN_STAGES`).
+
+    ``data`` is ``(target_nodes, target_ways, referenced_node_ids)`` after the
+    ``targets`` stage and ``(target_nodes, target_ways, coordinate_nodes)``
+    after the ``coordinates`` stage.
+    """
+
+    if stage not in SCAN_STAGES:
+        raise ValueError(f"Unknown scan stage {stage!r}")
+    target_nodes, target_ways, extra = data
+    meta = {
+        "version": CHECKPOINT_VERSION,
+        "file": file_signature(filename),
+        "label": label,
+        "stage": stage,
+    }
+    arrays = {
+        "meta": json_array(meta),
+        **pack_nodes("nodes", target_nodes.values()),
+        **pack_ways("ways", target_ways),
+    }
+    if stage == "targets":
+        arrays["referenced"] = np.array(sorted(extra), dtype=np.int64)
+    else:
+        arrays.update(
+            pack_nodes(
+                "extra",
+                (node for node_id, node in extra.items() if node_id not in target_nodes),
+            )
+        )
+
+    path = _scan_path(checkpoint_dir, filename, label)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as target:
+        target.write(dump_arrays(arrays))
+    os.replace(temp_path, path)
+    logger.debug("Saved %s scan checkpoint %s", stage, path)
+
+
+class ExportCheckpoint:
+    """Rows of the finished scan units of one export, kept in ``directory``."""
+
+    def __init__(self, directory: str, compression: Optional[str] = DEFAULT_SPILL_COMPRESSION):
+        self.directory = directory
+        self.compression = compression
+        os.makedirs(directory, exist_ok=True)
+
+    def _unit_path(self, unit: str) -> str:
+        return os.path.join(self.directory, f"unit-{_digest(unit)}.bin")
+
+    def rows(
+        self,
+        unit: str,
+        produce: Callable[[], Iterable[Tuple[str, Dict[str, Any]]]],
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Yield the ``(feature, row)`` pairs of ``unit``.
+
+        A finished unit is replayed from its spill file. Otherwise the pairs
+        come from ``produce()`` and are spilled alongside; the unit counts as
+        finished once they are exhausted.
+        """
+
+        path = self._unit_path(unit)
+        if os.path.exists(path):
+            logger.info("Resuming: replaying %s from %s", unit, path)
+            for record in iter_spill_records(path):
+                yield record.pop(_FEATURE_KEY), record
+            return
+
+        spill = SpillWriter(self.directory, self.compression)
+        try:
+            for feature, row in produce():
+                spill.write({**row, _FEATURE_KEY: feature})
+                yield feature, row
+            spill.close()
+        except BaseException:
+            spill.remove()
+            raise
+        os.replace(spill.path, path)
+        logger.info("Checkpointed %s (%d rows)", unit, spill.rows)
+
+    def remove(self) -> None:
+        """Delete the checkpoints once the export completed."""
+
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+__all__ = [
+    "CHECKPOINT_VERSION",
+    "ExportCheckpoint",
+    "SCAN_STAGES",
+    "export_checkpoint_dir",
+    "load_scan_checkpoint",
+    "save_scan_checkpoint",
+]
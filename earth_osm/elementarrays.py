@@ -0,0 +1,130 @@
+"""Pickle-free numpy archives of OSM nodes and ways.
+
+Scan checkpoints (:mod:`earth_osm.checkpoint`) and the block result cache
+(:mod:`earth_osm.blockcache`) store elements as plain arrays: ids and
+coordinates as int64/float64 arrays, way refs as deltas and tags as JSON
+text. The arrays are written as a ``.npz`` archive and loaded with
+``allow_pickle=False``, so a file planted in the data directory cannot run
+code.
+"""
+
+from __future__ import annotations
+
+import io
+import json
+import zipfile
+from typing import Any, Dict, Iterable, List, Mapping
+
+import numpy as np
+
+from earth_osm.osmpbf import Node, Way
+
+# Errors raised by a damaged or foreign ``.npz`` payload.
+ARRAY_ERRORS = (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile)
+
+
+def json_array(value: Any) -> np.ndarray:
+    """Return ``value`` as JSON text in a uint8 array."""
+
+    text = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    return np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+
+
+def json_value(array: np.ndarray) -> Any:
+    """Return the value stored by :func:`json_array`."""
+
+    return json.loads(array.tobytes().decode("utf-8"))
+
+
+def pack_nodes(prefix: str, nodes: Iterable[Node]) -> Dict[str, np.ndarray]:
+    """Return the ids, coordinates and tags of ``nodes`` as arrays named ``<prefix>_*``."""
+
+    nodes = list(nodes)
+    return {
+        f"{prefix}_ids": np.fromiter(
+            (node.id for node in nodes), dtype=np.int64, count=len(nodes)
+        ),
+        f"{prefix}_lonlat": np.array(
+            [node.lonlat for node in nodes], dtype=np.float64
+        ).reshape(-1, 2),
+        f"{prefix}_tags": json_array([node.tags for node in nodes]),
+    }
+
+
+def unpack_nodes(prefix: str, arrays: Mapping[str, np.ndarray]) -> List[Node]:
+    """Return the nodes packed by :func:`pack_nodes` under ``prefix``."""
+
+    ids = arrays[f"{prefix}_ids"].tolist()
+    lonlats = arrays[f"{prefix}_lonlat"].tolist()
+    tags = json_value(arrays[f"{prefix}_tags"])
+    return [
+        Node(node_id, node_tags, (lon, lat))
+        for node_id, node_tags, (lon, lat) in zip(ids, tags, lonlats)
+    ]
+
+
+def pack_ways(prefix: str, ways: Iterable[Way]) -> Dict[str, np.ndarray]:
+    """Return the ids, refs and tags of ``ways`` as arrays named ``<prefix>_*``.
+
+    Way refs are stored as deltas, which compress far better than raw ids.
+    """
+
+    ways = list(ways)
+    refs = np.fromiter((ref for way in ways for ref in way.refs), dtype=np.int64)
+    return {
+        f"{prefix}_ids": np.fromiter(
+            (way.id for way in ways), dtype=np.int64, count=len(ways)
+        ),
+        f"{prefix}_counts": np.fromiter(
+            (len(way.refs) for way in ways), dtype=np.int64, count=len(ways)
+        ),
+        f"{prefix}_refs": np.diff(refs, prepend=0),
+        f"{prefix}_tags": json_array([way.tags for way in ways]),
+    }
+
+
+def unpack_ways(prefix: str, arrays: Mapping[str, np.ndarray]) -> List[Way]:
+    """Return the ways packed by :func:`pack_ways` under ``prefix``."""
+
+    refs = np.cumsum(arrays[f"{prefix}_refs"]).tolist()
+    tags = json_value(arrays[f"{prefix}_tags"])
+    ways = []
+    start = 0
+    for way_id, way_tags, count in zip(
+        arrays[f"{prefix}_ids"].tolist(), tags, arrays[f"{prefix}_counts"].tolist()
+    ):
+        end = start + count
+        ways.append(Way(way_id, way_tags, tuple(refs[start:end])))
+        start = end
+    return ways
+
+
+def dump_arrays(arrays: Mapping[str, np.ndarray]) -> bytes:
+    """Write ``arrays`` as a deflated ``.npz`` archive, refusing object arrays."""
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+        for name, array in arrays.items():
+            with archive.open(f"{name}.npy", "w") as member:
+                np.lib.format.write_array(member, array, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def load_arrays(data: bytes) -> Dict[str, np.ndarray]:
+    """Read the arrays written by :func:`dump_arrays`; never unpickles."""
+
+    with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+        return {name: arrays[name] for name in arrays.files}
+
+
+__all__ = [
+    "ARRAY_ERRORS",
+    "dump_arrays",
+    "json_array",
+    "json_value",
+    "load_arrays",
+    "pack_nodes",
+    "pack_ways",
+    "unpack_nodes",
+    "unpack_ways",
+]
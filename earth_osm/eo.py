@@ -8,37 +8,69 @@ This is the principal module of the earth_osm project.
 
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import Optional
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 import pandas as pd
-
-# suppress pandas warning about fragmented dataframes
-# TODO: do not suppress warnings
-import warnings
-
-warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
+from shapely.geometry.base import BaseGeometry
 
 from earth_osm.backends import fetch_region_backend
+from earth_osm.blockcache import BlockCache
+from earth_osm.checkpoint import ExportCheckpoint, export_checkpoint_dir
+from earth_osm.gfk_download import calculate_md5
 from earth_osm.tagdata import get_feature_list
 from earth_osm.regions import (
     expand_region_to_iso_children,
+    find_cached_parent_pbf,
     get_region_tuple,
     get_region_tuple_historical,
+    iter_region_ancestors,
+    local_pbf_path,
     view_regions,
 )
-from earth_osm.export import EarthOSMWriter
-from earth_osm.stream import stream_region_features_multi
+from earth_osm.export import EarthOSMWriter, _normalize_formats, convert_pd_to_gdf
+from earth_osm.frames import (
+    CATEGORY_COLUMNS,
+    DEFAULT_BATCH_SIZE,
+    FeatureFrameBuilder,
+    TagFrame,
+    build_feature_frame,
+    build_tag_frame,
+    iter_feature_batches,
+)
+from earth_osm.overpass import MAX_CONCURRENT_REQUESTS, OverpassScheduler
+from earth_osm.predicate import TagPredicate, compile_tag_filter
+from earth_osm.resultcache import ResultCache, pbf_checksum, result_key
+from earth_osm.tagstats import TagHistogram, TagStatsStore
+from earth_osm.spatial import SpatialFilter, make_spatial_filter
+from earth_osm.stream import (
+    FeatureRow,
+    iter_pbf_feature_rows,
+    resolve_region_pbf,
+    stream_region_features_multi,
+    stream_regions_from_parent,
+)
 
 logger = logging.getLogger("eo.eo")
 logger.setLevel(logging.INFO)
 
+# Which region's copy of a feature found in several regions is kept.
+DEDUP_RULES = ("first", "last")
+
 
 def _rows_to_dataframe(row_iter):
-    rows = list(row_iter)
-    df_feature = pd.DataFrame(rows)
-    df_feature.dropna(axis=1, how="all", inplace=True)
-    return df_feature
+    return build_feature_frame(row_iter)
 
 
 def _fetch_overpass_region(
@@ -51,47 +83,176 @@ def _fetch_overpass_region(
     data_dir,
     progress_bar,
     cache_primary,
+    overpass_slots=None,
 ):
+    """Fetch ``region`` from Overpass, querying its ISO children concurrently.
+
+    At most ``overpass_slots`` queries are in flight; they share the server's
+    slot status and rate limit pauses (see
+    :class:`~earth_osm.overpass.OverpassScheduler`). Children are converted
+    to frames as their answers arrive and concatenated in their listed order.
+    """
+
     expanded_regions = expand_region_to_iso_children(region, require_iso=True)
     child_regions = [child for child in expanded_regions if child.id != region.id]
+    scheduler = OverpassScheduler(overpass_slots or MAX_CONCURRENT_REQUESTS)
 
-    if child_regions:
-        frames = []
-        for child_region in child_regions:
-            result_kind, payload = fetch_region_backend(
-                child_region,
-                primary_name,
-                feature_name,
-                data_source="overpass",
-                use_stream=False,
-                mp=mp,
-                update=update,
-                data_dir=data_dir,
-                progress_bar=progress_bar,
-                cache_primary=cache_primary,
-            )
-            frame = payload if result_kind == "dataframe" else _rows_to_dataframe(payload)
-            if isinstance(frame, pd.DataFrame) and not frame.empty:
-                frames.append(frame)
+    def fetch(target_region: Any) -> pd.DataFrame:
+        result_kind, payload = fetch_region_backend(
+            target_region,
+            primary_name,
+            feature_name,
+            data_source="overpass",
+            use_stream=False,
+            mp=mp,
+            update=update,
+            data_dir=data_dir,
+            progress_bar=progress_bar,
+            cache_primary=cache_primary,
+            overpass_scheduler=scheduler,
+        )
+        return payload if result_kind == "dataframe" else _rows_to_dataframe(payload)
 
-        if not frames:
-            return pd.DataFrame()
+    if not child_regions:
+        return fetch(region)
 
-        return pd.concat(frames, ignore_index=True)
+    frames = {}
+    with ThreadPoolExecutor(
+        max_workers=min(scheduler.max_concurrent, len(child_regions)),
+        thread_name_prefix="eo-overpass",
+    ) as executor:
+        futures = {
+            executor.submit(fetch, child): index for index, child in enumerate(child_regions)
+        }
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                frame = future.result()
+                if isinstance(frame, pd.DataFrame) and not frame.empty:
+                    frames[futures[future]] = frame
+                logger.info(
+                    "Overpass %s: fetched %d of %d child regions",
+                    region.short,
+                    done,
+                    len(child_regions),
+                )
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
 
-    result_kind, payload = fetch_region_backend(
-        region,
-        primary_name,
-        feature_name,
-        data_source="overpass",
-        use_stream=False,
-        mp=mp,
-        update=update,
-        data_dir=data_dir,
-        progress_bar=progress_bar,
-        cache_primary=cache_primary,
-    )
-    return payload if result_kind == "dataframe" else _rows_to_dataframe(payload)
+    if not frames:
+        return pd.DataFrame()
+
+    df_feature = pd.concat([frames[index] for index in sorted(frames)], ignore_index=True)
+    # children have their own Region categories, which concat turns into objects
+    for column in CATEGORY_COLUMNS:
+        if column in df_feature.columns:
+            df_feature[column] = df_feature[column].astype("category")
+    return df_feature
+
+
+def _plan_fanout_groups(
+    region_tuple_list: List[Any],
+    data_dir: str,
+    *,
+    parent_region: Optional[str],
+    from_parent: bool,
+    update: bool,
+) -> Tuple[List[Tuple[Any, List[Any]]], List[Any]]:
+    """Split regions into single-scan groups sharing a parent PBF and the rest.
+
+    Returns a list of ``(parent, regions)`` groups and the list of regions that
+    are processed on their own.
+    """
+
+    groups: Dict[str, Tuple[Any, List[Any]]] = {}
+    remaining: List[Any] = []
+
+    if parent_region is not None:
+        parent = get_region_tuple(parent_region)
+        for region in region_tuple_list:
+            ancestors = {ancestor.id for ancestor in iter_region_ancestors(region)}
+            if getattr(region, "target_date", None) is None and parent.id in ancestors:
+                groups.setdefault(parent.id, (parent, []))[1].append(region)
+            else:
+                logger.warning(
+                    "Region %s is not covered by %s; processing it separately",
+                    region.short,
+                    parent.id,
+                )
+                remaining.append(region)
+        return list(groups.values()), remaining
+
+    for region in region_tuple_list:
+        cached = None
+        if from_parent and not update and not os.path.exists(local_pbf_path(region, data_dir)):
+            cached = find_cached_parent_pbf(region, data_dir)
+        if cached is None:
+            remaining.append(region)
+            continue
+        parent, _ = cached
+        groups.setdefault(parent.id, (parent, []))[1].append(region)
+
+    return list(groups.values()), remaining
+
+
+def _save_tag_stats(
+    tag_stats: TagStatsStore,
+    primary_name: str,
+    sources: List[Tuple[str, str]],
+    histograms: Dict[Any, TagHistogram],
+    pbfs: Dict[str, str],
+) -> None:
+    """Persist the histograms of every source of a completed export.
+
+    Sources without rows are stored as empty histograms so that later
+    ``single_pass`` runs know they contribute nothing. ``pbfs`` maps each
+    region to the checksum of the PBF it was scanned from.
+    """
+
+    by_region: Dict[str, Dict[str, TagHistogram]] = {}
+    for region, feature_name in sources:
+        histogram = histograms.get((region, feature_name)) or TagHistogram()
+        by_region.setdefault(region, {})[feature_name] = histogram
+    for region, region_histograms in by_region.items():
+        if region in pbfs:
+            tag_stats.save(region, primary_name, region_histograms, pbfs[region])
+
+
+def _region_pbf_checksums(
+    direct_regions: List[Any], fanout_groups: List[Tuple[Any, List[Any]]], data_dir: str
+) -> Dict[str, str]:
+    """Checksums of the PBFs the regions are scanned from, for the cached PBFs."""
+
+    paths = {region.short: local_pbf_path(region, data_dir) for region in direct_regions}
+    for parent, group_regions in fanout_groups:
+        parent_path = local_pbf_path(parent, data_dir)
+        paths.update((region.short, parent_path) for region in group_regions)
+
+    checksums = {
+        path: pbf_checksum(path) for path in set(paths.values()) if os.path.exists(path)
+    }
+    return {region: checksums[path] for region, path in paths.items() if path in checksums}
+
+
+def _local_pbf_checksums(
+    direct_regions: List[Any], fanout_groups: List[Tuple[Any, List[Any]]], data_dir: str
+) -> Optional[Dict[str, str]]:
+    """Checksums of the PBFs an export scans, or ``None`` if one is not cached."""
+
+    paths = [local_pbf_path(region, data_dir) for region in direct_regions]
+    paths.extend(local_pbf_path(parent, data_dir) for parent, _ in fanout_groups)
+    if not all(os.path.exists(path) for path in paths):
+        return None
+    return {os.path.basename(path): pbf_checksum(path) for path in paths}
+
+
+def _polygon_key(polygon: Any) -> Any:
+    if polygon is None:
+        return None
+    if isinstance(polygon, (str, os.PathLike)) and os.path.isfile(polygon):
+        return {"file": calculate_md5(polygon)}
+    return getattr(polygon, "wkt", str(polygon))
 
 
 def process_region(
@@ -105,15 +266,31 @@ def process_region(
     data_source="geofabrik",
     stream=False,
     cache_primary=False,
+    from_parent=False,
+    spatial=None,
+    tag_filter=None,
+    checkpoint_dir=None,
+    block_cache=None,
+    overpass_slots=None,
 ):
     """Process a single region for a feature.
 
     When ``stream`` is ``True`` and the geofabrik backend is used the function
     returns an iterator of flattened feature dictionaries. Otherwise it returns
-    a :class:`pandas.DataFrame` to preserve the historic API.
+    a :class:`pandas.DataFrame` to preserve the historic API. ``spatial`` is an
+    optional :class:`~earth_osm.spatial.SpatialFilter` and ``tag_filter`` an
+    optional :class:`~earth_osm.predicate.TagPredicate`, both applied while
+    scanning. ``checkpoint_dir`` keeps the scan passes for a resumed run, see
+    :mod:`earth_osm.checkpoint`, and ``block_cache`` reuses per-block scan
+    results, see :mod:`earth_osm.blockcache`. ``overpass_slots`` bounds the
+    concurrent Overpass queries of a region split into ISO children.
     """
 
     if data_source == "overpass":
+        if spatial is not None or tag_filter is not None:
+            raise ValueError(
+                "Spatial and tag filters are not supported for the Overpass backend."
+            )
         if stream:
             raise ValueError("Streaming export is not supported for the Overpass backend.")
         return _fetch_overpass_region(
@@ -125,6 +302,7 @@ def process_region(
             data_dir=data_dir,
             progress_bar=progress_bar,
             cache_primary=cache_primary,
+            overpass_slots=overpass_slots,
         )
 
     use_stream = stream and data_source == "geofabrik"
@@ -139,6 +317,11 @@ def process_region(
         data_dir=data_dir,
         progress_bar=progress_bar,
         cache_primary=cache_primary,
+        from_parent=from_parent,
+        spatial=spatial,
+        tag_filter=tag_filter,
+        checkpoint_dir=checkpoint_dir,
+        block_cache=block_cache,
     )
 
     if stream:
@@ -161,7 +344,40 @@ def get_osm_data(
         progress_bar=True,
         target_date: Optional[datetime] = None,
         data_source="geofabrik",
+        bbox=None,
+        polygon=None,
+        tag_filter=None,
+        as_geodataframe=False,
+        tag_layout="wide",
+        tag_columns=(),
+        as_arrow=False,
 ):
+    """Return the ``primary_name=feature_name`` features of one region.
+
+    With ``as_geodataframe=True`` the ``lonlat`` column is replaced by a
+    ``geometry`` column (EPSG:4326) built with shapely's vectorised
+    constructors, and a :class:`geopandas.GeoDataFrame` is returned.
+
+    ``tag_layout="wide"`` spreads every tag into its own ``tags.<key>``
+    column. ``tag_layout="long"`` returns a :class:`~earth_osm.frames.TagFrame`
+    instead: the features with only the ``tag_columns`` keys as columns, and
+    the other tags in a dictionary-encoded ``(feature, key, value)`` table.
+    This is far smaller for tag-rich selections such as ``ALL_building``.
+
+    ``as_arrow=True`` returns a :class:`pyarrow.Table` instead, with a
+    GeoArrow ``geometry`` column and the tags in one ``map<string, string>``
+    column (see :meth:`~earth_osm.frames.FeatureFrameBuilder.build_geoarrow`).
+    Polars, DuckDB and GeoPandas can consume it without conversion.
+    """
+
+    if tag_layout not in ("wide", "long"):
+        raise ValueError(f"Unsupported tag_layout {tag_layout!r}; choose 'wide' or 'long'")
+    if tag_columns and tag_layout != "long":
+        raise ValueError("tag_columns requires tag_layout='long'")
+    if as_arrow and (as_geodataframe or tag_layout != "wide"):
+        raise ValueError(
+            "as_arrow cannot be combined with as_geodataframe or tag_layout='long'"
+        )
 
     if target_date:
         region_tuple = get_region_tuple_historical(region_str, target_date)
@@ -173,6 +389,27 @@ def get_osm_data(
 
     data_dir = os.path.join(os.getcwd(), "earth_data") if data_dir is None else data_dir
 
+    spatial = make_spatial_filter(bbox, polygon)
+    tag_filter = compile_tag_filter(tag_filter)
+    if as_arrow and data_source == "geofabrik":
+        features = _iter_region_features(
+            region_tuple,
+            primary_name,
+            feature_name,
+            data_dir,
+            update,
+            progress_bar,
+            spatial,
+            tag_filter,
+        )
+        return FeatureFrameBuilder().extend_features(features).build_geoarrow()
+
+    use_stream = spatial is not None or tag_filter is not None
+    long_tags = tag_layout == "long"
+    if long_tags and data_source == "geofabrik":
+        # Build straight from the rows rather than from a wide frame.
+        use_stream = True
+
     df = process_region(
         region_tuple,
         primary_name,
@@ -182,17 +419,108 @@ def get_osm_data(
         data_dir,
         progress_bar=progress_bar,
         data_source=data_source,
+        stream=use_stream,
+        spatial=spatial,
+        tag_filter=tag_filter,
     )
+    if long_tags:
+        rows = df if use_stream else df.to_dict(orient="records")
+        frame = build_tag_frame(rows, tag_columns)
+        if as_geodataframe:
+            frame = TagFrame(convert_pd_to_gdf(frame.features), frame.tags)
+        return frame
+    if as_arrow:
+        rows = df if use_stream else df.to_dict(orient="records")
+        return FeatureFrameBuilder().extend(rows).build_geoarrow()
+    if use_stream:
+        df = _rows_to_dataframe(df)
+    if as_geodataframe:
+        return convert_pd_to_gdf(df)
 
     return df
 
+
+def _iter_region_features(
+    region_tuple: Any,
+    primary_name: str,
+    feature_name: Union[str, Sequence[str]],
+    data_dir: str,
+    update: bool,
+    progress_bar: bool,
+    spatial: Optional[SpatialFilter],
+    tag_filter: Union[None, str, TagPredicate],
+) -> Iterator[FeatureRow]:
+    """Yield the :class:`~earth_osm.stream.FeatureRow` objects of a Geofabrik region."""
+
+    filename, spatial = resolve_region_pbf(
+        region_tuple,
+        update,
+        data_dir,
+        progress_bar=progress_bar,
+        spatial=spatial,
+    )
+    yield from iter_pbf_feature_rows(
+        filename,
+        primary_name,
+        feature_name,
+        region_tuple.short,
+        multiprocess=True,
+        spatial=spatial,
+        tag_filter=tag_filter,
+    )
+
+
+def iter_osm_batches(
+        region_str: str,
+        primary_name: str,
+        feature_name: Union[str, Sequence[str]],
+        data_dir: Optional[str] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        as_arrow: bool = False,
+        cached: bool = True,
+        progress_bar: bool = True,
+        target_date: Optional[datetime] = None,
+        bbox: Optional[Sequence[float]] = None,
+        polygon: Optional[Union[str, BaseGeometry]] = None,
+        tag_filter: Union[None, str, TagPredicate] = None,
+) -> Iterator[Any]:
+    """Yield the features of one region in batches of up to ``batch_size`` rows.
+
+    Batches are DataFrames shaped like :func:`get_osm_data` results, or
+    :class:`pyarrow.RecordBatch` objects with ``as_arrow=True``. Features are
+    streamed from the region's Geofabrik PBF and appended straight into
+    columnar buffers, so only one batch of output is held at a time.
+    ``feature_name`` may be a list; the features are then collected in one
+    scan and an element matching several of them is yielded once. Each batch
+    only has the tag columns its own features use.
+    """
+
+    if target_date:
+        region_tuple = get_region_tuple_historical(region_str, target_date)
+    else:
+        region_tuple = get_region_tuple(region_str)
+
+    data_dir = os.path.join(os.getcwd(), "earth_data") if data_dir is None else data_dir
+
+    features = _iter_region_features(
+        region_tuple,
+        primary_name,
+        feature_name,
+        data_dir,
+        not cached,
+        progress_bar,
+        make_spatial_filter(bbox, polygon),
+        compile_tag_filter(tag_filter),
+    )
+    yield from iter_feature_batches(features, batch_size, as_arrow)
+
 # TODO: Plan
 # Use an intermediary super efficient file format such as parquet
 # save a region,feauture pair in temp files
 # implement planetary file from osm (https://planet.openstreetmap.org/)
 # read keys, values, tags and their frequencies from taginfo api (https://taginfo.openstreetmap.org/taginfo/apidoc)
 # use **kwargs and allow for dropping of refs column
-# implement post processing functions: i) create_geojson 2) filter_by_bbox
+# implement post processing functions: i) create_geojson
 
 
 def save_osm_data(
@@ -210,6 +538,26 @@ def save_osm_data(
     stream_backend=True,
     cache_primary=False,
     target_date: Optional[datetime] = None,
+    from_parent=False,
+    parent_region=None,
+    bbox=None,
+    polygon=None,
+    tag_filter=None,
+    spill_dir=None,
+    spill_compression="zlib",
+    single_pass=False,
+    gpkg_path=None,
+    gpkg_table=None,
+    shards=1,
+    shard_by="id",
+    max_part_rows=None,
+    spatial_order=None,
+    feature_store=None,
+    dedup=None,
+    result_cache=False,
+    resume=False,
+    block_cache=None,
+    overpass_slots=None,
 ):
     """
     Get OSM Data for a list of regions and features
@@ -218,11 +566,83 @@ def save_osm_data(
         primary_name: primary feature to get data for
         feature_list: list of features to get data for
         update: update data
-        mp: use multiprocessing
+        mp: use multiprocessing (also finalizes the outputs in parallel)
         stream_backend: when ``True`` (default) use the streaming pipeline for
             GeoFabrik sources; set to ``False`` to revert to the legacy
             in-memory pipeline (primarily for benchmarking)
         target_date: optional target date for historical data
+        from_parent: when ``True`` regions without a cached PBF are cut out of
+            a cached ancestor PBF (continent, parent region or planet) in
+            ``data_dir`` instead of being downloaded (streaming backend only).
+            Regions sharing the same cached ancestor are extracted from a
+            single scan of it.
+        parent_region: optional region id (e.g. ``africa``) whose PBF is scanned
+            once and fanned out to every region of ``region_list`` it covers,
+            instead of downloading and scanning each region separately
+        bbox: optional ``(min_lon, min_lat, max_lon, max_lat)`` box; only
+            nodes inside it and ways with a vertex inside it are exported
+            (streaming backend only)
+        polygon: optional polygon restricting the export like ``bbox``; a
+            shapely geometry, a WKT string or a path to a vector file
+        tag_filter: optional tag predicate expression such as
+            ``"voltage>=110000 & !location=underground"`` that features must
+            satisfy in addition to the primary/feature selection (streaming
+            backend only, see :mod:`earth_osm.predicate`)
+        spill_dir: directory for the temporary spill files of the csv/geojson
+            writers (defaults to the system temp directory)
+        spill_compression: codec for the spill files (``"zlib"``, ``"bz2"``,
+            ``"lzma"`` or ``None`` for uncompressed)
+        single_pass: plan the csv/geojson columns from the tag statistics
+            recorded by earlier runs in ``data_dir/tagstats`` and write rows
+            straight to the outputs without a spill file. Outputs whose
+            sources have no statistics for their current PBFs, or runs with
+            ``update``, fall back to the two-pass writer (geofabrik streaming
+            backend without bbox/polygon/tag filters).
+        gpkg_path: with ``"gpkg"`` in ``out_format``, write every output as a
+            table of this one GeoPackage (relative to ``out_dir/out``) instead
+            of one ``.gpkg`` file per output
+        gpkg_table: append all outputs to this single table of ``gpkg_path``
+        shards: split every output into this many shards, routed by
+            ``shard_by`` (``"id"`` hash or spatial ``"cell"``)
+        shard_by: shard routing key, ``"id"`` or ``"cell"``
+        max_part_rows: start a new part file of a shard every this many rows.
+            Sharded outputs come with a ``<name>.manifest.json`` listing the
+            parts, their row counts and bounding boxes
+        spatial_order: write rows sorted along a ``"hilbert"`` or ``"zorder"``
+            curve by the centre of their bounding box instead of in id order
+            (all formats are then spilled and sorted externally)
+        feature_store: also upsert the exported rows into this SQLite feature
+            store (relative to ``out_dir/out``, see :mod:`earth_osm.store`).
+            Reruns only rewrite changed features and delete the ones no
+            longer exported for the regions and features of the run
+        dedup: write every element at most once per output, so aggregated
+            outputs do not repeat features found in several regions (e.g.
+            border lines). ``"first"`` keeps the copy, and ``Region`` label,
+            of the region listed first in ``region_list``, ``"last"`` the one
+            listed last. Regions cut out of a shared parent extract
+            (``parent_region``/``from_parent``) are scanned after the other
+            regions, so their copies are only kept when no other region has one
+        result_cache: skip the export when an earlier run with the same PBFs
+            (by MD5), earth_osm version and output options already wrote
+            the outputs and they are unchanged; outputs cached for another
+            ``out_dir`` are copied. Entries live in ``data_dir/results``. Only
+            for geofabrik exports without ``target_date`` or ``feature_store``;
+            runs with ``update`` always export and refresh the entry
+        resume: checkpoint the export in ``data_dir/checkpoints`` and continue
+            an interrupted run of the same export: regions (or parent scans)
+            that finished are replayed from their checkpoint, and a scan cut
+            short resumes after its last completed pass. Finished regions are
+            not downloaded again. The checkpoints are removed on success
+        block_cache: size in MiB of a cache in ``data_dir/blockcache`` keeping
+            the candidates each PBF block yielded to a scan. Later scans of
+            the same PBF with the same filter skip decompressing the blocks,
+            and scans with a narrower feature list or tag filter filter the
+            cached candidates; the least recently used blocks are evicted
+            beyond the size. Only for the geofabrik streaming backend
+        overpass_slots: number of concurrent Overpass queries when a region
+            is fetched as its ISO children (default
+            ``MAX_CONCURRENT_REQUESTS``). Queries also wait for a free slot
+            on the server and pause together on ``Retry-After``
     returns:
         dict of dataframes
     """
@@ -233,6 +653,22 @@ def save_osm_data(
 
     region_short_list = [r.short for r in region_tuple_list]
 
+    if dedup is not None and dedup not in DEDUP_RULES:
+        raise ValueError(f"Unsupported dedup {dedup!r}; choose from {list(DEDUP_RULES)}")
+    if block_cache is not None and block_cache <= 0:
+        raise ValueError("block_cache must be a positive size in MiB")
+    if overpass_slots is not None and overpass_slots < 1:
+        raise ValueError("overpass_slots must be at least 1")
+
+    spatial = make_spatial_filter(bbox, polygon)
+    tag_filter = compile_tag_filter(tag_filter)
+    if (spatial is not None or tag_filter is not None) and not (
+        data_source == "geofabrik" and stream_backend
+    ):
+        raise ValueError(
+            "bbox/polygon and tag filters require the geofabrik streaming backend"
+        )
+
     if feature_list is None:
         feature_list = get_feature_list(primary_name)
     elif feature_list == ["ALL"]:
@@ -247,7 +683,7 @@ def save_osm_data(
         and len(feature_list) > 1
     )
 
-    def iter_feature_rows(region_obj, feature_name_obj):
+    def scan_feature_rows(region_obj: Any, feature_name_obj: str) -> Iterable[Dict[str, Any]]:
         if data_source == "geofabrik" and stream_backend:
             return process_region(
                 region_obj,
@@ -260,6 +696,11 @@ def save_osm_data(
                 data_source=data_source,
                 stream=True,
                 cache_primary=cache_primary,
+                from_parent=from_parent,
+                spatial=spatial,
+                tag_filter=tag_filter,
+                checkpoint_dir=checkpoint_dir,
+                block_cache=block_results,
             )
 
         df_feature = process_region(
@@ -273,88 +714,314 @@ def save_osm_data(
             data_source=data_source,
             stream=False,
             cache_primary=cache_primary,
+            overpass_slots=overpass_slots,
         )
         return df_feature.to_dict("records")
 
-    with EarthOSMWriter(primary_name, out_dir, out_format) as writer:
+    def iter_feature_rows(region_obj: Any, feature_name_obj: str) -> Iterable[Dict[str, Any]]:
+        if checkpoint is None:
+            return scan_feature_rows(region_obj, feature_name_obj)
+        pairs = checkpoint.rows(
+            f"{region_obj.short}/{feature_name_obj}",
+            lambda: (
+                (feature_name_obj, row)
+                for row in scan_feature_rows(region_obj, feature_name_obj)
+            ),
+        )
+        return (row for _, row in pairs)
+
+    def iter_region_rows(region_obj: Any) -> Iterable[Tuple[str, Dict[str, Any]]]:
+        def scan() -> Iterator[Tuple[str, Dict[str, Any]]]:
+            return stream_region_features_multi(
+                region_obj,
+                primary_name,
+                feature_list,
+                data_dir,
+                update=update,
+                progress_bar=progress_bar,
+                multiprocess=mp,
+                data_source=data_source,
+                from_parent=from_parent,
+                spatial=spatial,
+                tag_filter=tag_filter,
+                checkpoint_dir=checkpoint_dir,
+                block_cache=block_results,
+            )
+
+        if checkpoint is None:
+            return scan()
+        return checkpoint.rows(f"{region_obj.short}/*", scan)
+
+    def iter_parent_rows(
+        parent: Any, group_regions: List[Any]
+    ) -> Iterable[Tuple[str, str, Dict[str, Any]]]:
+        def scan() -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+            return stream_regions_from_parent(
+                parent,
+                group_regions,
+                primary_name,
+                feature_list,
+                data_dir,
+                update=update,
+                progress_bar=progress_bar,
+                multiprocess=mp,
+                spatial=spatial,
+                tag_filter=tag_filter,
+                checkpoint_dir=checkpoint_dir,
+                block_cache=block_results,
+            )
+
+        if checkpoint is None:
+            return scan()
+        unit = f"{parent.id}>{','.join(region.short for region in group_regions)}"
+        pairs = checkpoint.rows(unit, lambda: ((feature, row) for _, feature, row in scan()))
+        return ((row["Region"], feature, row) for feature, row in pairs)
+
+    fanout_groups: List[Tuple[Any, List[Any]]] = []
+    direct_regions = list(region_tuple_list)
+    if data_source == "geofabrik" and stream_backend and (from_parent or parent_region):
+        fanout_groups, direct_regions = _plan_fanout_groups(
+            region_tuple_list,
+            data_dir,
+            parent_region=parent_region,
+            from_parent=from_parent,
+            update=update,
+        )
+    direct_ids = {id(region) for region in direct_regions}
+    region_labels = {
+        region.short: label for region, label in zip(region_tuple_list, region_list)
+    }
+    direct_pairs = [
+        (region, label)
+        for region, label in zip(region_tuple_list, region_list)
+        if id(region) in direct_ids
+    ]
+    if dedup == "last":
+        # The writer keeps the first copy of an element, so scan in reverse.
+        direct_regions.reverse()
+        direct_pairs.reverse()
+        fanout_groups = [(parent, group[::-1]) for parent, group in reversed(fanout_groups)]
+
+    # Options that shape the outputs; keys the result cache and the checkpoints.
+    export_params = {
+        "regions": list(region_list),
+        "primary_name": primary_name,
+        "feature_list": list(feature_list),
+        "data_source": data_source,
+        "target_date": target_date,
+        "out_format": sorted(_normalize_formats(out_format)),
+        "out_aggregate": out_aggregate,
+        "stream_backend": stream_backend,
+        "cache_primary": cache_primary,
+        "from_parent": from_parent,
+        "parent_region": parent_region,
+        "bbox": None if bbox is None else list(bbox),
+        "polygon": _polygon_key(polygon),
+        "tag_filter": None if tag_filter is None else str(tag_filter),
+        "single_pass": single_pass,
+        "gpkg_path": gpkg_path,
+        "gpkg_table": gpkg_table,
+        "shards": shards,
+        "shard_by": shard_by,
+        "max_part_rows": max_part_rows,
+        "spatial_order": spatial_order,
+        "dedup": dedup,
+    }
+
+    results = None
+    if result_cache:
+        if data_source != "geofabrik" or target_date or feature_store is not None:
+            logger.info(
+                "result_cache needs geofabrik PBFs without target_date or feature_store; "
+                "ignoring it"
+            )
+        else:
+            results = ResultCache(os.path.join(data_dir, "results"))
+            checksums = None
+            if not update:
+                checksums = _local_pbf_checksums(direct_regions, fanout_groups, data_dir)
+            if checksums is not None:
+                restored = results.restore(
+                    result_key(export_params, checksums), os.path.join(out_dir, "out")
+                )
+                if restored is not None:
+                    logger.info(
+                        "Outputs are up to date with the cached PBFs (%d files)", len(restored)
+                    )
+                    return
+
+    checkpoint = checkpoint_dir = None
+    if resume:
+        checkpoint = ExportCheckpoint(
+            export_checkpoint_dir(data_dir, export_params), spill_compression
+        )
+        checkpoint_dir = checkpoint.directory
+        logger.info("Checkpointing the export to %s", checkpoint_dir)
+
+    block_results = None
+    if block_cache is not None:
+        if data_source == "geofabrik" and stream_backend and not cache_primary:
+            block_results = BlockCache(
+                os.path.join(data_dir, "blockcache"), int(block_cache) << 20
+            )
+        else:
+            logger.info("block_cache needs the geofabrik streaming backend; ignoring it")
+
+    tag_stats = None
+    unfiltered = spatial is None and tag_filter is None
+    if data_source == "geofabrik" and stream_backend and unfiltered:
+        tag_stats = TagStatsStore(os.path.join(data_dir, "tagstats"))
+    elif single_pass:
+        logger.info(
+            "single_pass needs unfiltered geofabrik streaming; using the two-pass writer"
+        )
+    target_sources: List[Tuple[str, str]] = []
+    # PBFs about to be scanned; an update may replace them, so plan nothing then.
+    planned_pbfs: Dict[str, str] = {}
+    if single_pass and tag_stats is not None and not update:
+        planned_pbfs = _region_pbf_checksums(direct_regions, fanout_groups, data_dir)
+
+    def prepare_target(
+        target_regions: List[str], target_features: List[str], source_regions: List[str]
+    ) -> None:
+        sources = [
+            (region, feature) for region in source_regions for feature in target_features
+        ]
+        target_sources.extend(sources)
+        column_plan = None
+        if single_pass and tag_stats is not None:
+            column_plan = tag_stats.plan(primary_name, sources, planned_pbfs)
+            if column_plan is None:
+                logger.info(
+                    "No tag statistics for the current PBFs of %s; using the two-pass writer",
+                    ", ".join(target_regions),
+                )
+        writer.prepare_target(target_regions, target_features, column_plan, sources)
+
+    def target_for(region_short: str, feature_name: str) -> Tuple[List[str], List[str]]:
+        if out_aggregate == "region" or out_aggregate is True:
+            return region_short_list, [feature_name]
+        if out_aggregate == "feature":
+            return [region_short], feature_list
+        return [region_labels[region_short]], [feature_name]
+
+    with EarthOSMWriter(
+        primary_name,
+        out_dir,
+        out_format,
+        spill_dir=spill_dir,
+        spill_compression=spill_compression,
+        finalize_workers=None if mp else 1,
+        gpkg_path=gpkg_path,
+        gpkg_table=gpkg_table,
+        shards=shards,
+        shard_by=shard_by,
+        max_part_rows=max_part_rows,
+        spatial_order=spatial_order,
+        feature_store=feature_store,
+        deduplicate=dedup is not None,
+    ) as writer:
         if out_aggregate == "region" or out_aggregate is True:
             for feature_name in feature_list:
-                writer.prepare_target(region_short_list, [feature_name])
+                prepare_target(region_short_list, [feature_name], region_short_list)
 
             if multi_feature_streaming:
-                for region in region_tuple_list:
-                    for matched_feature, row in stream_region_features_multi(
-                        region,
-                        primary_name,
-                        feature_list,
-                        data_dir,
-                        update=update,
-                        progress_bar=progress_bar,
-                        multiprocess=mp,
-                        data_source=data_source,
-                    ):
-                        writer.write(region_short_list, [matched_feature], [row])
+                for region in direct_regions:
+                    for matched_feature, row in iter_region_rows(region):
+                        writer.write(
+                            region_short_list,
+                            [matched_feature],
+                            [row],
+                            source=(region.short, matched_feature),
+                        )
             else:
                 for feature_name in feature_list:
-                    for region in region_tuple_list:
+                    for region in direct_regions:
                         writer.write(
                             region_short_list,
                             [feature_name],
                             iter_feature_rows(region, feature_name),
+                            source=(region.short, feature_name),
                         )
 
         elif out_aggregate == "feature":
             for region in region_tuple_list:
-                writer.prepare_target([region.short], feature_list)
+                prepare_target([region.short], feature_list, [region.short])
 
             if multi_feature_streaming:
-                for region in region_tuple_list:
-                    for _, row in stream_region_features_multi(
-                        region,
-                        primary_name,
-                        feature_list,
-                        data_dir,
-                        update=update,
-                        progress_bar=progress_bar,
-                        multiprocess=mp,
-                        data_source=data_source,
-                    ):
-                        writer.write([region.short], feature_list, [row])
+                for region in direct_regions:
+                    for matched_feature, row in iter_region_rows(region):
+                        writer.write(
+                            [region.short],
+                            feature_list,
+                            [row],
+                            source=(region.short, matched_feature),
+                        )
             else:
-                for region in region_tuple_list:
+                for region in direct_regions:
                     for feature_name in feature_list:
                         writer.write(
                             [region.short],
                             feature_list,
                             iter_feature_rows(region, feature_name),
+                            source=(region.short, feature_name),
                         )
 
         elif out_aggregate is False:
-            for region_label in region_list:
+            for region, region_label in zip(region_tuple_list, region_list):
                 for feature_name in feature_list:
-                    writer.prepare_target([region_label], [feature_name])
+                    prepare_target([region_label], [feature_name], [region.short])
 
             if multi_feature_streaming:
-                for region, region_label in zip(region_tuple_list, region_list):
-                    for matched_feature, row in stream_region_features_multi(
-                        region,
-                        primary_name,
-                        feature_list,
-                        data_dir,
-                        update=update,
-                        progress_bar=progress_bar,
-                        multiprocess=mp,
-                        data_source=data_source,
-                    ):
-                        writer.write([region_label], [matched_feature], [row])
+                for region, region_label in direct_pairs:
+                    for matched_feature, row in iter_region_rows(region):
+                        writer.write(
+                            [region_label],
+                            [matched_feature],
+                            [row],
+                            source=(region.short, matched_feature),
+                        )
             else:
-                for region, region_label in zip(region_tuple_list, region_list):
+                for region, region_label in direct_pairs:
                     for feature_name in feature_list:
                         writer.write(
                             [region_label],
                             [feature_name],
                             iter_feature_rows(region, feature_name),
+                            source=(region.short, feature_name),
                         )
+        else:
+            fanout_groups = []
+
+        for parent, group_regions in fanout_groups:
+            for region_short, matched_feature, row in iter_parent_rows(parent, group_regions):
+                writer.write(
+                    *target_for(region_short, matched_feature),
+                    [row],
+                    source=(region_short, matched_feature),
+                )
+
+    if tag_stats is not None:
+        _save_tag_stats(
+            tag_stats,
+            primary_name,
+            target_sources,
+            writer.source_histograms,
+            _region_pbf_checksums(direct_regions, fanout_groups, data_dir),
+        )
+
+    if results is not None:
+        checksums = _local_pbf_checksums(direct_regions, fanout_groups, data_dir)
+        if checksums is not None:
+            results.save(
+                result_key(export_params, checksums),
+                os.path.join(out_dir, "out"),
+                writer.output_files(),
+                export_params,
+            )
+
+    if checkpoint is not None:
+        checkpoint.remove()
 
     # combinations = ((region, feature_name) for region in region_tuple_list for feature_name in feature_list)
 
@@ -12,19 +12,76 @@ This module contains functions for exporting OSM data to different file formats.
 import os
 import ast
 import csv
+import functools
+import glob
 import json
 import logging
 import math
-import tempfile
-from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
-
+import multiprocessing as mp
+from typing import (
+    IO,
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import LineString, Point, Polygon
+
+from earth_osm.flatgeobuf import FlatGeobufWriter
+from earth_osm.geopackage import GeoPackageWriter, prepare_geopackage
+from earth_osm.geometry import (
+    hilbert_position,
+    hilbert_values,
+    lonlat_to_geometries,
+    zorder_values,
+)
+from earth_osm.geoparquet import PARQUET_ROW_GROUP_SIZE, GeoParquetWriter
+from earth_osm.idset import IdSet, element_key
+from earth_osm.spill import DEFAULT_SPILL_COMPRESSION, SortedSpillWriter, SpillWriter
+from earth_osm.store import FeatureStore, StoreSync, SyncStats, element_type
+from earth_osm.tagstats import MELT_THRESHOLD, ColumnPlan, TagHistogram, plan_columns
 
 logger = logging.getLogger("eo.export")
 logger.setLevel(logging.INFO)
 
+SUPPORTED_FORMATS = ("csv", "geojson", "geojsonseq", "parquet", "fgb", "gpkg")
+# Formats derived from the spilled rows once the full column set is known.
+SPILLED_FORMATS = ("csv", "geojson", "geojsonseq", "fgb", "gpkg")
+GEOJSON_FORMATS = ("geojson", "geojsonseq")
+# Formats written feature by feature from (properties, Type, lonlat).
+FEATURE_FORMATS = ("geojson", "geojsonseq", "fgb", "gpkg")
+FORMAT_EXTENSIONS = {"geojsonseq": "geojsonl"}
+GEOJSON_PRECISION = 7
+SHARD_KEYS = ("id", "cell")
+SPATIAL_ORDERS = ("hilbert", "zorder")
+WORLD_EXTENT = (-180.0, -90.0, 180.0, 90.0)
+# Grid order of the Hilbert curve used for ``shard_by="cell"`` routing.
+SHARD_CELL_ORDER = 10
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+_PART_PATTERN = "-[0-9][0-9][0-9]-[0-9][0-9][0-9][0-9]"
+GEOJSON_CRS = {"type": "name", "properties": {"name": "urn:ogc:def:crs:OGC:1.3:CRS84"}}
+
+
+def _normalize_formats(out_format: Union[str, Iterable[str]]) -> List[str]:
+    formats = [out_format] if isinstance(out_format, str) else list(out_format)
+    if not formats:
+        raise ValueError("out_format must contain at least one value")
+    unknown = sorted(set(formats) - set(SUPPORTED_FORMATS))
+    if unknown:
+        raise ValueError(
+            f"Unsupported out_format {unknown}; choose from {list(SUPPORTED_FORMATS)}"
+        )
+    return formats
+
 
 def get_list_slug(str_list):
     import hashlib
@@ -38,51 +95,214 @@ def get_list_slug(str_list):
             name_code = hashlib.md5(file_slug[15:].encode()).hexdigest()[:8]
             file_slug = name_string + '_' + name_code
         return file_slug
-    
+
+
+def _parse_lonlat(value: Any) -> Any:
+    if not isinstance(value, str):
+        return value
+    try:
+        return json.loads(value)
+    except ValueError:
+        return ast.literal_eval(value)
+
+
 def convert_pd_to_gdf(pd_df):
-    pd_df['lonlat'] = pd_df['lonlat'].apply(lambda x: ast.literal_eval(x) if isinstance(x, str) else x)
+    """Return a GeoDataFrame of ``pd_df`` with ``lonlat`` replaced by geometries.
 
-    def create_geometry(lonlat_list, geom_type):
-        if geom_type == 'node':
-            return Point(lonlat_list[0])
-        if geom_type == 'way':
-            return LineString(lonlat_list)
-        if geom_type == 'area':
-            return Polygon(lonlat_list)
+    Geometries are built per type with shapely's array constructors from one
+    flat coordinate array, see :func:`earth_osm.geometry.lonlat_to_geometries`.
+    """
 
-    geometry_col = pd_df.apply(lambda row: create_geometry(row['lonlat'], row['Type']), axis=1)
+    pd_df['lonlat'] = pd_df['lonlat'].map(_parse_lonlat)
+
+    geometry_col = lonlat_to_geometries(pd_df['Type'].tolist(), pd_df['lonlat'].tolist())
     lonlat_index = pd_df.columns.get_loc('lonlat')
     pd_df.insert(lonlat_index, "geometry", geometry_col)
-    gdf = gpd.GeoDataFrame(pd_df, geometry='geometry')
+    gdf = gpd.GeoDataFrame(pd_df, geometry='geometry', crs="EPSG:4326")
     gdf.drop(columns=['lonlat'], inplace=True)
     pd_df.drop(columns=['geometry'], inplace=True)
 
     return gdf
 
 
+def _lonlat_bbox(lonlat: Any) -> Optional[Tuple[float, float, float, float]]:
+    if not lonlat:
+        return None
+    xs = [pair[0] for pair in lonlat]
+    ys = [pair[1] for pair in lonlat]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _check_spatial_order(spatial_order: Optional[str]) -> None:
+    if spatial_order is not None and spatial_order not in SPATIAL_ORDERS:
+        raise ValueError(
+            f"Unsupported spatial_order {spatial_order!r}; choose from {list(SPATIAL_ORDERS)}"
+        )
+
+
+def _check_sharding(
+    shards: int,
+    shard_by: str,
+    max_part_rows: Optional[int],
+    gpkg_path: Optional[str] = None,
+) -> None:
+    if shards < 1:
+        raise ValueError("shards must be at least 1")
+    if shard_by not in SHARD_KEYS:
+        raise ValueError(f"Unsupported shard_by {shard_by!r}; choose from {list(SHARD_KEYS)}")
+    if max_part_rows is not None and max_part_rows < 1:
+        raise ValueError("max_part_rows must be positive")
+    if gpkg_path is not None and (shards > 1 or max_part_rows):
+        # The parts of a target are written side by side, and a GeoPackage
+        # admits a single writing transaction.
+        raise ValueError("gpkg_path cannot be combined with sharded outputs")
+
+
+class _ShardRouter:
+    """Assign rows to the ``(shard, part)`` keys of a sharded output.
+
+    ``shard_by="id"`` spreads rows over the shards by a hash of their id;
+    ``shard_by="cell"`` splits the Hilbert curve over the world into
+    ``shards`` ranges and routes rows by the centre of their bounding box, so
+    each shard covers a compact area. A shard starts a new part every
+    ``max_part_rows`` rows. Keys depend only on the rows and their order, so
+    replayed spill rows get the same keys as on the way in.
+    """
+
+    def __init__(
+        self, shards: int = 1, shard_by: str = "id", max_part_rows: Optional[int] = None
+    ):
+        self.shards = shards
+        self.shard_by = shard_by
+        self.max_part_rows = max_part_rows
+        self._counts = [0] * shards
+
+    def _shard(self, record: Dict[str, Any]) -> int:
+        if self.shard_by == "id":
+            value = (int(record.get("id") or 0) * _HASH_MULTIPLIER) & 0xFFFFFFFFFFFFFFFF
+            return (value >> 32) * self.shards >> 32
+
+        box = _lonlat_bbox(record.get("lonlat"))
+        if box is None:
+            return 0
+        position = hilbert_position(
+            (box[0] + box[2]) / 2, (box[1] + box[3]) / 2, WORLD_EXTENT, SHARD_CELL_ORDER
+        )
+        return position * self.shards >> (2 * SHARD_CELL_ORDER)
+
+    def __call__(self, record: Dict[str, Any]) -> Tuple[int, int]:
+        shard = self._shard(record) if self.shards > 1 else 0
+        count = self._counts[shard]
+        self._counts[shard] = count + 1
+        return shard, count // self.max_part_rows if self.max_part_rows else 0
+
+
+def _spatial_sort_keys(records: Sequence[Dict[str, Any]], curve: str) -> np.ndarray:
+    """Curve positions of the bounding-box centres of ``records`` over the world."""
+
+    xs = np.full(len(records), np.nan)
+    ys = np.full(len(records), np.nan)
+    for index, record in enumerate(records):
+        box = _lonlat_bbox(record.get("lonlat"))
+        if box is not None:
+            xs[index] = (box[0] + box[2]) / 2
+            ys[index] = (box[1] + box[3]) / 2
+    values = hilbert_values if curve == "hilbert" else zorder_values
+    return values(xs, ys, WORLD_EXTENT)
+
+
+class _OutputPart:
+    """The csv file and feature writers of one output part."""
+
+    def __init__(self, slug: str):
+        self.slug = slug
+        self.csv_file: Optional[IO[str]] = None
+        self.csv_writer: Optional[csv.DictWriter] = None
+        self.feature_writers: List[Any] = []
+
 
 class _ExportTarget:
+    """One output file set (csv/geojson/parquet) fed by a stream of rows.
+
+    The csv and geojson layouts depend on tag frequencies over the whole
+    output, so by default rows are spilled and written on close. When a
+    :class:`~earth_osm.tagstats.ColumnPlan` is given up front the rows are
+    written straight to their final files instead.
+
+    ``gpkg_path`` puts the GeoPackage table of this target into a file shared
+    with other targets, and ``gpkg_table`` makes that table shared as well.
+
+    With ``shards > 1`` or ``max_part_rows`` every format is split into part
+    files ``<slug>-<shard>-<part>.<ext>`` (see :class:`_ShardRouter`) and a
+    ``<slug>.manifest.json`` lists the parts with their row counts and
+    bounding boxes.
+
+    ``spatial_order`` (``"hilbert"`` or ``"zorder"``) writes the rows of every
+    format, parquet included, sorted along that curve by the centre of their
+    bounding box. The sort happens in the spill (see
+    :class:`~earth_osm.spill.SortedSpillWriter`), so such targets always spill.
+    """
 
-    def __init__(self, region_list, primary_name, feature_list, data_dir, out_format):
+    def __init__(
+        self,
+        region_list: List[str],
+        primary_name: str,
+        feature_list: List[str],
+        data_dir: str,
+        out_format: Union[str, Iterable[str]],
+        row_group_size: int = PARQUET_ROW_GROUP_SIZE,
+        spill_dir: Optional[str] = None,
+        spill_compression: Optional[str] = DEFAULT_SPILL_COMPRESSION,
+        column_plan: Optional[ColumnPlan] = None,
+        gpkg_path: Optional[str] = None,
+        gpkg_table: Optional[str] = None,
+        shards: int = 1,
+        shard_by: str = "id",
+        max_part_rows: Optional[int] = None,
+        spatial_order: Optional[str] = None,
+    ):
+        _check_sharding(shards, shard_by, max_part_rows, gpkg_path)
+        _check_spatial_order(spatial_order)
         self.region_list = region_list
         self.primary_name = primary_name
         self.feature_list = feature_list
         self.data_dir = data_dir
-
-        formats = [out_format] if isinstance(out_format, str) else list(out_format)
-        if not formats:
-            raise ValueError("out_format must contain at least one value")
-        if "geojson" in formats and "csv" not in formats:
-            raise ValueError("geojson output requires csv format")
-        self.out_format = formats
+        self.out_format = _normalize_formats(out_format)
+        self.row_group_size = row_group_size
+        self.spill_dir = spill_dir
+        self.spill_compression = spill_compression
+        self.column_plan = column_plan
+        self.gpkg_path = gpkg_path
+        self.gpkg_table = gpkg_table
+        self.shards = shards
+        self.shard_by = shard_by
+        self.max_part_rows = max_part_rows
+        self._sharded = shards > 1 or bool(max_part_rows)
+        self.spatial_order = spatial_order
+        self._sorted = spatial_order is not None
+        self._router: Optional[_ShardRouter] = None
+        self._part_stats: Dict[Tuple[int, int], List[Any]] = {}
+        self._text_outputs = any(fmt in SPILLED_FORMATS for fmt in self.out_format)
+        # A shared GeoPackage admits one writer at a time, so targets cannot
+        # keep their transactions open side by side in single-pass mode.
+        shared_gpkg = "gpkg" in self.out_format and gpkg_path is not None
+        self._spill = (
+            self._text_outputs and (column_plan is None or shared_gpkg) or self._sorted
+        )
+        self._parquet_writers: Dict[Any, GeoParquetWriter] = {}
+        self._opened = False
 
         self.out_slug: Optional[str] = None
-        self._temp_file = None
-        self._temp_path: Optional[str] = None
-        self._seen_columns: Set[str] = set()
-        self._non_null_counts: Dict[str, int] = {}
-        self._total_rows = 0
-        self._melt_threshold = 0.95
+        self._spill_writer: Optional[Union[SpillWriter, SortedSpillWriter]] = None
+        self._histogram = TagHistogram()
+        self.duplicates = 0
+        self._melt_threshold = MELT_THRESHOLD
+
+        self._columns: List[str] = []
+        self._keep_columns: Set[str] = set()
+        self._property_columns: List[str] = []
+        self._parts: Dict[Any, _OutputPart] = {}
+        self._overflow_columns: Set[str] = set()
 
         logger.debug(
             "File writer initialized with region_list: %s, primary_name: %s, feature_list: %s",
@@ -92,7 +312,7 @@ class _ExportTarget:
         )
 
     def open(self):
-        if self._temp_file is not None:
+        if self._opened:
             raise RuntimeError("Writer is already open")
 
         region_slug = get_list_slug(self.region_list)
@@ -103,28 +323,65 @@ class _ExportTarget:
 
         os.makedirs(out_dir, exist_ok=True)
 
-        for ext in self.out_format:
-            out_path = f"{self.out_slug}.{ext}"
+        for out_path in self._own_files():
             if os.path.exists(out_path):
                 logger.debug("Deleting existing file: %s", out_path)
                 os.remove(out_path)
 
-        self._temp_file = tempfile.NamedTemporaryFile(
-            mode="w", encoding="utf-8", delete=False
-        )
-        self._temp_path = self._temp_file.name
-        self._seen_columns.clear()
-        self._non_null_counts.clear()
-        self._total_rows = 0
+        self._histogram = TagHistogram()
+        self.duplicates = 0
+        self._overflow_columns.clear()
+        self._part_stats.clear()
+        if self._sharded:
+            self._router = _ShardRouter(self.shards, self.shard_by, self.max_part_rows)
+        if self.spatial_order is not None:
+            self._spill_writer = SortedSpillWriter(
+                functools.partial(_spatial_sort_keys, curve=self.spatial_order),
+                self.spill_dir,
+                self.spill_compression,
+            )
+        elif self._spill:
+            self._spill_writer = SpillWriter(self.spill_dir, self.spill_compression)
+        elif self._text_outputs and self.column_plan is not None:
+            self._open_outputs(self.column_plan)
+        if "parquet" in self.out_format and not self._sharded and not self._sorted:
+            self._parquet_writer(None)
+        self._opened = True
 
         return self
 
+    def _own_files(self) -> List[str]:
+        """Paths this target may write, except a GeoPackage shared with others."""
+
+        out_slug = self._slug()
+        paths = [self._manifest_path()]
+        for fmt in self.out_format:
+            if fmt == "gpkg" and self.gpkg_path is not None:
+                continue
+            extension = FORMAT_EXTENSIONS.get(fmt, fmt)
+            paths.append(self._output_path(fmt))
+            paths.extend(glob.glob(f"{glob.escape(out_slug)}{_PART_PATTERN}.{extension}"))
+        return paths
+
+    def output_files(self) -> List[str]:
+        """Return the files written for this target, a shared GeoPackage included."""
+
+        paths = self._own_files()
+        if "gpkg" in self.out_format and self.gpkg_path is not None:
+            paths.append(self.gpkg_path)
+        return [path for path in paths if os.path.exists(path)]
+
     def __enter__(self):
         return self.open()
 
-    def __call__(self, rows):
+    def __call__(
+        self,
+        rows: Union[pd.DataFrame, Dict[str, Any], Iterable[Any]],
+        histogram: Optional[TagHistogram] = None,
+        seen: Optional[IdSet] = None,
+    ) -> None:
         for record in self._iter_records(rows):
-            self._write_record(record)
+            self._write_record(record, histogram, seen)
 
     def __exit__(self, exc_type, exc_value, traceback):
         return self._close(exc_type, exc_value, traceback)
@@ -133,22 +390,60 @@ class _ExportTarget:
         self._close(exc_type, exc_value, traceback)
 
     def _close(self, exc_type, exc_value, traceback):
-        if self._temp_file is not None:
-            self._temp_file.close()
-
         try:
             if exc_type is not None:
+                self._abort()
                 return False
 
-            if self._total_rows == 0:
-                self._write_empty_outputs()
-            else:
-                self._finalize_outputs()
+            self._close_inputs()
+            self._finalize()
         finally:
-            self._cleanup_temp()
+            self._release()
 
         return False
 
+    def _abort(self) -> None:
+        if self._spill_writer is not None:
+            self._spill_writer.close()
+        for parquet in self._parquet_writers.values():
+            parquet.abort()
+        self._parquet_writers = {}
+        self._close_outputs(completed=False)
+
+    def _close_inputs(self) -> None:
+        """Stop accepting rows: close the spill file and the parquet writers."""
+
+        if self._spill_writer is not None:
+            self._spill_writer.close()
+        self._close_parquet()
+
+    def _close_parquet(self) -> None:
+        parquet_writers, self._parquet_writers = self._parquet_writers, {}
+        for key, parquet in parquet_writers.items():
+            parquet.close()
+            logger.info("PARQUET: %s", self._output_path("parquet", key))
+
+    def _finalize(self) -> None:
+        """Write the csv/geojson outputs; safe to run in a worker process."""
+
+        if self._spill:
+            self._finalize_outputs()
+        elif self._text_outputs:
+            self._close_outputs(completed=True)
+            if self._overflow_columns:
+                logger.info(
+                    "%s: %d columns missing from the tag statistics were kept in other_tags",
+                    self.out_slug,
+                    len(self._overflow_columns),
+                )
+        if self._sharded:
+            self._write_manifest()
+
+    def _release(self) -> None:
+        self._parquet_writers = {}
+        self._opened = False
+        self._cleanup_temp()
+
     def _iter_records(self, payload) -> Iterator[Dict[str, Any]]:
         if isinstance(payload, pd.DataFrame):
             yield from payload.to_dict(orient="records")
@@ -180,8 +475,19 @@ class _ExportTarget:
             return True
         return isinstance(value, float) and math.isnan(value)
 
-    def _write_record(self, record: Dict[str, Any]) -> None:
-        if self._temp_file is None:
+    def _write_record(
+        self,
+        record: Dict[str, Any],
+        histogram: Optional[TagHistogram] = None,
+        seen: Optional[IdSet] = None,
+    ) -> None:
+        """Write ``record``, unless its element is already in ``seen``.
+
+        ``histogram`` collects the tags of the records of its source that are
+        written, so plans made from it match the two-pass layout.
+        """
+
+        if not self._opened:
             raise RuntimeError("Writer is not active")
 
         sanitized: Dict[str, Any] = {}
@@ -191,61 +497,64 @@ class _ExportTarget:
                 value = [list(pair) for pair in value]
             elif key == "refs" and value is not None:
                 value = list(value)
-
             sanitized[key] = value
-            self._seen_columns.add(key)
-            if not self._is_null(value):
-                self._non_null_counts[key] = self._non_null_counts.get(key, 0) + 1
-
-        self._temp_file.write(json.dumps(sanitized, ensure_ascii=False))
-        self._temp_file.write("\n")
-        self._total_rows += 1
-
-    def _columns_to_melt(self) -> Set[str]:
-        melt: Set[str] = set()
-        if self._total_rows == 0:
-            return melt
 
-        threshold = 1.0 - self._melt_threshold
-        for column in self._seen_columns:
-            if not column.startswith("tags."):
-                continue
-            ratio = self._non_null_counts.get(column, 0) / self._total_rows
-            if ratio <= threshold:
-                melt.add(column)
-        return melt
-
-    def _determine_columns(self, melt_columns: Set[str]) -> List[str]:
-        columns: List[str] = ["id", "Type", "Region", "lonlat"]
-        if "refs" in self._seen_columns:
-            columns.append("refs")
-
-        reserved = set(columns)
-        reserved.update(melt_columns)
-        remaining = sorted(
-            col
-            for col in self._seen_columns
-            if col not in reserved and col != "other_tags"
-        )
-        columns.extend(col for col in remaining if col not in columns)
+        if seen is not None and not seen.add(
+            element_key(element_type(sanitized.get("Type")), sanitized["id"])
+        ):
+            self.duplicates += 1
+            return
+        if histogram is not None:
+            histogram.add(sanitized)
+        self._histogram.add(sanitized)
+
+        part_key: Optional[Tuple[int, int]] = None
+        if self._router is not None and not self._sorted:
+            part_key = self._router(sanitized)
+            self._track_part(part_key, sanitized)
+
+        if "parquet" in self.out_format and not self._sorted:
+            self._parquet_writer(part_key).write(sanitized)
+        if self._spill_writer is not None:
+            self._spill_writer.write(sanitized)
+        elif self._text_outputs:
+            self._emit(dict(sanitized), part_key)
+
+    def _track_part(self, key: Tuple[int, int], record: Dict[str, Any]) -> None:
+        stats = self._part_stats.get(key)
+        if stats is None:
+            stats = self._part_stats[key] = [0, None]
+        stats[0] += 1
+        box = _lonlat_bbox(record.get("lonlat"))
+        if box is not None:
+            known = stats[1]
+            stats[1] = box if known is None else (
+                min(known[0], box[0]),
+                min(known[1], box[1]),
+                max(known[2], box[2]),
+                max(known[3], box[3]),
+            )
 
-        if melt_columns or "other_tags" in self._seen_columns:
-            if "other_tags" not in columns:
-                columns.append("other_tags")
+    def _parquet_writer(self, key: Optional[Tuple[int, int]]) -> GeoParquetWriter:
+        parquet = self._parquet_writers.get(key)
+        if parquet is None:
+            parquet = self._parquet_writers[key] = GeoParquetWriter(
+                self._output_path("parquet", key), row_group_size=self.row_group_size
+            )
+        return parquet
 
-        return columns
+    def _apply_melt(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """Move every column outside the planned layout into ``other_tags``."""
 
-    def _apply_melt(self, record: Dict[str, Any], melt_columns: Set[str]) -> Dict[str, Any]:
         other_tags: Dict[str, Any] = {}
         existing = record.get("other_tags")
         if isinstance(existing, dict):
             other_tags.update(existing)
 
-        for column in melt_columns:
-            if column in record:
-                value = record.pop(column)
-                if not self._is_null(value):
-                    other_tags[column] = value
+        for column in [column for column in record if column not in self._keep_columns]:
+            value = record.pop(column)
+            if not self._is_null(value):
+                other_tags[column] = value
 
         record["other_tags"] = other_tags or None
         return record
@@ -266,86 +575,395 @@ class _ExportTarget:
                 row[column] = value
         return row
 
-    def _write_empty_outputs(self) -> None:
-        csv_path = None
-        if 'csv' in self.out_format:
-            csv_path = f"{self.out_slug}.csv"
-            with open(csv_path, 'w', newline='', encoding='utf-8') as csv_file:
-                writer = csv.DictWriter(csv_file, fieldnames=["id", "Type", "Region", "lonlat"])
-                writer.writeheader()
-            logger.info("CSV: %s.csv (empty)", self.out_slug)
+    def _slug(self) -> str:
+        if self.out_slug is None:
+            raise RuntimeError("Writer is not open")
+        return self.out_slug
+
+    def _part_slug(self, key: Optional[Tuple[int, int]] = None) -> str:
+        if key is None:
+            return self._slug()
+        shard, part = key
+        return f"{self._slug()}-{shard:03d}-{part:04d}"
+
+    def _output_path(self, fmt: str, key: Optional[Tuple[int, int]] = None) -> str:
+        if fmt == "gpkg" and self.gpkg_path is not None:
+            return self.gpkg_path
+        return f"{self._part_slug(key)}.{FORMAT_EXTENSIONS.get(fmt, fmt)}"
+
+    def _gpkg_table(self, key: Optional[Tuple[int, int]] = None) -> str:
+        return self.gpkg_table or os.path.basename(self._part_slug(key))
+
+    def _manifest_path(self) -> str:
+        return f"{self._slug()}.manifest.json"
+
+    def _open_geojson(
+        self, fmt: str, key: Optional[Tuple[int, int]] = None
+    ) -> "_GeoJSONWriter":
+        return _GeoJSONWriter(
+            self._output_path(fmt, key),
+            os.path.basename(self._part_slug(key)),
+            sequence=fmt == "geojsonseq",
+        )
 
-        if 'geojson' in self.out_format and csv_path is not None:
-            self._convert_csv_to_geojson(csv_path)
+    def _open_feature_writer(
+        self, fmt: str, key: Optional[Tuple[int, int]] = None
+    ) -> Union[FlatGeobufWriter, GeoPackageWriter, "_GeoJSONWriter"]:
+        if fmt == "fgb":
+            return FlatGeobufWriter(
+                self._output_path(fmt, key),
+                os.path.basename(self._part_slug(key)),
+                self._property_columns,
+            )
+        if fmt == "gpkg":
+            return GeoPackageWriter(
+                self._output_path(fmt, key),
+                self._gpkg_table(key),
+                self._property_columns,
+                append=self.gpkg_table is not None,
+            )
+        return self._open_geojson(fmt, key)
+
+    def _open_outputs(self, plan: ColumnPlan) -> None:
+        self._columns = list(plan.columns)
+        self._keep_columns = set(plan.columns)
+        self._property_columns = [column for column in self._columns if column != "lonlat"]
+        # Unsharded outputs exist even without rows; parts open on first use.
+        if not self._sharded:
+            self._open_part(None)
+
+    def _open_part(self, key: Optional[Tuple[int, int]]) -> _OutputPart:
+        part = self._parts[key] = _OutputPart(self._part_slug(key))
+        try:
+            if 'csv' in self.out_format:
+                csv_file = open(f"{part.slug}.csv", 'w', newline='', encoding='utf-8')
+                part.csv_file = csv_file
+                part.csv_writer = csv.DictWriter(csv_file, fieldnames=self._columns)
+                part.csv_writer.writeheader()
+
+            for fmt in FEATURE_FORMATS:
+                if fmt in self.out_format:
+                    part.feature_writers.append(self._open_feature_writer(fmt, key))
+        except BaseException:
+            self._close_outputs(completed=False)
+            raise
+        return part
+
+    def _emit(self, record: Dict[str, Any], key: Optional[Tuple[int, int]] = None) -> None:
+        if self.column_plan is not None:
+            for column in record:
+                melted = self.column_plan.melt_columns
+                if column not in self._keep_columns and column not in melted:
+                    self._overflow_columns.add(column)
+        record = self._apply_melt(record)
+
+        part = self._parts.get(key)
+        if part is None:
+            part = self._open_part(key)
+
+        if part.csv_writer is not None:
+            part.csv_writer.writerow(self._prepare_csv_row(record, self._columns))
+
+        if part.feature_writers:
+            properties = {column: record.get(column) for column in self._property_columns}
+            for feature_writer in part.feature_writers:
+                feature_writer.write(properties, record.get("Type"), record.get("lonlat"))
+
+    def _close_outputs(self, completed: bool) -> None:
+        parts, self._parts = self._parts, {}
+        for part in parts.values():
+            if part.csv_file is not None:
+                part.csv_file.close()
+                if completed:
+                    logger.info("CSV: %s.csv", part.slug)
+                elif os.path.exists(part.csv_file.name):
+                    os.remove(part.csv_file.name)
+            for feature_writer in part.feature_writers:
+                if completed:
+                    feature_writer.close()
+                    logger.info("%s: %s", feature_writer.label, feature_writer.path)
+                else:
+                    feature_writer.abort()
 
     def _finalize_outputs(self) -> None:
-        melt_columns = self._columns_to_melt()
-        columns = self._determine_columns(melt_columns)
-
-        csv_writer = None
-        csv_file = None
-        csv_path = None
-
+        spill_writer = self._spill_writer
+        if spill_writer is None:
+            raise RuntimeError("Writer is not open")
+        self._open_outputs(plan_columns(self._histogram, self._melt_threshold))
+        router = None
+        if self._sharded:
+            router = _ShardRouter(self.shards, self.shard_by, self.max_part_rows)
+        # Sorted targets write parquet here; parts follow the sorted order.
+        parquet = self._sorted and "parquet" in self.out_format
+        if parquet and not self._sharded:
+            self._parquet_writer(None)
+        completed = False
         try:
-            if 'csv' in self.out_format:
-                csv_path = f"{self.out_slug}.csv"
-                csv_file = open(csv_path, 'w', newline='', encoding='utf-8')
-                csv_writer = csv.DictWriter(csv_file, fieldnames=columns)
-                csv_writer.writeheader()
+            for record in spill_writer.iter_records():
+                key: Optional[Tuple[int, int]] = None
+                if router is not None:
+                    key = router(record)
+                    if self._sorted:
+                        self._track_part(key, record)
+                if parquet:
+                    self._parquet_writer(key).write(record)
+                if self._text_outputs:
+                    self._emit(dict(record), key)
+            completed = True
+        finally:
+            self._close_outputs(completed)
+            if completed:
+                self._close_parquet()
+            else:
+                for writer in self._parquet_writers.values():
+                    writer.abort()
+                self._parquet_writers = {}
+
+    def _write_manifest(self) -> None:
+        """List the parts with their files, row counts and bounding boxes."""
+
+        out_slug = self._slug()
+        out_dir = os.path.dirname(out_slug)
+        parts = []
+        for key in sorted(self._part_stats):
+            rows, box = self._part_stats[key]
+            files = {
+                fmt: os.path.relpath(self._output_path(fmt, key), out_dir)
+                for fmt in self.out_format
+            }
+            entry = {
+                "shard": key[0],
+                "part": key[1],
+                "rows": rows,
+                "bbox": list(box) if box is not None else None,
+                "files": files,
+            }
+            if "gpkg" in self.out_format:
+                entry["gpkg_table"] = self._gpkg_table(key)
+            parts.append(entry)
+
+        boxes = [entry["bbox"] for entry in parts if entry["bbox"] is not None]
+        manifest = {
+            "name": os.path.basename(out_slug),
+            "formats": list(self.out_format),
+            "shard_by": self.shard_by if self.shards > 1 else None,
+            "shards": self.shards,
+            "max_part_rows": self.max_part_rows,
+            "rows": sum(entry["rows"] for entry in parts),
+            "bbox": [
+                min(box[0] for box in boxes),
+                min(box[1] for box in boxes),
+                max(box[2] for box in boxes),
+                max(box[3] for box in boxes),
+            ] if boxes else None,
+            "parts": parts,
+        }
+
+        path = self._manifest_path()
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as target:
+            json.dump(manifest, target, indent=1)
+        os.replace(temp_path, path)
+        logger.info("MANIFEST: %s (%d parts)", path, len(parts))
 
-            with open(self._temp_path, 'r', encoding='utf-8') as source:
-                for line in source:
-                    record = json.loads(line)
-                    record = self._apply_melt(record, melt_columns)
+    def _cleanup_temp(self) -> None:
+        if self._spill_writer is not None:
+            self._spill_writer.remove()
+        self._spill_writer = None
+
+
+def _round_pair(pair: Sequence[float]) -> List[float]:
+    # OSM stores coordinates with 7 decimal places; drop the accumulated float noise.
+    return [round(pair[0], GEOJSON_PRECISION), round(pair[1], GEOJSON_PRECISION)]
+
+
+def _feature_geometry(
+    feature_type: Optional[str], lonlat: Optional[Sequence[Sequence[float]]]
+) -> Optional[Dict[str, Any]]:
+    if not lonlat:
+        return None
+    if feature_type == "node":
+        return {"type": "Point", "coordinates": _round_pair(lonlat[0])}
+    if feature_type == "way":
+        return {"type": "LineString", "coordinates": [_round_pair(pair) for pair in lonlat]}
+    if feature_type == "area":
+        return {"type": "Polygon", "coordinates": [[_round_pair(pair) for pair in lonlat]]}
+    return None
+
+
+class _GeoJSONWriter:
+    """Write GeoJSON features one at a time.
+
+    ``sequence=False`` produces a FeatureCollection laid out with one feature
+    per line; ``sequence=True`` produces newline-delimited GeoJSON features
+    (GeoJSONSeq). Only the current feature is held in memory.
+    """
+
+    def __init__(self, path: str, name: str, sequence: bool = False):
+        self.path = path
+        self.sequence = sequence
+        self.label = "GEOJSONSEQ" if sequence else "GEOJSON"
+        self._count = 0
+        self._file: Optional[IO[str]] = open(path, "w", encoding="utf-8")
+        if not sequence:
+            self._file.write(
+                '{\n"type": "FeatureCollection",\n'
+                f'"name": {json.dumps(name, ensure_ascii=False)},\n'
+                f'"crs": {json.dumps(GEOJSON_CRS)},\n'
+                '"features": [\n'
+            )
 
-                    if csv_writer is not None:
-                        csv_writer.writerow(self._prepare_csv_row(record, columns))
+    def write(
+        self,
+        properties: Dict[str, Any],
+        feature_type: Optional[str],
+        lonlat: Optional[Sequence[Sequence[float]]],
+    ) -> None:
+        feature = json.dumps(
+            {
+                "type": "Feature",
+                "properties": properties,
+                "geometry": _feature_geometry(feature_type, lonlat),
+            },
+            ensure_ascii=False,
+        )
+        target = self._file
+        if target is None:
+            raise RuntimeError(f"GeoJSON writer for {self.path} is closed")
+        if not self.sequence and self._count:
+            target.write(",\n")
+        target.write(feature)
+        if self.sequence:
+            target.write("\n")
+        self._count += 1
+
+    def close(self) -> None:
+        if self._file is None:
+            return
+        if not self.sequence:
+            self._file.write("\n]\n}\n" if self._count else "]\n}\n")
+        self._file.close()
+        self._file = None
 
-        finally:
-            if csv_file is not None:
-                csv_file.close()
+    def abort(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
 
-        if 'csv' in self.out_format:
-            logger.info("CSV: %s.csv", self.out_slug)
-        if 'geojson' in self.out_format and csv_path is not None:
-            self._convert_csv_to_geojson(csv_path)
 
-    def _cleanup_temp(self) -> None:
-        if self._temp_path and os.path.exists(self._temp_path):
-            os.remove(self._temp_path)
-        self._temp_path = None
-        self._temp_file = None
+class ExportFinalizeError(RuntimeError):
+    """Raised when one or more export targets failed to finalize.
 
-    def _convert_csv_to_geojson(self, csv_path: str) -> None:
-        geojson_path = f"{self.out_slug}.geojson"
+    ``failures`` maps each failed output slug to its error message; the other
+    targets are finalized regardless.
+    """
 
-        df = pd.read_csv(csv_path)
-        if df.empty:
-            base = df.drop(columns=["lonlat"], errors="ignore")
-            geometry = gpd.GeoSeries([], name="geometry", dtype="geometry")
-            gdf = gpd.GeoDataFrame(base, geometry=geometry)
-        else:
-            gdf = convert_pd_to_gdf(df)
+    def __init__(self, failures: Dict[str, str]):
+        self.failures = failures
+        details = "; ".join(f"{slug}: {error}" for slug, error in failures.items())
+        super().__init__(f"{len(failures)} export target(s) failed to finalize: {details}")
 
-        gdf.set_crs(epsg=4326, inplace=True, allow_override=True)
-        gdf.to_file(geojson_path, driver="GeoJSON")
-        logger.info("GEOJSON: %s.geojson", self.out_slug)
 
+def _finalize_target(task: Tuple[int, _ExportTarget]) -> Tuple[int, Optional[str]]:
+    """Pool worker: finalize one spilled target and report ``(index, error)``."""
 
-class EarthOSMWriter:
+    index, target = task
+    try:
+        target._finalize()
+    except Exception as exc:
+        logger.exception("Failed to finalize %s", target.out_slug)
+        return index, f"{type(exc).__name__}: {exc}"
+    return index, None
 
-    def __init__(self, primary_name: str, data_dir: str, out_format):
-        formats = [out_format] if isinstance(out_format, str) else list(out_format)
-        if not formats:
-            raise ValueError("out_format must contain at least one value")
-        if "geojson" in formats and "csv" not in formats:
-            raise ValueError("geojson output requires csv format")
 
+class EarthOSMWriter:
+    """Route rows to one :class:`_ExportTarget` per region/feature combination.
+
+    On close, targets that spilled their rows are finalized concurrently in a
+    pool of ``finalize_workers`` processes (``None`` picks the CPU count, 1
+    finalizes serially). Each target writes only its own files, so the output
+    is identical to a serial run. Targets that share ``gpkg_path`` append to
+    the same file, so they are finalized serially in writer order to keep its
+    row order deterministic.
+
+    GeoPackage outputs go to one ``<slug>.gpkg`` per target unless
+    ``gpkg_path`` names a single file (relative to ``<data_dir>/out``) for
+    all of them. That file holds one table per target, or one shared table
+    named ``gpkg_table`` that every target appends to; other tables already
+    in the file are kept. Writers to a shared file take turns on its lock.
+
+    ``shards``, ``shard_by`` and ``max_part_rows`` split every output into
+    part files described by a manifest, and ``spatial_order`` sorts the rows
+    of every output along a space-filling curve, see :class:`_ExportTarget`.
+
+    ``feature_store`` names a SQLite :class:`~earth_osm.store.FeatureStore`
+    (relative to ``<data_dir>/out``) that every row written with a
+    ``source`` is upserted into. The store is updated on a successful close,
+    after which ``store_stats`` holds the counts of the run.
+
+    With ``deduplicate`` an element (node or way id) is written at most once
+    per output and feature: copies from later ``write`` calls, such as a
+    border line in the extracts of both neighbours, are dropped. The seen
+    ids are kept in a compact :class:`~earth_osm.idset.IdSet`.
+    """
+
+    def __init__(
+        self,
+        primary_name: str,
+        data_dir: str,
+        out_format: Union[str, Iterable[str]],
+        row_group_size: int = PARQUET_ROW_GROUP_SIZE,
+        spill_dir: Optional[str] = None,
+        spill_compression: Optional[str] = DEFAULT_SPILL_COMPRESSION,
+        finalize_workers: Optional[int] = None,
+        gpkg_path: Optional[str] = None,
+        gpkg_table: Optional[str] = None,
+        shards: int = 1,
+        shard_by: str = "id",
+        max_part_rows: Optional[int] = None,
+        spatial_order: Optional[str] = None,
+        feature_store: Optional[str] = None,
+        deduplicate: bool = False,
+    ):
+        if gpkg_table is not None and gpkg_path is None:
+            raise ValueError("gpkg_table requires gpkg_path")
+        _check_sharding(shards, shard_by, max_part_rows, gpkg_path)
+        _check_spatial_order(spatial_order)
         self.primary_name = primary_name
         self.data_dir = data_dir
-        self.out_format = formats
+        self.out_format = _normalize_formats(out_format)
+        self.row_group_size = row_group_size
+        self.spill_dir = spill_dir
+        self.spill_compression = spill_compression
+        self.finalize_workers = finalize_workers
+        self.gpkg_path = gpkg_path
+        self.gpkg_table = gpkg_table
+        self.shards = shards
+        self.shard_by = shard_by
+        self.max_part_rows = max_part_rows
+        self.spatial_order = spatial_order
+        if gpkg_path is not None and "gpkg" in self.out_format:
+            out_dir = os.path.join(data_dir, "out")
+            self.gpkg_path = os.path.join(out_dir, gpkg_path)
+            os.makedirs(os.path.dirname(self.gpkg_path) or ".", exist_ok=True)
+            prepare_geopackage(self.gpkg_path, gpkg_table)
+        self.feature_store: Optional[str] = None
+        self.store_stats: Optional[SyncStats] = None
+        self._store: Optional[FeatureStore] = None
+        self._store_sync: Optional[StoreSync] = None
+        if feature_store is not None:
+            self.feature_store = os.path.join(data_dir, "out", feature_store)
+            self._store = FeatureStore(self.feature_store)
+            self._store_sync = self._store.begin_sync(primary_name)
+        self.deduplicate = deduplicate
+        # Ids written per ``(target, feature)`` when deduplicating.
+        self._seen: Dict[tuple, IdSet] = {}
         self._targets: Dict[tuple, _ExportTarget] = {}
         self._closed = False
+        # Histograms of the rows written per ``source`` key, see ``write``.
+        self.source_histograms: Dict[Any, TagHistogram] = {}
 
     def __enter__(self):
         return self
@@ -354,29 +972,173 @@ class EarthOSMWriter:
         self.close(exc_type, exc_value, traceback)
         return False
 
-    def prepare_target(self, region_list: Iterable[str], feature_list: Iterable[str]) -> None:
-        self._ensure_target(region_list, feature_list)
+    def prepare_target(
+        self,
+        region_list: Iterable[str],
+        feature_list: Iterable[str],
+        column_plan: Optional[ColumnPlan] = None,
+        sources: Iterable[Tuple[str, str]] = (),
+    ) -> None:
+        """Open the output for ``region_list`` x ``feature_list`` ahead of its rows.
+
+        With a ``column_plan`` the csv/geojson outputs are written in a single
+        pass instead of being spilled and finalized on close. ``sources`` lists
+        the ``(region, feature)`` pairs feeding the output, so the feature
+        store also drops the stored rows of sources that yield no rows.
+        """
+
+        self._ensure_target(region_list, feature_list, column_plan)
+        if self._store_sync is not None:
+            for region, feature in sources:
+                self._store_sync.add_scope(region, feature)
 
     def write(
         self,
         region_list: Iterable[str],
         feature_list: Iterable[str],
         rows: Iterable[Any],
+        source: Any = None,
     ) -> None:
+        """Append ``rows`` to the output of ``region_list`` x ``feature_list``.
+
+        ``source`` (e.g. a ``(region, feature)`` tuple) names where the rows
+        came from; their tag statistics are collected in ``source_histograms``
+        and, with a ``feature_store``, the rows are staged for the store.
+        """
+
         target = self._ensure_target(region_list, feature_list)
-        target(rows)
+        histogram = None
+        if source is not None:
+            histogram = self.source_histograms.get(source)
+            if histogram is None:
+                histogram = self.source_histograms[source] = TagHistogram()
+            if self._store_sync is not None:
+                rows = self._staged_rows(target._iter_records(rows), *source)
+        seen = None
+        if self.deduplicate:
+            seen_key = (target.out_slug, source[1] if source is not None else None)
+            seen = self._seen.get(seen_key)
+            if seen is None:
+                seen = self._seen[seen_key] = IdSet()
+        target(rows, histogram, seen)
+
+    def output_files(self) -> List[str]:
+        """Return the files written for all outputs."""
+
+        paths: Dict[str, None] = {}
+        for target in self._targets.values():
+            paths.update(dict.fromkeys(target.output_files()))
+        return list(paths)
+
+    def _staged_rows(self, rows: Iterable[Any], region: str, feature: str) -> Iterator[Any]:
+        sync = self._store_sync
+        if sync is None:
+            raise RuntimeError("Feature store is closed")
+        sync.add_scope(region, feature)
+        for record in rows:
+            sync.write(region, feature, record)
+            yield record
+
+    def _close_store(self, commit: bool) -> None:
+        store, sync = self._store, self._store_sync
+        if store is None or sync is None:
+            return
+        try:
+            if commit:
+                self.store_stats = sync.commit()
+            else:
+                sync.rollback()
+        finally:
+            store.close()
+            self._store = self._store_sync = None
 
     def close(self, exc_type=None, exc_value=None, traceback=None):
         if self._closed:
             return
         self._closed = True
+        self._seen.clear()
+        if exc_type is not None:
+            self._close_store(commit=False)
+            for target in self._targets.values():
+                target.close(exc_type, exc_value, traceback)
+            return
+
+        failures: Dict[str, str] = {}
+        if self.feature_store is not None:
+            try:
+                self._close_store(commit=True)
+            except Exception as exc:
+                logger.exception("Failed to update the feature store %s", self.feature_store)
+                failures[self.feature_store] = f"{type(exc).__name__}: {exc}"
+
+        pending: List[_ExportTarget] = []
         for target in self._targets.values():
-            target.close(exc_type, exc_value, traceback)
+            if target.duplicates:
+                logger.info(
+                    "%s: dropped %d duplicate rows", target.out_slug, target.duplicates
+                )
+            try:
+                target._close_inputs()
+                if target._spill:
+                    pending.append(target)
+                    continue
+                target._finalize()
+            except Exception as exc:
+                logger.exception("Failed to finalize %s", target.out_slug)
+                failures[target._slug()] = f"{type(exc).__name__}: {exc}"
+                target._abort()
+            target._release()
+
+        try:
+            self._finalize_pending(pending, failures)
+        finally:
+            for target in pending:
+                target._release()
+
+        if failures:
+            raise ExportFinalizeError(failures)
+
+    def _finalize_pending(
+        self, pending: List[_ExportTarget], failures: Dict[str, str]
+    ) -> None:
+        if not pending:
+            return
+
+        workers = self.finalize_workers or os.cpu_count() or 1
+        if self.gpkg_path is not None and "gpkg" in self.out_format:
+            # Targets sharing one GeoPackage would interleave their rows.
+            workers = 1
+        workers = max(1, min(workers, len(pending)))
+        tasks = list(enumerate(pending))
+
+        pool = mp.Pool(workers) if workers > 1 else None
+        try:
+            results = (
+                pool.imap_unordered(_finalize_target, tasks)
+                if pool
+                else map(_finalize_target, tasks)
+            )
+            for done, (index, error) in enumerate(results, start=1):
+                target = pending[index]
+                if error is not None:
+                    failures[target._slug()] = error
+                logger.info(
+                    "Finalized %d/%d outputs (%s%s)",
+                    done,
+                    len(pending),
+                    os.path.basename(target._slug()),
+                    ", failed" if error is not None else "",
+                )
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
     def _ensure_target(
         self,
         region_list: Iterable[str],
         feature_list: Iterable[str],
+        column_plan: Optional[ColumnPlan] = None,
     ) -> _ExportTarget:
         region_key = tuple(sorted(region_list))
         feature_key = tuple(sorted(feature_list))
@@ -390,6 +1152,16 @@ class EarthOSMWriter:
                 list(feature_list),
                 self.data_dir,
                 self.out_format,
+                row_group_size=self.row_group_size,
+                spill_dir=self.spill_dir,
+                spill_compression=self.spill_compression,
+                column_plan=column_plan,
+                gpkg_path=self.gpkg_path,
+                gpkg_table=self.gpkg_table,
+                shards=self.shards,
+                shard_by=self.shard_by,
+                max_part_rows=self.max_part_rows,
+                spatial_order=self.spatial_order,
             )
             target.open()
             self._targets[slug_key] = target
@@ -0,0 +1,642 @@
+"""DataFrame construction for flattened feature rows.
+
+Feature rows carry one ``tags.<key>`` entry per OSM tag. Spread into a wide
+frame, a tag-rich selection such as ``ALL_building`` becomes hundreds of
+mostly empty object columns. :func:`build_tag_frame` instead keeps the tags
+in a long table with one row per ``(feature, key, value)``, where ``key`` and
+``value`` are dictionary encoded as categoricals. Only the tag keys a caller
+asks for are promoted to real ``tags.<key>`` columns of the feature frame.
+
+:class:`FeatureFrameBuilder` builds the plain wide frame column by column, so
+neither the list of row dicts nor a row-by-row schema inference is needed;
+:func:`iter_feature_batches` uses it to cut a feature stream into DataFrames
+or Arrow record batches.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import math
+from array import array
+from itertools import chain
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+import pandas as pd
+
+from earth_osm.geoarrow import TAGS_COLUMN, encode_geometry, encode_tags
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+
+logger = logging.getLogger("eo.frames")
+
+TAG_PREFIX = "tags."
+INT_COLUMNS = ("id",)
+CATEGORY_COLUMNS = ("Region", "Type")
+COORDINATE_COLUMNS = ("lonlat",)
+DEFAULT_BATCH_SIZE = 65536
+
+
+def _tag_column(key: str) -> str:
+    return key if key.startswith(TAG_PREFIX) else f"{TAG_PREFIX}{key}"
+
+
+def _tag_key(column: str) -> str:
+    """Return the tag key of a ``tags.<key>`` column."""
+
+    prefix_length = len(TAG_PREFIX)
+    return column[prefix_length:]
+
+
+def _default_string_dtype() -> Any:
+    dtype = pd.Series(["a"]).dtype
+    if pa is not None and getattr(dtype, "storage", None) == "pyarrow":
+        return dtype
+    return None
+
+
+_STRING_DTYPE = _default_string_dtype()
+
+
+def _string_array(values: Union[List[Any], np.ndarray]) -> Any:
+    """Return ``values`` as an Arrow-backed string array if they are all strings or NaN.
+
+    This is what pandas infers for such a list anyway, without converting it
+    element by element. Returns None when pandas does not default to Arrow
+    strings or some value is not a string.
+    """
+
+    if _STRING_DTYPE is None:
+        return None
+    try:
+        strings = pa.array(values, type=pa.large_string(), from_pandas=True)
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        return None
+    return pd.array(strings, dtype=_STRING_DTYPE)
+
+
+def _is_null(value: Any) -> bool:
+    if value is None:
+        return True
+    return isinstance(value, float) and math.isnan(value)
+
+
+class TagFrame(NamedTuple):
+    """Features with their tags held as a dictionary-encoded long table.
+
+    ``features`` has one row per feature with the non-tag columns and the
+    promoted ``tags.<key>`` columns. ``tags`` has one row per remaining tag:
+    the position of its ``feature`` row and categorical ``key`` (without the
+    ``tags.`` prefix) and ``value`` columns.
+    """
+
+    features: pd.DataFrame
+    tags: pd.DataFrame
+
+    def to_wide(self, keys: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """Return the features with the tags (or only ``keys``) as ``tags.<key>`` columns."""
+
+        wanted = None if keys is None else {_tag_key(_tag_column(key)) for key in keys}
+        count = len(self.features)
+        positions = self.tags["feature"].to_numpy()
+        codes = self.tags["key"].cat.codes.to_numpy()
+        values = self.tags["value"].cat.categories.to_numpy(dtype=object)[
+            self.tags["value"].cat.codes.to_numpy()
+        ]
+
+        order = np.argsort(codes, kind="stable")
+        starts = np.searchsorted(
+            codes[order], np.arange(len(self.tags["key"].cat.categories) + 1)
+        )
+        columns: Dict[str, np.ndarray] = {}
+        for code, key in enumerate(self.tags["key"].cat.categories):
+            if wanted is not None and key not in wanted:
+                continue
+            start, end = starts[code], starts[code + 1]
+            selection = order[start:end]
+            if not len(selection):
+                continue
+            column = np.full(count, np.nan, dtype=object)
+            column[positions[selection]] = values[selection]
+            columns[f"{TAG_PREFIX}{key}"] = column
+
+        if not columns:
+            return self.features.copy()
+        return pd.concat(
+            [self.features, pd.DataFrame(columns, index=self.features.index)], axis=1
+        )
+
+
+class _ValueColumn:
+    """Values of one column with the positions of the rows that have them.
+
+    Missing rows are only filled in (with NaN) by :meth:`finish`, so a sparse
+    tag column costs memory for its values rather than for every row.
+    """
+
+    __slots__ = ("positions", "values")
+
+    def __init__(self) -> None:
+        self.positions = array("q")
+        self.values: List[Any] = []
+
+    def put(self, position: int, value: Any) -> bool:
+        self.positions.append(position)
+        self.values.append(value)
+        return True
+
+    def _dense(self, count: int) -> Union[List[Any], np.ndarray]:
+        values = self.values
+        if len(values) == count:
+            return values
+        dense = np.full(count, np.nan, dtype=object)
+        dense[np.frombuffer(self.positions, dtype=np.int64)] = np.fromiter(
+            values, dtype=object, count=len(values)
+        )
+        return dense
+
+    def finish(self, count: int) -> Any:
+        values = self._dense(count)
+        strings = _string_array(values)
+        if strings is not None:
+            return strings
+        return values.tolist() if isinstance(values, np.ndarray) else values
+
+    def finish_arrow(self, count: int) -> Any:
+        values = self._dense(count)
+        try:
+            return pa.array(values, from_pandas=True)
+        except (pa.ArrowTypeError, pa.ArrowInvalid):
+            # mixed value types: fall back to their text form
+            return pa.array(
+                [None if _is_null(value) else _text(value) for value in values],
+                type=pa.string(),
+            )
+
+
+class _IntColumn:
+    """Dense int64 column; ``put`` refuses gaps and non-int values."""
+
+    __slots__ = ("values",)
+
+    def __init__(self) -> None:
+        self.values = array("q")
+
+    def put(self, position: int, value: Any) -> bool:
+        if len(self.values) != position or value.__class__ is not int:
+            return False
+        try:
+            self.values.append(value)
+        except OverflowError:
+            return False
+        return True
+
+    def finish(self, count: int) -> Any:
+        if len(self.values) != count:
+            return self.demote().finish(count)
+        return np.frombuffer(self.values, dtype=np.int64)
+
+    def finish_arrow(self, count: int) -> Any:
+        if len(self.values) != count:
+            return self.demote().finish_arrow(count)
+        return pa.array(np.frombuffer(self.values, dtype=np.int64))
+
+    def demote(self) -> _ValueColumn:
+        column = _ValueColumn()
+        column.positions = array("q", range(len(self.values)))
+        column.values = self.values.tolist()
+        return column
+
+
+class _CategoryColumn:
+    """Dictionary-encoded string column; missing rows get code -1."""
+
+    __slots__ = ("codes", "index")
+
+    def __init__(self) -> None:
+        self.codes = array("i")
+        self.index: Dict[Any, int] = {}
+
+    def put(self, position: int, value: Any) -> bool:
+        try:
+            code = self.index.get(value)
+        except TypeError:
+            return False
+        if code is None:
+            code = self.index[value] = len(self.index)
+        codes = self.codes
+        if len(codes) < position:
+            codes.extend([-1] * (position - len(codes)))
+        codes.append(code)
+        return True
+
+    def _codes(self, count: int) -> np.ndarray:
+        codes = self.codes
+        if len(codes) < count:
+            codes.extend([-1] * (count - len(codes)))
+        return np.frombuffer(codes, dtype=np.int32)
+
+    def finish(self, count: int) -> pd.Categorical:
+        return pd.Categorical.from_codes(self._codes(count), categories=list(self.index))
+
+    def finish_arrow(self, count: int) -> Any:
+        codes = self._codes(count)
+        try:
+            dictionary = pa.array(list(self.index))
+        except (pa.ArrowTypeError, pa.ArrowInvalid):
+            return self.demote().finish_arrow(count)
+        return pa.DictionaryArray.from_arrays(pa.array(codes, mask=codes < 0), dictionary)
+
+    def demote(self) -> _ValueColumn:
+        column = _ValueColumn()
+        categories = list(self.index)
+        for position, code in enumerate(self.codes):
+            if code >= 0:
+                column.put(position, categories[code])
+        return column
+
+
+class _CoordinateColumn:
+    """``[[lon, lat], ...]`` sequences kept as flat float64 pairs plus row offsets.
+
+    :meth:`finish` rebuilds the nested lists pandas consumers expect, while
+    :meth:`finish_arrow` hands the buffers over as a GeoArrow style
+    ``list<fixed_size_list<double, 2>>`` array.
+    """
+
+    __slots__ = ("positions", "offsets", "coords")
+
+    def __init__(self) -> None:
+        self.positions = array("q")
+        self.offsets = array("q", [0])
+        self.coords = array("d")
+
+    def put(self, position: int, value: Any) -> bool:
+        coords = self.coords
+        start = len(coords)
+        try:
+            coords.extend(chain.from_iterable(value))
+            valid = len(coords) - start == 2 * len(value)
+        except TypeError:
+            valid = False
+        if not valid:
+            del coords[start:]
+            return False
+        self.positions.append(position)
+        self.offsets.append(len(coords) // 2)
+        return True
+
+    def _rows(self) -> List[List[List[float]]]:
+        pairs = np.frombuffer(self.coords, dtype=np.float64).reshape(-1, 2).tolist()
+        offsets = self.offsets.tolist()
+        return [pairs[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def finish(self, count: int) -> List[Any]:
+        rows = self._rows()
+        if len(rows) == count:
+            return rows
+        dense: List[Any] = [np.nan] * count
+        for position, row in zip(self.positions, rows):
+            dense[position] = row
+        return dense
+
+    def flat(self, count: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the ``(n, 2)`` coordinates and the ``count + 1`` row offsets.
+
+        Rows without coordinates get empty ranges.
+        """
+
+        coords = np.frombuffer(self.coords, dtype=np.float64).reshape(-1, 2)
+        offsets = np.frombuffer(self.offsets, dtype=np.int64)
+        if len(self.positions) == count:
+            return coords, offsets
+        lengths = np.zeros(count, dtype=np.int64)
+        lengths[np.frombuffer(self.positions, dtype=np.int64)] = np.diff(offsets)
+        dense = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(lengths, out=dense[1:])
+        return coords, dense
+
+    def finish_arrow(self, count: int) -> Any:
+        coords, offsets = self.flat(count)
+        pairs = pa.FixedSizeListArray.from_arrays(pa.array(coords.ravel()), 2)
+        mask = None
+        if len(self.positions) != count:
+            missing = np.ones(count, dtype=bool)
+            missing[np.frombuffer(self.positions, dtype=np.int64)] = False
+            mask = pa.array(missing)
+        return pa.LargeListArray.from_arrays(pa.array(offsets), pairs, mask=mask)
+
+    def demote(self) -> _ValueColumn:
+        column = _ValueColumn()
+        column.positions = array("q", self.positions)
+        column.values = self._rows()
+        return column
+
+
+def _text(value: Any) -> str:
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+
+
+def _import_pyarrow() -> Any:
+    if pa is None:  # pragma: no cover - depends on the environment
+        raise ImportError(
+            "Arrow batches require pyarrow; install it with `pip install earth_osm[parquet]`"
+        )
+    return pa
+
+
+class FeatureFrameBuilder:
+    """Build the wide feature DataFrame incrementally from flattened rows.
+
+    Each column is kept in its own buffer: ``id`` as int64, ``Region`` and
+    ``Type`` as categorical codes, ``lonlat`` as flat coordinate pairs and
+    every other column (``refs``, ``tags.<key>``) as a list of values. Null
+    values are skipped, so a column only exists once some row has a value
+    for it. A typed buffer that meets a value it cannot hold falls back to a
+    plain list. The results share the typed buffers, so no rows can be
+    appended once a ``build`` method has been called.
+    """
+
+    def __init__(self) -> None:
+        self._columns: Dict[str, Any] = {}
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _put(self, column: str, position: int, value: Any) -> None:
+        buffer = self._columns.get(column)
+        if buffer is None:
+            buffer = self._columns[column] = _new_column(column)
+        if not buffer.put(position, value):
+            buffer = self._columns[column] = buffer.demote()
+            buffer.put(position, value)
+
+    def append(self, row: Mapping[str, Any]) -> None:
+        position = self._count
+        for column, value in row.items():
+            if not _is_null(value):
+                self._put(column, position, value)
+        self._count = position + 1
+
+    def append_feature(self, feature: Any) -> None:
+        """Append a :class:`~earth_osm.stream.FeatureRow` without building its row dict."""
+
+        position = self._count
+        put = self._put
+        put("id", position, feature.id)
+        put("Region", position, feature.region)
+        put("Type", position, feature.type)
+        put("lonlat", position, feature.lonlat)
+        if feature.refs is not None:
+            put("refs", position, feature.refs)
+        # tag columns always use plain value buffers, so fill them directly
+        columns = self._columns
+        for key, value in feature.tags.items():
+            if _is_null(value):
+                continue
+            buffer = columns.get(TAG_PREFIX + key)
+            if buffer is None:
+                buffer = columns[TAG_PREFIX + key] = _ValueColumn()
+            buffer.positions.append(position)
+            buffer.values.append(value)
+        self._count = position + 1
+
+    def extend(self, rows: Iterable[Mapping[str, Any]]) -> "FeatureFrameBuilder":
+        for row in rows:
+            self.append(row)
+        return self
+
+    def extend_features(self, features: Iterable[Any]) -> "FeatureFrameBuilder":
+        for feature in features:
+            self.append_feature(feature)
+        return self
+
+    def build(self, start: int = 0) -> pd.DataFrame:
+        """Return the DataFrame of all appended rows, columns in first-seen order.
+
+        The index counts from ``start``.
+        """
+
+        count = self._count
+        data = {column: buffer.finish(count) for column, buffer in self._columns.items()}
+        logger.debug("Built feature frame of %d rows and %d columns", count, len(data))
+        return pd.DataFrame(data, index=pd.RangeIndex(start, start + count))
+
+    def build_arrow(self) -> Any:
+        """Return all appended rows as a :class:`pyarrow.RecordBatch`.
+
+        ``Region`` and ``Type`` are dictionary arrays and ``lonlat`` is a list
+        of ``[lon, lat]`` fixed size lists.
+        """
+
+        _import_pyarrow()
+        count = self._count
+        arrays = [buffer.finish_arrow(count) for buffer in self._columns.values()]
+        return pa.RecordBatch.from_arrays(arrays, names=list(self._columns))
+
+    def build_geoarrow(self) -> Any:
+        """Return all appended rows as a GeoArrow encoded :class:`pyarrow.Table`.
+
+        ``lonlat`` is replaced by a ``geometry`` column (see
+        :func:`~earth_osm.geoarrow.encode_geometry`) and the ``tags.<key>``
+        columns by one ``tags`` map column. The id and coordinate buffers are
+        handed to Arrow without copying.
+        """
+
+        _import_pyarrow()
+        count = self._count
+        columns = dict(self._columns)
+        coordinates = columns.pop("lonlat", None)
+        if not isinstance(coordinates, _CoordinateColumn):
+            coordinates = _coordinate_column(coordinates)
+        feature_types = columns["Type"].finish(count) if "Type" in columns else [None] * count
+
+        tag_columns = []
+        names, arrays = [], []
+        for column, buffer in columns.items():
+            if column.startswith(TAG_PREFIX) and isinstance(buffer, _ValueColumn):
+                tag_columns.append(
+                    (
+                        _tag_key(column),
+                        np.frombuffer(buffer.positions, dtype=np.int64),
+                        buffer.values,
+                    )
+                )
+                continue
+            names.append(column)
+            arrays.append(buffer.finish_arrow(count))
+
+        geometry_field, geometry = encode_geometry(
+            np.asarray(feature_types, dtype=object), *coordinates.flat(count)
+        )
+        fields = [pa.field(name, array.type) for name, array in zip(names, arrays)]
+        position = names.index("Type") + 1 if "Type" in names else len(names)
+        fields.insert(position, geometry_field)
+        arrays.insert(position, geometry)
+        fields.append(pa.field(TAGS_COLUMN, pa.map_(pa.string(), pa.string())))
+        arrays.append(encode_tags(count, tag_columns))
+        return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def _coordinate_column(buffer: Optional[_ValueColumn]) -> _CoordinateColumn:
+    """Re-read a demoted ``lonlat`` buffer, leaving out values that are not coordinates."""
+
+    column = _CoordinateColumn()
+    if buffer is not None:
+        for position, value in zip(buffer.positions, buffer.values):
+            column.put(position, value)
+    return column
+
+
+def _new_column(column: str) -> Any:
+    if column in INT_COLUMNS:
+        return _IntColumn()
+    if column in CATEGORY_COLUMNS:
+        return _CategoryColumn()
+    if column in COORDINATE_COLUMNS:
+        return _CoordinateColumn()
+    return _ValueColumn()
+
+
+def build_feature_frame(rows: Iterable[Mapping[str, Any]]) -> pd.DataFrame:
+    """Build the wide feature DataFrame of ``rows`` without all-null columns."""
+
+    return FeatureFrameBuilder().extend(rows).build()
+
+
+def iter_feature_batches(
+    features: Iterable[Any],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    as_arrow: bool = False,
+) -> Iterator[Any]:
+    """Group features into DataFrames (or Arrow record batches) of ``batch_size`` rows.
+
+    ``features`` may hold :class:`~earth_osm.stream.FeatureRow` objects or
+    flattened row dicts. DataFrame indexes continue across batches. Each
+    batch only has the columns its own rows have values for.
+    """
+
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be positive, got {batch_size}")
+    if as_arrow:
+        _import_pyarrow()
+
+    start = 0
+    builder = FeatureFrameBuilder()
+    for feature in features:
+        if isinstance(feature, Mapping):
+            builder.append(feature)
+        else:
+            builder.append_feature(feature)
+        if len(builder) >= batch_size:
+            yield builder.build_arrow() if as_arrow else builder.build(start)
+            start += len(builder)
+            builder = FeatureFrameBuilder()
+    if len(builder):
+        yield builder.build_arrow() if as_arrow else builder.build(start)
+
+
+def _hashable(value: Any) -> Any:
+    try:
+        hash(value)
+    except TypeError:
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def build_tag_frame(
+    rows: Iterable[Mapping[str, Any]],
+    tag_columns: Iterable[str] = (),
+) -> TagFrame:
+    """Build a :class:`TagFrame` from flattened feature rows.
+
+    ``tag_columns`` names the tag keys (``"voltage"`` or ``"tags.voltage"``)
+    kept as columns of ``features``; all other tags go to the long table.
+    Columns that are empty in every row are not created.
+    """
+
+    promoted = {_tag_column(key) for key in tag_columns}
+    columns: Dict[str, List[Any]] = {}
+    feature_positions = array("q")
+    key_codes = array("i")
+    value_codes = array("i")
+    key_index: Dict[str, int] = {}
+    value_index: Dict[Any, int] = {}
+
+    count = 0
+    for position, row in enumerate(rows):
+        for column, value in row.items():
+            if _is_null(value):
+                continue
+            if column.startswith(TAG_PREFIX) and column not in promoted:
+                key = _tag_key(column)
+                key_code = key_index.get(key)
+                if key_code is None:
+                    key_code = key_index[key] = len(key_index)
+                value = _hashable(value)
+                value_code = value_index.get(value)
+                if value_code is None:
+                    value_code = value_index[value] = len(value_index)
+                feature_positions.append(position)
+                key_codes.append(key_code)
+                value_codes.append(value_code)
+                continue
+
+            values = columns.get(column)
+            if values is None:
+                values = columns[column] = []
+            if len(values) < position:
+                values.extend([None] * (position - len(values)))
+            values.append(value)
+        count = position + 1
+
+    for values in columns.values():
+        if len(values) < count:
+            values.extend([None] * (count - len(values)))
+
+    features = pd.DataFrame(columns, index=pd.RangeIndex(count))
+    tags = pd.DataFrame(
+        {
+            "feature": np.frombuffer(feature_positions, dtype=np.int64),
+            "key": pd.Categorical.from_codes(
+                np.frombuffer(key_codes, dtype=np.int32), categories=list(key_index)
+            ),
+            "value": pd.Categorical.from_codes(
+                np.frombuffer(value_codes, dtype=np.int32), categories=list(value_index)
+            ),
+        }
+    )
+    logger.debug(
+        "Built %d features with %d tags over %d keys", count, len(tags), len(key_index)
+    )
+    return TagFrame(features, tags)
+
+
+__all__ = [
+    "CATEGORY_COLUMNS",
+    "COORDINATE_COLUMNS",
+    "DEFAULT_BATCH_SIZE",
+    "FeatureFrameBuilder",
+    "INT_COLUMNS",
+    "TAG_PREFIX",
+    "TagFrame",
+    "build_feature_frame",
+    "build_tag_frame",
+    "iter_feature_batches",
+]
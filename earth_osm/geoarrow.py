@@ -0,0 +1,163 @@
+"""GeoArrow encoding of feature coordinates and tags.
+
+Feature coordinates are held as one flat ``(n, 2)`` float64 array plus row
+offsets (see :func:`earth_osm.geometry.flatten_lonlat`). When all features of
+a result share a geometry kind, those buffers are wrapped as a native GeoArrow
+``point``, ``linestring`` or ``polygon`` array without copying the
+coordinates. Mixed results fall back to ``geoarrow.wkb``. Tags become a
+``map<string, string>`` column.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+from typing import Any, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import shapely
+
+from earth_osm.geometry import build_geometries
+
+logger = logging.getLogger("eo.geoarrow")
+
+GEOARROW_CRS = "OGC:CRS84"
+GEOMETRY_COLUMN = "geometry"
+TAGS_COLUMN = "tags"
+
+# Smallest coordinate count of a valid geometry per feature type, as in build_geometries.
+_MIN_COORDS = {"node": 1, "way": 2, "area": 4}
+_NATIVE_ENCODINGS = {
+    "node": "geoarrow.point",
+    "way": "geoarrow.linestring",
+    "area": "geoarrow.polygon",
+}
+
+
+def _import_pyarrow() -> Any:
+    try:
+        import pyarrow as pa
+    except ImportError as exc:  # pragma: no cover - depends on the environment
+        raise ImportError(
+            "Arrow results require pyarrow; install it with `pip install earth_osm[parquet]`"
+        ) from exc
+    return pa
+
+
+def _field(pa: Any, extension: str, storage_type: Any) -> Any:
+    metadata = {
+        b"ARROW:extension:name": extension.encode(),
+        b"ARROW:extension:metadata": json.dumps({"crs": GEOARROW_CRS}).encode(),
+    }
+    return pa.field(GEOMETRY_COLUMN, storage_type, metadata=metadata)
+
+
+def _native_kind(kinds: np.ndarray, counts: np.ndarray) -> Optional[str]:
+    """Return the feature type shared by all rows if it has a native encoding."""
+
+    if not len(kinds):
+        return None
+    kind = kinds[0]
+    if kind not in _NATIVE_ENCODINGS or not (kinds == kind).all():
+        return None
+    if kind == "node" and not (counts == 1).all():
+        return None
+    return kind
+
+
+def encode_geometry(
+    types: Union[Sequence[Any], np.ndarray],
+    coords: np.ndarray,
+    offsets: np.ndarray,
+) -> Tuple[Any, Any]:
+    """Return ``(field, array)`` holding the GeoArrow geometries of the rows.
+
+    ``coords`` is the contiguous ``(n, 2)`` coordinate array and row ``i``
+    owns ``coords[offsets[i]:offsets[i + 1]]``. Rows too short for their type
+    are null, as in :func:`~earth_osm.geometry.build_geometries`.
+    """
+
+    pa = _import_pyarrow()
+    kinds = np.asarray(types, dtype=object)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.diff(offsets)
+    kind = _native_kind(kinds, counts)
+
+    if kind is None or offsets[-1] > np.iinfo(np.int32).max:
+        geometries = build_geometries(kinds, coords, offsets)
+        array = pa.array(shapely.to_wkb(geometries), type=pa.binary(), from_pandas=True)
+        return _field(pa, "geoarrow.wkb", array.type), array
+
+    xy = pa.list_(pa.field("xy", pa.float64(), nullable=False), 2)
+    points = pa.FixedSizeListArray.from_arrays(pa.array(np.ravel(coords)), type=xy)
+    if kind == "node":
+        return _field(pa, _NATIVE_ENCODINGS[kind], points.type), points
+
+    short = counts < _MIN_COORDS[kind]
+    mask = pa.array(short) if short.any() else None
+    if kind == "way":
+        array = pa.ListArray.from_arrays(pa.array(offsets.astype(np.int32)), points, mask=mask)
+    else:
+        rings = pa.ListArray.from_arrays(pa.array(offsets.astype(np.int32)), points)
+        array = pa.ListArray.from_arrays(
+            pa.array(np.arange(len(kinds) + 1, dtype=np.int32)), rings, mask=mask
+        )
+    return _field(pa, _NATIVE_ENCODINGS[kind], array.type), array
+
+
+def _text(value: Any) -> str:
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+
+
+def encode_tags(
+    count: int,
+    columns: Sequence[Tuple[str, np.ndarray, List[Any]]],
+) -> Any:
+    """Return a ``map<string, string>`` array of ``count`` rows from per-key columns.
+
+    Each column is ``(key, positions, values)`` with the rows that have the
+    tag and their values. Map entries follow the order of ``columns``.
+    """
+
+    pa = _import_pyarrow()
+    map_type = pa.map_(pa.string(), pa.string())
+    if not columns:
+        return pa.MapArray.from_arrays(
+            pa.array(np.zeros(count + 1, dtype=np.int32)),
+            pa.array([], type=pa.string()),
+            pa.array([], type=pa.string()),
+            type=map_type,
+        )
+
+    keys = pa.array([key for key, _, _ in columns], type=pa.string())
+    positions = np.concatenate([positions for _, positions, _ in columns])
+    codes = np.concatenate(
+        [
+            np.full(len(positions), code, dtype=np.int32)
+            for code, (_, positions, _) in enumerate(columns)
+        ]
+    )
+    values = np.fromiter(
+        (_text(value) for _, _, column in columns for value in column),
+        dtype=object,
+        count=len(positions),
+    )
+
+    order = np.lexsort((codes, positions))
+    offsets = np.zeros(count + 1, dtype=np.int32)
+    np.cumsum(np.bincount(positions, minlength=count), out=offsets[1:])
+    return pa.MapArray.from_arrays(
+        pa.array(offsets),
+        keys.take(pa.array(codes[order])),
+        pa.array(values[order], type=pa.string()),
+        type=map_type,
+    )
+
+
+__all__ = [
+    "GEOARROW_CRS",
+    "GEOMETRY_COLUMN",
+    "TAGS_COLUMN",
+    "encode_geometry",
+    "encode_tags",
+]
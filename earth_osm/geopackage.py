@@ -0,0 +1,488 @@
+"""GeoPackage writer built on the standard library ``sqlite3`` module.
+
+Rows are buffered and inserted in batches with ``executemany`` inside a
+single write transaction per table. Geometries are encoded as GeoPackage
+binary (``GP`` header with an xy envelope followed by WKB, see
+:func:`encode_geometries`) from shapely geometries built a batch at a time.
+
+The spatial index is the ``gpkg_rtree_index`` extension. Its maintenance
+triggers call ``ST_*`` SQL functions that plain SQLite does not provide, so
+they are dropped while a batch load is in progress. The R-tree rows are
+inserted directly from the computed envelopes, and the triggers are
+recreated before commit. Files stay editable by GDAL/QGIS afterwards.
+
+Several tables can live in one file. ``GeoPackageWriter`` replaces its
+table by default; with ``append=True`` it adds rows to an existing table,
+adding any columns that table does not have yet, so that several outputs
+can share one table.
+
+Reference: https://www.geopackage.org/spec130/
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import struct
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import shapely
+
+from earth_osm.geometry import lonlat_to_geometries
+
+logger = logging.getLogger("eo.geopackage")
+
+GPKG_APPLICATION_ID = 0x47504B47  # "GPKG"
+GPKG_USER_VERSION = 10300
+GPKG_BATCH_SIZE = 10_000
+GEOMETRY_COLUMN = "geom"
+SRS_ID = 4326
+# Seconds to wait for another process writing to the same file.
+LOCK_TIMEOUT = 3600.0
+
+# Magic, version 0, flags: little endian with an [minx, maxx, miny, maxy] envelope.
+_HEADER = struct.Struct("<2sBBi4d")
+_HEADER_FLAGS = 0b0000_0011
+
+_WGS84_WKT = (
+    'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,'
+    'AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,'
+    'AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,'
+    'AUTHORITY["EPSG","9122"]],AXIS["Latitude",NORTH],AXIS["Longitude",EAST],'
+    'AUTHORITY["EPSG","4326"]]'
+)
+
+_CORE_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (
+        srs_name TEXT NOT NULL,
+        srs_id INTEGER NOT NULL PRIMARY KEY,
+        organization TEXT NOT NULL,
+        organization_coordsys_id INTEGER NOT NULL,
+        definition TEXT NOT NULL,
+        description TEXT)""",
+    """CREATE TABLE IF NOT EXISTS gpkg_contents (
+        table_name TEXT NOT NULL PRIMARY KEY,
+        data_type TEXT NOT NULL,
+        identifier TEXT UNIQUE,
+        description TEXT DEFAULT '',
+        last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+        min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE,
+        srs_id INTEGER,
+        CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id)
+            REFERENCES gpkg_spatial_ref_sys(srs_id))""",
+    """CREATE TABLE IF NOT EXISTS gpkg_geometry_columns (
+        table_name TEXT NOT NULL,
+        column_name TEXT NOT NULL,
+        geometry_type_name TEXT NOT NULL,
+        srs_id INTEGER NOT NULL,
+        z TINYINT NOT NULL,
+        m TINYINT NOT NULL,
+        CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name),
+        CONSTRAINT uk_gc_table_name UNIQUE (table_name),
+        CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name),
+        CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id))""",
+    """CREATE TABLE IF NOT EXISTS gpkg_extensions (
+        table_name TEXT,
+        column_name TEXT,
+        extension_name TEXT NOT NULL,
+        definition TEXT NOT NULL,
+        scope TEXT NOT NULL,
+        CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name))""",
+)
+
+_SPATIAL_REF_SYS = (
+    (
+        "Undefined cartesian SRS",
+        -1,
+        "NONE",
+        -1,
+        "undefined",
+        "undefined cartesian coordinate reference system",
+    ),
+    (
+        "Undefined geographic SRS",
+        0,
+        "NONE",
+        0,
+        "undefined",
+        "undefined geographic coordinate reference system",
+    ),
+    (
+        "WGS 84 geodetic",
+        SRS_ID,
+        "EPSG",
+        SRS_ID,
+        _WGS84_WKT,
+        "longitude/latitude coordinates in decimal degrees on the WGS 84 spheroid",
+    ),
+)
+
+# The rtree triggers of the spec, with {t} the table, {r} the rtree table and
+# {c} the geometry column (all quoted).
+_RTREE_TRIGGERS = {
+    "insert": """AFTER INSERT ON {t}
+        WHEN (new.{c} NOT NULL AND NOT ST_IsEmpty(NEW.{c}))
+        BEGIN
+          INSERT OR REPLACE INTO {r} VALUES (
+            NEW.fid, ST_MinX(NEW.{c}), ST_MaxX(NEW.{c}), ST_MinY(NEW.{c}), ST_MaxY(NEW.{c}));
+        END""",
+    "update1": """AFTER UPDATE OF {c} ON {t}
+        WHEN OLD.fid = NEW.fid AND (NEW.{c} NOTNULL AND NOT ST_IsEmpty(NEW.{c}))
+        BEGIN
+          INSERT OR REPLACE INTO {r} VALUES (
+            NEW.fid, ST_MinX(NEW.{c}), ST_MaxX(NEW.{c}), ST_MinY(NEW.{c}), ST_MaxY(NEW.{c}));
+        END""",
+    "update2": """AFTER UPDATE OF {c} ON {t}
+        WHEN OLD.fid = NEW.fid AND (NEW.{c} ISNULL OR ST_IsEmpty(NEW.{c}))
+        BEGIN
+          DELETE FROM {r} WHERE id = OLD.fid;
+        END""",
+    "update3": """AFTER UPDATE ON {t}
+        WHEN OLD.fid != NEW.fid AND (NEW.{c} NOTNULL AND NOT ST_IsEmpty(NEW.{c}))
+        BEGIN
+          DELETE FROM {r} WHERE id = OLD.fid;
+          INSERT OR REPLACE INTO {r} VALUES (
+            NEW.fid, ST_MinX(NEW.{c}), ST_MaxX(NEW.{c}), ST_MinY(NEW.{c}), ST_MaxY(NEW.{c}));
+        END""",
+    "update4": """AFTER UPDATE ON {t}
+        WHEN OLD.fid != NEW.fid AND (NEW.{c} ISNULL OR ST_IsEmpty(NEW.{c}))
+        BEGIN
+          DELETE FROM {r} WHERE id IN (OLD.fid, NEW.fid);
+        END""",
+    "delete": """AFTER DELETE ON {t}
+        WHEN old.{c} NOT NULL
+        BEGIN
+          DELETE FROM {r} WHERE id = OLD.fid;
+        END""",
+}
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _column_type(name: str) -> str:
+    return "INTEGER" if name == "id" else "TEXT"
+
+
+def _sql_value(value: Any, column_type: str) -> Any:
+    if value is None:
+        return None
+    if column_type == "INTEGER":
+        return int(value)
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+def encode_geometries(
+    geometries: np.ndarray, srs_id: int = SRS_ID
+) -> Tuple[List[Optional[bytes]], np.ndarray]:
+    """Return GeoPackage binary blobs and ``(n, 4)`` xy bounds of shapely ``geometries``.
+
+    Missing geometries give ``None`` blobs and NaN bounds.
+    """
+
+    bounds = shapely.bounds(geometries)
+    wkbs = shapely.to_wkb(geometries, byte_order=1)
+    blobs: List[Optional[bytes]] = []
+    for wkb, (min_x, min_y, max_x, max_y) in zip(wkbs.tolist(), bounds.tolist()):
+        if wkb is None:
+            blobs.append(None)
+            continue
+        header = _HEADER.pack(b"GP", 0, _HEADER_FLAGS, srs_id, min_x, max_x, min_y, max_y)
+        blobs.append(header + wkb)
+    return blobs, bounds
+
+
+def ensure_geopackage(connection: sqlite3.Connection) -> None:
+    """Create the GeoPackage core tables if ``connection`` does not have them yet."""
+
+    connection.execute(f"PRAGMA application_id = {GPKG_APPLICATION_ID}")
+    connection.execute(f"PRAGMA user_version = {GPKG_USER_VERSION}")
+    for statement in _CORE_SCHEMA:
+        connection.execute(statement)
+    connection.executemany(
+        "INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)",
+        _SPATIAL_REF_SYS,
+    )
+
+
+def drop_feature_table(connection: sqlite3.Connection, table: str) -> None:
+    """Remove ``table``, its R-tree and its metadata rows if they exist."""
+
+    connection.execute(f"DROP TABLE IF EXISTS {_quote(f'rtree_{table}_{GEOMETRY_COLUMN}')}")
+    connection.execute(f"DROP TABLE IF EXISTS {_quote(table)}")
+    for metadata in ("gpkg_extensions", "gpkg_geometry_columns", "gpkg_contents"):
+        connection.execute(f"DELETE FROM {metadata} WHERE table_name = ?", (table,))
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Open ``path`` in autocommit mode; transactions are managed explicitly."""
+
+    return sqlite3.connect(path, timeout=LOCK_TIMEOUT, isolation_level=None)
+
+
+def prepare_geopackage(path: str, table: Optional[str] = None) -> None:
+    """Create the GeoPackage at ``path`` if needed and drop ``table`` from it.
+
+    Called once before several writers add tables to, or append to the
+    shared ``table`` of, the same file.
+    """
+
+    connection = connect(path)
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        ensure_geopackage(connection)
+        if table is not None:
+            drop_feature_table(connection, table)
+        connection.execute("COMMIT")
+    finally:
+        connection.close()
+
+
+class GeoPackageWriter:
+    """Write feature rows into one table of a GeoPackage.
+
+    ``columns`` fixes the property columns: ``id`` is stored as INTEGER,
+    ``refs``/``other_tags`` as JSON text and tag columns as TEXT. Rows are
+    only visible to readers once ``close`` commits the transaction.
+    """
+
+    label = "GPKG"
+
+    def __init__(
+        self,
+        path: str,
+        table: str,
+        columns: Sequence[str],
+        append: bool = False,
+        batch_size: int = GPKG_BATCH_SIZE,
+    ):
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive")
+        self.path = path
+        self.table = table
+        self.append = append
+        self.batch_size = batch_size
+        self.columns = [(column, _column_type(column)) for column in columns]
+        self.feature_count = 0
+        self._rtree = f"rtree_{table}_{GEOMETRY_COLUMN}"
+        self._created_file = not os.path.exists(path)
+        self._pending: List[Tuple[Any, Any, Dict[str, Any]]] = []
+        self._extent = [np.inf, np.inf, -np.inf, -np.inf]
+        self._types: Set[int] = set()
+
+        connection = connect(path)
+        self._conn: Optional[sqlite3.Connection] = connection
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            ensure_geopackage(connection)
+            if not append:
+                drop_feature_table(connection, table)
+            self._prepare_table()
+        except BaseException:
+            self.abort()
+            raise
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            raise RuntimeError(f"GeoPackage writer for {self.path}:{self.table} is closed")
+        return self._conn
+
+    def _prepare_table(self) -> None:
+        connection = self._connection()
+        table = _quote(self.table)
+        exists = connection.execute(
+            "SELECT 1 FROM gpkg_contents WHERE table_name = ?", (self.table,)
+        ).fetchone()
+
+        if not exists:
+            definitions = [
+                "fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL",
+                f"{_quote(GEOMETRY_COLUMN)} GEOMETRY",
+            ]
+            definitions += [
+                f"{_quote(name)} {column_type}" for name, column_type in self.columns
+            ]
+            connection.execute(f"CREATE TABLE {table} ({', '.join(definitions)})")
+            connection.execute(
+                "INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) "
+                "VALUES (?, 'features', ?, ?)",
+                (self.table, self.table, SRS_ID),
+            )
+            connection.execute(
+                "INSERT INTO gpkg_geometry_columns VALUES (?, ?, 'GEOMETRY', ?, 0, 0)",
+                (self.table, GEOMETRY_COLUMN, SRS_ID),
+            )
+            connection.execute(
+                f"CREATE VIRTUAL TABLE {_quote(self._rtree)} "
+                "USING rtree(id, minx, maxx, miny, maxy)"
+            )
+            connection.execute(
+                "INSERT INTO gpkg_extensions VALUES (?, ?, 'gpkg_rtree_index', "
+                "'http://www.geopackage.org/spec120/#extension_rtree', 'write-only')",
+                (self.table, GEOMETRY_COLUMN),
+            )
+        else:
+            present = {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}
+            for name, column_type in self.columns:
+                if name not in present:
+                    connection.execute(
+                        f"ALTER TABLE {table} ADD COLUMN {_quote(name)} {column_type}"
+                    )
+
+        for suffix in _RTREE_TRIGGERS:
+            connection.execute(f"DROP TRIGGER IF EXISTS {_quote(f'{self._rtree}_{suffix}')}")
+
+        # Explicit fids let the R-tree rows be inserted alongside each batch.
+        last_fid = connection.execute(f"SELECT MAX(fid) FROM {table}").fetchone()[0] or 0
+        sequence = connection.execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = ?", (self.table,)
+        ).fetchone()
+        self._next_fid = max(last_fid, sequence[0] if sequence else 0) + 1
+
+        placeholders = ", ".join("?" * (len(self.columns) + 2))
+        names = ", ".join(
+            ["fid", _quote(GEOMETRY_COLUMN)] + [_quote(name) for name, _ in self.columns]
+        )
+        self._insert = f"INSERT INTO {table} ({names}) VALUES ({placeholders})"
+
+    def write(
+        self,
+        properties: Dict[str, Any],
+        feature_type: Optional[str],
+        lonlat: Optional[Sequence[Sequence[float]]],
+    ) -> None:
+        self._pending.append((feature_type, lonlat, properties))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        connection = self._connection()
+        pending, self._pending = self._pending, []
+
+        geometries = lonlat_to_geometries(
+            [feature_type for feature_type, _, _ in pending],
+            [lonlat for _, lonlat, _ in pending],
+        )
+        blobs, bounds = encode_geometries(geometries)
+        self._types.update(
+            shapely.get_type_id(geometries[shapely.is_geometry(geometries)]).tolist()
+        )
+
+        first = self._next_fid
+        self._next_fid += len(pending)
+        rows = []
+        for fid, blob, (_, _, properties) in zip(range(first, self._next_fid), blobs, pending):
+            values = [
+                _sql_value(properties.get(name), column_type)
+                for name, column_type in self.columns
+            ]
+            rows.append((fid, blob, *values))
+        connection.executemany(self._insert, rows)
+
+        indexed = ~np.isnan(bounds[:, 0])
+        fids = np.arange(first, self._next_fid)[indexed]
+        boxes = bounds[indexed]
+        connection.executemany(
+            f"INSERT INTO {_quote(self._rtree)} VALUES (?, ?, ?, ?, ?)",
+            zip(
+                fids.tolist(),
+                boxes[:, 0].tolist(),
+                boxes[:, 2].tolist(),
+                boxes[:, 1].tolist(),
+                boxes[:, 3].tolist(),
+            ),
+        )
+        if len(boxes):
+            self._extent = [
+                min(self._extent[0], float(boxes[:, 0].min())),
+                min(self._extent[1], float(boxes[:, 1].min())),
+                max(self._extent[2], float(boxes[:, 2].max())),
+                max(self._extent[3], float(boxes[:, 3].max())),
+            ]
+        self.feature_count += len(pending)
+
+    def _finish_table(self) -> None:
+        connection = self._connection()
+        names = {
+            "t": _quote(self.table),
+            "r": _quote(self._rtree),
+            "c": _quote(GEOMETRY_COLUMN),
+        }
+        for suffix, body in _RTREE_TRIGGERS.items():
+            connection.execute(
+                f"CREATE TRIGGER {_quote(f'{self._rtree}_{suffix}')} {body.format(**names)}"
+            )
+
+        if np.isfinite(self._extent[0]):
+            connection.execute(
+                "UPDATE gpkg_contents SET "
+                "min_x = min(coalesce(min_x, :min_x), :min_x), "
+                "min_y = min(coalesce(min_y, :min_y), :min_y), "
+                "max_x = max(coalesce(max_x, :max_x), :max_x), "
+                "max_y = max(coalesce(max_y, :max_y), :max_y) "
+                "WHERE table_name = :table",
+                dict(
+                    zip(("min_x", "min_y", "max_x", "max_y"), self._extent), table=self.table
+                ),
+            )
+        if len(self._types) == 1 and not self.append:
+            type_name = shapely.GeometryType(next(iter(self._types))).name
+            connection.execute(
+                "UPDATE gpkg_geometry_columns SET geometry_type_name = ? WHERE table_name = ?",
+                (type_name, self.table),
+            )
+        connection.execute(
+            "UPDATE gpkg_contents SET last_change = strftime('%Y-%m-%dT%H:%M:%fZ','now') "
+            "WHERE table_name = ?",
+            (self.table,),
+        )
+
+    def close(self) -> None:
+        if self._conn is None:
+            return
+        try:
+            self._flush()
+            self._finish_table()
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self.abort()
+            raise
+        self._conn.close()
+        self._conn = None
+        logger.debug("Wrote %d features to %s:%s", self.feature_count, self.path, self.table)
+
+    def abort(self) -> None:
+        """Roll back the rows of this writer, used when the export fails."""
+
+        self._pending = []
+        if self._conn is not None:
+            if self._conn.in_transaction:
+                self._conn.execute("ROLLBACK")
+            self._conn.close()
+            self._conn = None
+        if self._created_file and os.path.exists(self.path) and self._is_empty():
+            os.remove(self.path)
+
+    def _is_empty(self) -> bool:
+        connection = connect(self.path)
+        try:
+            return connection.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0
+        finally:
+            connection.close()
+
+
+__all__ = [
+    "GPKG_BATCH_SIZE",
+    "GeoPackageWriter",
+    "encode_geometries",
+    "ensure_geopackage",
+    "prepare_geopackage",
+]
@@ -0,0 +1,183 @@
+"""Streaming GeoParquet writer for exported feature rows.
+
+Rows are buffered in plain Python lists and flushed as one Parquet row group
+whenever ``row_group_size`` rows have accumulated, so memory use stays bounded
+regardless of the size of the extract. The schema is fixed up front:
+
+* ``id`` (int64), ``Region`` and ``Type`` (dictionary encoded strings)
+* ``geometry`` as WKB, described by GeoParquet ``geo`` metadata
+* ``refs`` (list of int64, null for nodes)
+* ``tags`` as a ``map<string, string>`` holding every OSM tag of the row
+
+Keeping all tags in a map column means the schema never depends on which keys
+appear later in the stream, and no pandas objects are created on the way.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from pyproj import CRS
+
+from earth_osm.geometry import GEOMETRY_TYPES, lonlat_to_wkb
+
+logger = logging.getLogger("eo.geoparquet")
+
+PARQUET_ROW_GROUP_SIZE = 65536
+GEOPARQUET_VERSION = "1.0.0"
+
+_RESERVED_COLUMNS = {"id", "Region", "Type", "lonlat", "refs", "other_tags"}
+
+
+def _import_pyarrow() -> Tuple[Any, Any]:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as exc:  # pragma: no cover - depends on the environment
+        raise ImportError(
+            "out_format='parquet' requires pyarrow; install it with "
+            "`pip install earth_osm[parquet]`"
+        ) from exc
+    return pa, pq
+
+
+def parquet_schema() -> Any:
+    pa, _ = _import_pyarrow()
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema(
+        [
+            ("id", pa.int64()),
+            ("Region", dictionary),
+            ("Type", dictionary),
+            ("geometry", pa.binary()),
+            ("refs", pa.list_(pa.int64())),
+            ("tags", pa.map_(pa.string(), pa.string())),
+        ]
+    )
+
+
+def _row_tags(record: Dict[str, Any]) -> List[Tuple[str, str]]:
+    tags: Dict[str, str] = {}
+    for key, value in record.items():
+        if key in _RESERVED_COLUMNS or value is None:
+            continue
+        tag_key = key[5:] if key.startswith("tags.") else key
+        tags[tag_key] = (
+            value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+        )
+
+    other_tags = record.get("other_tags")
+    if isinstance(other_tags, dict):
+        for key, value in other_tags.items():
+            if value is None:
+                continue
+            tag_key = key[5:] if key.startswith("tags.") else key
+            tags.setdefault(tag_key, value if isinstance(value, str) else str(value))
+
+    return list(tags.items())
+
+
+class GeoParquetWriter:
+    """Append feature rows to a GeoParquet file in bounded row groups."""
+
+    def __init__(self, path: str, row_group_size: int = PARQUET_ROW_GROUP_SIZE):
+        if row_group_size <= 0:
+            raise ValueError("row_group_size must be positive")
+        pa, pq = _import_pyarrow()
+        self.path = path
+        self.row_group_size = row_group_size
+        self._schema = parquet_schema()
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._rows: Dict[str, List[Any]] = {name: [] for name in self._schema.names}
+        self._lonlat: List[Any] = []
+        self._geometry_types: Set[str] = set()
+        self._bbox: Optional[List[float]] = None
+        self.row_count = 0
+
+    def write(self, record: Dict[str, Any]) -> None:
+        feature_type = record.get("Type")
+        self._rows["id"].append(record.get("id"))
+        self._rows["Region"].append(record.get("Region"))
+        self._rows["Type"].append(feature_type)
+        self._rows["refs"].append(record.get("refs"))
+        self._rows["tags"].append(_row_tags(record))
+        self._lonlat.append(record.get("lonlat") or [])
+        if feature_type in GEOMETRY_TYPES:
+            self._geometry_types.add(GEOMETRY_TYPES[feature_type])
+
+        if len(self._lonlat) >= self.row_group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._lonlat:
+            return
+        pa, _ = _import_pyarrow()
+
+        wkb, bbox = lonlat_to_wkb(self._rows["Type"], self._lonlat)
+        if bbox is not None:
+            if self._bbox is None:
+                self._bbox = list(bbox)
+            else:
+                self._bbox = [
+                    min(self._bbox[0], bbox[0]),
+                    min(self._bbox[1], bbox[1]),
+                    max(self._bbox[2], bbox[2]),
+                    max(self._bbox[3], bbox[3]),
+                ]
+
+        arrays = []
+        for field in self._schema:
+            values = wkb if field.name == "geometry" else self._rows[field.name]
+            if pa.types.is_dictionary(field.type):
+                arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array(values, type=field.type))
+        table = pa.Table.from_arrays(arrays, schema=self._schema)
+        self._writer.write_table(table, row_group_size=len(table))
+
+        self.row_count += len(table)
+        self._lonlat = []
+        for values in self._rows.values():
+            values.clear()
+
+    def _geo_metadata(self) -> Dict[str, Any]:
+        column: Dict[str, Any] = {
+            "encoding": "WKB",
+            "geometry_types": sorted(self._geometry_types),
+            "crs": CRS.from_epsg(4326).to_json_dict(),
+        }
+        if self._bbox is not None:
+            column["bbox"] = self._bbox
+        return {
+            "version": GEOPARQUET_VERSION,
+            "primary_column": "geometry",
+            "columns": {"geometry": column},
+        }
+
+    def close(self) -> None:
+        if self._writer is None:
+            return
+        self.flush()
+        self._writer.add_key_value_metadata({"geo": json.dumps(self._geo_metadata())})
+        self._writer.close()
+        self._writer = None
+        logger.debug("Wrote %d rows to %s", self.row_count, self.path)
+
+    def abort(self) -> None:
+        """Close the file and remove it, used when the export fails."""
+
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+__all__ = [
+    "GeoParquetWriter",
+    "PARQUET_ROW_GROUP_SIZE",
+    "parquet_schema",
+]
@@ -15,10 +15,12 @@ import logging
 import os
 from collections import namedtuple
 from datetime import datetime
+from functools import lru_cache
 from typing import Optional
 
 import geopandas as gpd
 import pandas as pd
+from shapely.geometry.base import BaseGeometry
 
 from earth_osm.gfk_download import download_sitemap
 from earth_osm.planet import (
@@ -47,6 +49,26 @@ def get_geom_sitemap(progress_bar=True):
     return gpd.read_file(geom_sitemap)
 
 
+@lru_cache(maxsize=1)
+def _load_geom_index() -> gpd.GeoDataFrame:
+    return get_geom_sitemap(progress_bar=False).set_index("id")
+
+
+def get_region_geometry(id: str) -> Optional[BaseGeometry]:
+    """
+    Takes a region id (eg. germany) and returns its boundary polygon as published
+    in the Geofabrik index. Returns None for the planet, which has no boundary.
+    Raises KeyError if id is not found
+    """
+    if str(id) == PLANET_REGION_ID:
+        return None
+
+    geom_index = _load_geom_index()
+    if id not in geom_index.index:
+        raise KeyError(f"{id} has no boundary in the Geofabrik index")
+    return geom_index.loc[id, "geometry"]
+
+
 def get_root_list():
     """
     Returns a list of regions without parents (i.e continents)
@@ -0,0 +1,107 @@
+"""Compact set of OSM ids for streaming deduplication.
+
+Ids are split into pages of ``2**16`` consecutive values. A page holds a
+sorted ``array('H')`` of the low 16 bits of its ids while it is sparse and
+switches to an 8 KiB bitmap once it holds more than :data:`ARRAY_LIMIT` ids,
+so memory stays proportional to the number of ids rather than their range.
+"""
+
+from __future__ import annotations
+
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, Iterator, Union
+
+PAGE_BITS = 16
+PAGE_MASK = (1 << PAGE_BITS) - 1
+# A sorted page of this many 2 byte entries is as large as a bitmap page.
+ARRAY_LIMIT = (1 << PAGE_BITS) // 16
+_BITMAP_BYTES = (1 << PAGE_BITS) // 8
+
+
+def element_key(element: str, osm_id: int) -> int:
+    """Return one integer key for an element type (``node``/``way``) and id."""
+
+    return (int(osm_id) << 1) | (element != "node")
+
+
+class IdSet:
+    """Set of integer ids stored in sparse and bitmap pages."""
+
+    def __init__(self, values: Iterable[int] = ()):
+        self._pages: Dict[int, Union[array, bytearray]] = {}
+        self._count = 0
+        for value in values:
+            self.add(value)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, value: int) -> bool:
+        page = self._pages.get(value >> PAGE_BITS)
+        if page is None:
+            return False
+        low = value & PAGE_MASK
+        if isinstance(page, bytearray):
+            return bool(page[low >> 3] & (1 << (low & 7)))
+        index = bisect_left(page, low)
+        return index < len(page) and page[index] == low
+
+    def __iter__(self) -> Iterator[int]:
+        for page_no in sorted(self._pages):
+            page = self._pages[page_no]
+            base = page_no << PAGE_BITS
+            if isinstance(page, bytearray):
+                for byte_index, byte in enumerate(page):
+                    while byte:
+                        bit = byte & -byte
+                        yield base + (byte_index << 3) + bit.bit_length() - 1
+                        byte ^= bit
+            else:
+                for low in page:
+                    yield base + low
+
+    def add(self, value: int) -> bool:
+        """Add ``value`` and return ``True`` unless it was already present."""
+
+        page_no = value >> PAGE_BITS
+        low = value & PAGE_MASK
+        page = self._pages.get(page_no)
+        if page is None:
+            self._pages[page_no] = array("H", (low,))
+            self._count += 1
+            return True
+
+        if isinstance(page, bytearray):
+            byte, bit = low >> 3, 1 << (low & 7)
+            if page[byte] & bit:
+                return False
+            page[byte] |= bit
+            self._count += 1
+            return True
+
+        index = bisect_left(page, low)
+        if index < len(page) and page[index] == low:
+            return False
+        if len(page) < ARRAY_LIMIT:
+            page.insert(index, low)
+        else:
+            bitmap = bytearray(_BITMAP_BYTES)
+            for known in page:
+                bitmap[known >> 3] |= 1 << (known & 7)
+            bitmap[low >> 3] |= 1 << (low & 7)
+            self._pages[page_no] = bitmap
+        self._count += 1
+        return True
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the pages (without the dictionary overhead)."""
+
+        return sum(
+            len(page) if isinstance(page, bytearray) else page.itemsize * len(page)
+            for page in self._pages.values()
+        )
+
+
+__all__ = ["ARRAY_LIMIT", "IdSet", "PAGE_BITS", "element_key"]
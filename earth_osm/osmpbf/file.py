@@ -13,6 +13,9 @@ Modified from esy-osm-pbf/file.py
 import struct
 import zlib
 from itertools import accumulate
+from typing import Any, Dict, Sequence, Tuple
+
+import numpy as np
 
 from . import Node, Relation, Way, fileformat_pb2, osmformat_pb2
 
@@ -114,6 +117,56 @@ def iter_nodes(block, strmap, group):
         yield (id, tags, (lon, lat))
 
 
+def decode_dense_arrays(
+    block: Any, group: Any
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Decode the dense nodes of a primitive group into numpy arrays.
+
+    Returns ``(ids, lons, lats, tag_starts, tag_ends)`` where the tags of node
+    ``i`` occupy ``group.dense.keys_vals[tag_starts[i]:tag_ends[i]]``. The
+    coordinates are accumulated in the same order as :func:`iter_nodes`, so
+    both decoders yield identical values.
+    """
+
+    dense = group.dense
+    ids = np.cumsum(np.asarray(dense.id, dtype=np.int64))
+    count = len(ids)
+
+    granularity = block.granularity or 100
+    lat_offset = block.lat_offset or 0
+    lon_offset = block.lon_offset or 0
+    coord_scale = 0.000000001
+    lats = np.cumsum(
+        coord_scale * (lat_offset + granularity * np.asarray(dense.lat, dtype=np.int64))
+    )
+    lons = np.cumsum(
+        coord_scale * (lon_offset + granularity * np.asarray(dense.lon, dtype=np.int64))
+    )
+
+    keys_vals = np.asarray(dense.keys_vals, dtype=np.int64)
+    if len(keys_vals) == 0:
+        tag_starts = np.zeros(count, dtype=np.int64)
+        tag_ends = tag_starts
+    else:
+        tag_ends = np.flatnonzero(keys_vals == 0)[:count]
+        tag_starts = np.empty_like(tag_ends)
+        tag_starts[:1] = 0
+        tag_starts[1:] = tag_ends[:-1] + 1
+
+    return ids, lons, lats, tag_starts, tag_ends
+
+
+def dense_node_tags(
+    strmap: Sequence[str], keys_vals: Sequence[int], start: int, end: int
+) -> Dict[str, str]:
+    """
+    Decode the tags of one dense node given its ``keys_vals`` span.
+    """
+
+    return {strmap[keys_vals[pos]]: strmap[keys_vals[pos + 1]] for pos in range(start, end, 2)}
+
+
 def iter_ways(block, strmap, group):
     for way in group.ways:
         tags = {strmap[k]: strmap[v] for k, v in zip(way.keys, way.vals)}
@@ -8,9 +8,14 @@ This module provides functions to fetch OSM data from the Overpass API.
 
 import json
 import logging
-from datetime import datetime
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from textwrap import dedent
-from typing import Dict, Iterator, List, Optional, Sequence
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 
 import requests
 from requests.adapters import HTTPAdapter
@@ -19,8 +24,16 @@ from urllib3.util.retry import Retry
 logger = logging.getLogger("eo.overpass")
 
 OVERPASS_ENDPOINT = "https://overpass-api.de/api/interpreter"
+OVERPASS_STATUS_ENDPOINT = "https://overpass-api.de/api/status"
 REQUEST_TIMEOUT = 600
 QUERY_TIMEOUT = 300
+# overpass-api.de grants two concurrent queries per client address.
+MAX_CONCURRENT_REQUESTS = 2
+MAX_REQUEST_ATTEMPTS = 5
+# Responses telling the client to come back later rather than failing.
+RATE_LIMIT_STATUSES = (429, 503, 504)
+MAX_RETRY_DELAY = 300
+STATUS_TIMEOUT = 30
 REQUEST_HEADERS = {
     "User-Agent": "earth-osm/overpass (+https://github.com/pypsa-meets-earth/earth-osm)",
 }
@@ -63,36 +76,190 @@ def build_overpass_query(country_code, primary_name, feature_name):
 
 _SESSION = requests.Session()
 _SESSION.headers.update(REQUEST_HEADERS)
+# Rate limiting answers (429/503/504) are handled by OverpassScheduler so the
+# pause applies to every request in flight, not just the one that got it.
 _RETRY = Retry(
     total=3,
     backoff_factor=2,
-    status_forcelist=(429, 500, 502, 503, 504),
-    allowed_methods=False,
+    status_forcelist=(500, 502),
+    allowed_methods=None,
     respect_retry_after_header=True,
 )
-_ADAPTER = HTTPAdapter(max_retries=_RETRY)
+_ADAPTER = HTTPAdapter(max_retries=_RETRY, pool_maxsize=16)
 _SESSION.mount("http://", _ADAPTER)
 _SESSION.mount("https://", _ADAPTER)
 
 
-def fetch_overpass_data(query):
+@dataclass(frozen=True)
+class OverpassStatus:
+    """Slot status reported by ``/api/status``.
+
+    ``rate_limit`` is the number of slots of the client (0 means unlimited),
+    ``available`` how many are free now and ``wait`` the seconds until the
+    next one frees up (``None`` when no slot is pending).
+    """
+
+    rate_limit: int
+    available: int
+    wait: Optional[float]
+
+
+_RATE_LIMIT_RE = re.compile(r"^Rate limit: (\d+)", re.MULTILINE)
+_AVAILABLE_RE = re.compile(r"^(\d+) slots? available now", re.MULTILINE)
+_SLOT_WAIT_RE = re.compile(r"^Slot available after: \S+, in (-?\d+) seconds?", re.MULTILINE)
+
+
+def parse_overpass_status(text: str) -> OverpassStatus:
+    """Parse the plain text answer of the Overpass ``/api/status`` endpoint."""
+
+    rate_limit = _RATE_LIMIT_RE.search(text)
+    if rate_limit is None:
+        raise ValueError("Not an Overpass status page")
+    available = _AVAILABLE_RE.search(text)
+    waits = [max(0.0, float(seconds)) for seconds in _SLOT_WAIT_RE.findall(text)]
+    return OverpassStatus(
+        rate_limit=int(rate_limit.group(1)),
+        available=int(available.group(1)) if available else 0,
+        wait=min(waits) if waits else None,
+    )
+
+
+def _retry_after(response: requests.Response) -> Optional[float]:
+    """Return the delay requested by the ``Retry-After`` header of ``response``."""
+
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max(0.0, (moment - datetime.now(timezone.utc)).total_seconds())
+
+
+class OverpassScheduler:
+    """Runs Overpass queries with at most ``max_concurrent`` in flight.
+
+    Before a query is sent the scheduler waits until the server reports a
+    free slot on ``status_endpoint`` (skipped when the endpoint has no status
+    page). A ``429``, ``503`` or ``504`` answer pauses all queries of the
+    scheduler for the ``Retry-After`` delay, or an exponential backoff
+    without one, before the query is retried up to ``max_attempts`` times.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = MAX_CONCURRENT_REQUESTS,
+        *,
+        endpoint: str = OVERPASS_ENDPOINT,
+        status_endpoint: Optional[str] = OVERPASS_STATUS_ENDPOINT,
+        max_attempts: int = MAX_REQUEST_ATTEMPTS,
+        session: Optional[requests.Session] = None,
+        sleep: Callable[[float], None] = time.sleep,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if max_concurrent < 1:
+            raise ValueError("max_concurrent must be at least 1")
+        self.max_concurrent = max_concurrent
+        self.endpoint = endpoint
+        self.status_endpoint = status_endpoint
+        self.max_attempts = max_attempts
+        self.session = session or _SESSION
+        self._sleep = sleep
+        self._clock = clock
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+
+    def defer(self, delay: float) -> None:
+        """Hold back all queries for ``delay`` seconds."""
+
+        with self._lock:
+            self._resume_at = max(self._resume_at, self._clock() + min(delay, MAX_RETRY_DELAY))
+
+    def _wait_resume(self) -> None:
+        while True:
+            with self._lock:
+                remaining = self._resume_at - self._clock()
+            if remaining <= 0:
+                return
+            self._sleep(remaining)
+
+    def status(self) -> Optional[OverpassStatus]:
+        """Return the slot status of the server, or ``None`` when it has none."""
+
+        if self.status_endpoint is None:
+            return None
+        try:
+            response = self.session.get(self.status_endpoint, timeout=STATUS_TIMEOUT)
+            response.raise_for_status()
+            return parse_overpass_status(response.text)
+        except (requests.RequestException, ValueError) as exc:
+            logger.debug("Overpass status unavailable (%s); not checking slots", exc)
+            self.status_endpoint = None
+            return None
+
+    def _wait_for_slot(self) -> None:
+        self._wait_resume()
+        status = self.status()
+        if status is None or status.rate_limit == 0 or status.available > 0:
+            return
+        delay = status.wait if status.wait is not None else 1.0
+        logger.info("No free Overpass slot; next one in %.0fs", delay)
+        self.defer(delay)
+        self._wait_resume()
+
+    def _backoff(self, response: requests.Response, attempt: int) -> float:
+        delay = _retry_after(response)
+        if delay is None:
+            delay = 2.0 ** attempt
+        return min(delay, MAX_RETRY_DELAY)
+
+    def fetch(self, query: str) -> Dict:
+        """Send ``query`` and return the decoded JSON answer."""
+
+        for attempt in range(1, self.max_attempts + 1):
+            with self._slots:
+                self._wait_for_slot()
+                response = self.session.post(
+                    self.endpoint, data=query, timeout=REQUEST_TIMEOUT
+                )
+            if response.status_code not in RATE_LIMIT_STATUSES or attempt == self.max_attempts:
+                break
+            delay = self._backoff(response, attempt)
+            logger.info(
+                "Overpass answered %d; retrying in %.0fs (attempt %d of %d)",
+                response.status_code,
+                delay,
+                attempt + 1,
+                self.max_attempts,
+            )
+            self.defer(delay)
+        response.raise_for_status()
+        return response.json()
+
+
+def fetch_overpass_data(
+    query: str, scheduler: Optional[OverpassScheduler] = None
+) -> Dict[str, Any]:
     """
     Fetch data from the Overpass API.
 
     Args:
         query: Overpass query string
+        scheduler: OverpassScheduler sharing slots and rate limits with other
+            queries (a single-slot scheduler by default)
 
     Returns:
         dict: Response from Overpass API
     """
     logger.debug("Fetching data from Overpass API")
-    response = _SESSION.post(
-        OVERPASS_ENDPOINT,
-        data=query,
-        timeout=REQUEST_TIMEOUT,
-    )
-    response.raise_for_status()
-    data = response.json()
+    data = (scheduler or OverpassScheduler(1)).fetch(query)
     logger.info("Successfully fetched data from Overpass API")
     return data
 
@@ -187,6 +354,12 @@ def transform_overpass_to_internal_format(overpass_data, primary_name, feature_n
     return primary_dict, feature_dict
 
 
+# One decoded element: {"id": ..., "lonlat": ..., "refs": ..., "tags": {...}}.
+OverpassElement = Dict[str, Any]
+# Elements by type ("Node", "Way", "Relation") and id, the "Data" of a feature dict.
+ElementsByType = Dict[str, Dict[Any, OverpassElement]]
+
+
 def _format_lonlat_pairs(pairs: Sequence[Sequence[float]]) -> List[List[float]]:
     return [list(pair) for pair in pairs]
 
@@ -214,16 +387,17 @@ def _build_row_dict(
 
 
 def rows_from_feature_dict(
-    feature_dict: Dict[str, Dict[str, Dict[str, object]]],
+    feature_dict: Dict[str, Any],
     region_code: str,
-    primary_dict: Optional[Dict[str, Dict[str, Dict[str, object]]]] = None,
+    primary_dict: Optional[Dict[str, Any]] = None,
 ) -> Iterator[Dict[str, object]]:
-    data = feature_dict.get("Data", {})
+    data: ElementsByType = feature_dict.get("Data", {})
 
-    feature_nodes = data.get("Node", {})
-    primary_nodes: Dict[str, Dict[str, object]] = {}
+    feature_nodes: Dict[Any, OverpassElement] = data.get("Node", {})
+    primary_nodes: Dict[Any, OverpassElement] = {}
     if primary_dict is not None:
-        primary_nodes = primary_dict.get("Data", {}).get("Node", {})
+        primary_data: ElementsByType = primary_dict.get("Data", {})
+        primary_nodes = primary_data.get("Node", {})
 
     for node in feature_nodes.values():
         lonlat = node.get("lonlat")
@@ -238,13 +412,13 @@ def rows_from_feature_dict(
             tags=node.get("tags", {}),
         )
 
-    def iter_node_sources() -> Iterator[tuple[str, Dict[str, object]]]:
+    def iter_node_sources() -> Iterator[Tuple[Any, OverpassElement]]:
         yield from feature_nodes.items()
         for node_id, node in primary_nodes.items():
             if node_id not in feature_nodes:
                 yield node_id, node
 
-    nodes: Dict[int, Dict[str, object]] = {}
+    nodes: Dict[int, OverpassElement] = {}
     for node_id, node in iter_node_sources():
         node_lonlat = node.get("lonlat")
         if node_lonlat is None:
@@ -259,11 +433,11 @@ def rows_from_feature_dict(
         coords: List[Sequence[float]] = []
         missing = False
         for ref in refs:
-            node = nodes.get(ref)
-            if node is None:
+            ref_node = nodes.get(ref)
+            if ref_node is None:
                 missing = True
                 break
-            node_lonlat = node.get("lonlat")
+            node_lonlat = ref_node.get("lonlat")
             if node_lonlat is None:
                 missing = True
                 break
@@ -281,7 +455,13 @@ def rows_from_feature_dict(
         )
 
 
-def get_overpass_data(region, primary_name, feature_name, data_dir):
+def get_overpass_data(
+    region: Any,
+    primary_name: str,
+    feature_name: str,
+    data_dir: str,
+    scheduler: Optional[OverpassScheduler] = None,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
     """
     Get OSM data from Overpass API for a specific region and feature.
 
@@ -290,6 +470,7 @@ def get_overpass_data(region, primary_name, feature_name, data_dir):
         primary_name: Primary feature name (e.g., 'power')
         feature_name: Specific feature name (e.g., 'substation')
         data_dir: Directory for data storage
+        scheduler: optional OverpassScheduler the request is sent through
 
     Returns:
         tuple: (primary_dict, feature_dict) in the format expected by process_region
@@ -310,7 +491,7 @@ def get_overpass_data(region, primary_name, feature_name, data_dir):
     query = build_overpass_query(region.short, primary_name, feature_name)
     logger.debug(f"Overpass query: {query}")
 
-    overpass_response = fetch_overpass_data(query)
+    overpass_response = fetch_overpass_data(query, scheduler)
 
     primary_dict, feature_dict = transform_overpass_to_internal_format(
         overpass_response, primary_name, feature_name
@@ -328,6 +509,7 @@ def iter_overpass_rows(
     primary_name: str,
     feature_name: str,
     data_dir: str,
+    scheduler: Optional[OverpassScheduler] = None,
 ) -> Iterator[Dict[str, object]]:
     """Yield flattened feature dictionaries using the Overpass backend."""
 
@@ -336,13 +518,18 @@ def iter_overpass_rows(
         primary_name,
         feature_name,
         data_dir,
+        scheduler,
     )
     yield from rows_from_feature_dict(feature_dict, region.short, primary_dict)
 
 
 __all__ = [
+    "MAX_CONCURRENT_REQUESTS",
+    "OverpassScheduler",
+    "OverpassStatus",
     "build_overpass_query",
     "fetch_overpass_data",
+    "parse_overpass_status",
     "transform_overpass_to_internal_format",
     "get_overpass_data",
     "rows_from_feature_dict",
@@ -0,0 +1,642 @@
+"""Compiled tag predicates.
+
+A small expression language selects OSM elements by their tags, e.g.::
+
+    power=line,cable & voltage>=110000 & !(location=underground)
+
+Supported terms are ``key`` or ``key=*`` (key present), ``key=a,b`` (any
+``;``-separated token of the value equals ``a`` or ``b``), ``key!=a``,
+``key~regex`` and ``key!~regex`` (searched in the whole value) and the numeric
+comparisons ``<``, ``<=``, ``>`` and ``>=`` (any numeric token satisfies them).
+Terms are combined with ``!``/``not``, ``&``/``and`` (or juxtaposition) and
+``|``/``or`` and parentheses. Keys and values containing spaces or operator
+characters must be double quoted.
+
+Expressions are parsed once into a tree of :class:`TagPredicate` nodes. A tree
+can be evaluated against decoded tags with :meth:`TagPredicate.matches` or
+bound to the string table of a PBF block with :meth:`TagPredicate.bind`. A
+bound predicate works on ``{key_index: value_index}`` mappings, so elements
+are matched by integer lookups and only the matching ones have their tags
+decoded.
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
+
+from earth_osm.utils import iter_tag_values
+
+logger = logging.getLogger("eo.predicate")
+
+KeyValueIndex = Mapping[int, int]
+
+_COMPARATORS: Dict[str, Callable[[float, float], bool]] = {
+    "<": lambda left, right: left < right,
+    "<=": lambda left, right: left <= right,
+    ">": lambda left, right: left > right,
+    ">=": lambda left, right: left >= right,
+}
+
+
+def _parse_number(token: str) -> Optional[float]:
+    try:
+        return float(token)
+    except ValueError:
+        return None
+
+
+class BlockStrings:
+    """String table of one PBF block with a reverse index.
+
+    Shared by all leaves of a predicate while it is bound to a block so the
+    table is indexed only once.
+    """
+
+    def __init__(self, strmap: Sequence[str]):
+        self.strmap = strmap
+        self._positions: Optional[Dict[str, List[int]]] = None
+        self._list_indices: Optional[List[int]] = None
+
+    @property
+    def positions(self) -> Dict[str, List[int]]:
+        if self._positions is None:
+            positions: Dict[str, List[int]] = {}
+            for index, text in enumerate(self.strmap):
+                positions.setdefault(text, []).append(index)
+            self._positions = positions
+        return self._positions
+
+    @property
+    def list_indices(self) -> List[int]:
+        """Indices of strings that hold ``;``-separated lists or padding."""
+
+        if self._list_indices is None:
+            self._list_indices = [
+                index
+                for index, text in enumerate(self.strmap)
+                if ";" in text or text != text.strip()
+            ]
+        return self._list_indices
+
+    def indices(self, text: str) -> List[int]:
+        return self.positions.get(text, [])
+
+
+@dataclass(frozen=True)
+class BoundPredicate:
+    """A predicate bound to one block's string table.
+
+    ``constant`` is set when the outcome does not depend on the element.
+    ``anchors`` lists key indices of which at least one must be present for a
+    match, or ``None`` when untagged elements may match.
+    """
+
+    test: Callable[[KeyValueIndex], bool]
+    constant: Optional[bool] = None
+    anchors: Optional[FrozenSet[int]] = None
+
+    def __call__(self, key_values: KeyValueIndex) -> bool:
+        return self.test(key_values)
+
+
+_ALWAYS = BoundPredicate(lambda key_values: True, constant=True)
+_NEVER = BoundPredicate(lambda key_values: False, constant=False, anchors=frozenset())
+
+
+class TagPredicate:
+    """Base class of the predicate tree."""
+
+    def matches(self, tags: Mapping[str, object]) -> bool:
+        raise NotImplementedError
+
+    def bind(self, strmap: Union[Sequence[str], BlockStrings]) -> BoundPredicate:
+        """Compile the predicate against a block string table."""
+
+        strings = strmap if isinstance(strmap, BlockStrings) else BlockStrings(strmap)
+        return self._bind(strings)
+
+    def _bind(self, strings: BlockStrings) -> BoundPredicate:
+        raise NotImplementedError
+
+    def __and__(self, other: "TagPredicate") -> "TagPredicate":
+        return And((self, other))
+
+    def __or__(self, other: "TagPredicate") -> "TagPredicate":
+        return Or((self, other))
+
+    def __invert__(self) -> "TagPredicate":
+        return Not(self)
+
+
+@dataclass(frozen=True)
+class TagTest(TagPredicate):
+    """Leaf comparing the value of ``key``.
+
+    ``op`` is one of ``exists``, ``eq``, ``regex``, ``<``, ``<=``, ``>`` or
+    ``>=``; ``values`` holds the accepted values, the pattern or the number.
+    """
+
+    key: str
+    op: str = "exists"
+    values: Tuple[str, ...] = ()
+
+    def __post_init__(self) -> None:
+        if self.op not in ("exists", "eq", "regex") and self.op not in _COMPARATORS:
+            raise ValueError(f"Unknown tag comparison {self.op!r}")
+        if self.op in _COMPARATORS and _parse_number(self.values[0]) is None:
+            raise ValueError(f"{self.key}{self.op}{self.values[0]}: expected a number")
+        if self.op == "regex":
+            try:
+                re.compile(self.values[0])
+            except re.error as exc:
+                raise ValueError(
+                    f"{self.key}~{self.values[0]}: invalid pattern ({exc})"
+                ) from exc
+
+    def value_matches(self, value: str) -> bool:
+        if self.op == "exists":
+            return True
+        if self.op == "eq":
+            return any(token in self.values for token in iter_tag_values(value))
+        if self.op == "regex":
+            return re.search(self.values[0], value) is not None
+        compare = _COMPARATORS[self.op]
+        threshold = float(self.values[0])
+        for token in iter_tag_values(value):
+            number = _parse_number(token)
+            if number is not None and compare(number, threshold):
+                return True
+        return False
+
+    def matches(self, tags: Mapping[str, object]) -> bool:
+        value = tags.get(self.key)
+        if value is None:
+            return False
+        return self.value_matches(str(value))
+
+    def _accepted_values(self, strings: BlockStrings) -> FrozenSet[int]:
+        if self.op == "eq":
+            # A value with ``;`` or padding is never a single token, so the
+            # string table entry equal to it must not be accepted either.
+            accepted = {
+                index
+                for value in self.values
+                if self.value_matches(value)
+                for index in strings.indices(value)
+            }
+            accepted.update(
+                index
+                for index in strings.list_indices
+                if self.value_matches(strings.strmap[index])
+            )
+            return frozenset(accepted)
+        return frozenset(
+            index for index, text in enumerate(strings.strmap) if self.value_matches(text)
+        )
+
+    def _bind(self, strings: BlockStrings) -> BoundPredicate:
+        key_indices = strings.indices(self.key)
+        if not key_indices:
+            return _NEVER
+        anchors = frozenset(key_indices)
+
+        if self.op == "exists":
+            if len(key_indices) == 1:
+                key_index = key_indices[0]
+                return BoundPredicate(
+                    lambda key_values: key_index in key_values, anchors=anchors
+                )
+            return BoundPredicate(
+                lambda key_values: any(index in key_values for index in key_indices),
+                anchors=anchors,
+            )
+
+        accepted = self._accepted_values(strings)
+        if not accepted:
+            return _NEVER
+        if len(key_indices) == 1:
+            key_index = key_indices[0]
+            return BoundPredicate(
+                lambda key_values: key_values.get(key_index) in accepted,
+                anchors=anchors,
+            )
+        return BoundPredicate(
+            lambda key_values: any(key_values.get(index) in accepted for index in key_indices),
+            anchors=anchors,
+        )
+
+
+@dataclass(frozen=True)
+class Not(TagPredicate):
+    operand: TagPredicate
+
+    def matches(self, tags: Mapping[str, object]) -> bool:
+        return not self.operand.matches(tags)
+
+    def _bind(self, strings: BlockStrings) -> BoundPredicate:
+        inner = self.operand._bind(strings)
+        if inner.constant is not None:
+            return _NEVER if inner.constant else _ALWAYS
+        test = inner.test
+        return BoundPredicate(lambda key_values: not test(key_values))
+
+
+@dataclass(frozen=True)
+class And(TagPredicate):
+    operands: Tuple[TagPredicate, ...]
+
+    def matches(self, tags: Mapping[str, object]) -> bool:
+        return all(operand.matches(tags) for operand in self.operands)
+
+    def _bind(self, strings: BlockStrings) -> BoundPredicate:
+        bound: List[BoundPredicate] = []
+        for operand in self.operands:
+            child = operand._bind(strings)
+            if child.constant is False:
+                return _NEVER
+            if child.constant is None:
+                bound.append(child)
+        if not bound:
+            return _ALWAYS
+        if len(bound) == 1:
+            return bound[0]
+
+        anchored = [child.anchors for child in bound if child.anchors is not None]
+        anchors = min(anchored, key=len) if anchored else None
+        tests = tuple(child.test for child in bound)
+        return BoundPredicate(
+            lambda key_values: all(test(key_values) for test in tests),
+            anchors=anchors,
+        )
+
+
+@dataclass(frozen=True)
+class Or(TagPredicate):
+    operands: Tuple[TagPredicate, ...]
+
+    def matches(self, tags: Mapping[str, object]) -> bool:
+        return any(operand.matches(tags) for operand in self.operands)
+
+    def _bind(self, strings: BlockStrings) -> BoundPredicate:
+        bound: List[BoundPredicate] = []
+        for operand in self.operands:
+            child = operand._bind(strings)
+            if child.constant is True:
+                return _ALWAYS
+            if child.constant is None:
+                bound.append(child)
+        if not bound:
+            return _NEVER
+        if len(bound) == 1:
+            return bound[0]
+
+        anchors: Optional[FrozenSet[int]] = frozenset()
+        for child in bound:
+            if anchors is None or child.anchors is None:
+                anchors = None
+                break
+            anchors = anchors | child.anchors
+        tests = tuple(child.test for child in bound)
+        return BoundPredicate(
+            lambda key_values: any(test(key_values) for test in tests),
+            anchors=anchors,
+        )
+
+
+def _flatten(
+    kind: Union[Type["And"], Type["Or"]], operands: Sequence[TagPredicate]
+) -> List[TagPredicate]:
+    flat: List[TagPredicate] = []
+    for operand in operands:
+        operand = normalize_predicate(operand)
+        if isinstance(operand, (And, Or)) and isinstance(operand, kind):
+            flat.extend(operand.operands)
+        else:
+            flat.append(operand)
+    return flat
+
+
+def normalize_predicate(predicate: TagPredicate) -> TagPredicate:
+    """Return a canonical form of ``predicate``.
+
+    Nested ``And``/``Or`` nodes are flattened, their operands sorted and
+    deduplicated, double negations dropped and ``key=a | key=b`` merged into
+    ``key=a,b``, so equivalent spellings of a filter compare equal.
+    """
+
+    if isinstance(predicate, TagTest):
+        if predicate.op == "eq":
+            return TagTest(predicate.key, "eq", tuple(sorted(set(predicate.values))))
+        return predicate
+    if isinstance(predicate, Not):
+        operand = normalize_predicate(predicate.operand)
+        return operand.operand if isinstance(operand, Not) else Not(operand)
+    if isinstance(predicate, (And, Or)):
+        kind = type(predicate)
+        operands = _flatten(kind, predicate.operands)
+        if kind is Or:
+            values: Dict[str, set] = {}
+            merged: List[TagPredicate] = []
+            for operand in operands:
+                if isinstance(operand, TagTest) and operand.op == "eq":
+                    values.setdefault(operand.key, set()).update(operand.values)
+                else:
+                    merged.append(operand)
+            merged.extend(
+                TagTest(key, "eq", tuple(sorted(accepted))) for key, accepted in values.items()
+            )
+            operands = merged
+        unique = sorted(set(operands), key=repr)
+        if len(unique) == 1:
+            return unique[0]
+        return kind(tuple(unique))
+    return predicate
+
+
+_LOWER_BOUNDS = (">", ">=")
+_UPPER_BOUNDS = ("<", "<=")
+
+
+def _test_implies(narrow: TagTest, broad: TagTest) -> bool:
+    if narrow.key != broad.key:
+        return False
+    if broad.op == "exists" or narrow == broad:
+        return True
+    if narrow.op == "eq" and broad.op == "eq":
+        return set(narrow.values) <= set(broad.values)
+    directions: Tuple[Tuple[Tuple[str, str], Callable[[float, float], bool]], ...] = (
+        (_LOWER_BOUNDS, lambda a, b: a > b),
+        (_UPPER_BOUNDS, lambda a, b: a < b),
+    )
+    for bounds, tighter in directions:
+        if narrow.op in bounds and broad.op in bounds:
+            limit, threshold = float(narrow.values[0]), float(broad.values[0])
+            # ``>= b`` admits ``b`` itself, so any bound at or past ``b`` is narrower.
+            if broad.op.endswith("=") or narrow.op == broad.op:
+                return limit == threshold or tighter(limit, threshold)
+            return tighter(limit, threshold)
+    return False
+
+
+def predicate_implies(narrow: TagPredicate, broad: TagPredicate) -> bool:
+    """Return ``True`` when every element matching ``narrow`` also matches ``broad``.
+
+    The check is structural and conservative: ``False`` only means the
+    implication could not be shown.
+    """
+
+    if narrow == broad:
+        return True
+    if isinstance(broad, And):
+        return all(predicate_implies(narrow, operand) for operand in broad.operands)
+    if isinstance(narrow, Or):
+        return all(predicate_implies(operand, broad) for operand in narrow.operands)
+    if isinstance(narrow, And) and any(
+        predicate_implies(operand, broad) for operand in narrow.operands
+    ):
+        return True
+    if isinstance(broad, Or):
+        return any(predicate_implies(narrow, operand) for operand in broad.operands)
+    if isinstance(narrow, Not) and isinstance(broad, Not):
+        return predicate_implies(broad.operand, narrow.operand)
+    if isinstance(narrow, TagTest) and isinstance(broad, TagTest):
+        return _test_implies(narrow, broad)
+    return False
+
+
+def predicate_to_json(predicate: TagPredicate) -> Dict[str, Any]:
+    """Describe ``predicate`` with JSON types (see :func:`predicate_from_json`)."""
+
+    if isinstance(predicate, TagTest):
+        return {"key": predicate.key, "op": predicate.op, "values": list(predicate.values)}
+    if isinstance(predicate, Not):
+        return {"not": predicate_to_json(predicate.operand)}
+    if isinstance(predicate, (And, Or)):
+        kind = "and" if isinstance(predicate, And) else "or"
+        return {kind: [predicate_to_json(operand) for operand in predicate.operands]}
+    raise TypeError(f"Cannot describe {type(predicate).__name__} as JSON")
+
+
+def predicate_from_json(payload: Any) -> TagPredicate:
+    """Rebuild the predicate described by :func:`predicate_to_json`."""
+
+    if not isinstance(payload, dict):
+        raise ValueError(f"Expected a predicate object, got {payload!r}")
+    if "key" in payload:
+        return TagTest(
+            str(payload["key"]),
+            str(payload.get("op", "exists")),
+            tuple(str(value) for value in payload.get("values", ())),
+        )
+    if "not" in payload:
+        return Not(predicate_from_json(payload["not"]))
+    for kind, node in (("and", And), ("or", Or)):
+        if kind in payload:
+            return node(tuple(predicate_from_json(operand) for operand in payload[kind]))
+    raise ValueError(f"Unknown predicate {payload!r}")
+
+
+_TOKEN_RE = re.compile(
+    r"""
+    \s*(?:
+        (?P<paren>[()])
+      | (?P<and>&&?)
+      | (?P<or>\|\|?)
+      | (?P<op>!=|!~|>=|<=|=|~|>|<)
+      | (?P<not>!)
+      | "(?P<quoted>(?:[^"\\]|\\.)*)"
+      | (?P<word>[^\s()!=<>~&|"]+)
+    )
+    """,
+    re.VERBOSE,
+)
+
+
+def _tokenize(text: str) -> List[Tuple[str, str, int]]:
+    tokens: List[Tuple[str, str, int]] = []
+    position = 0
+    while position < len(text):
+        if text[position:].strip() == "":
+            break
+        match = _TOKEN_RE.match(text, position)
+        if match is None or match.end() == position:
+            raise ValueError(f"Invalid tag filter {text!r} at position {position}")
+        kind = match.lastgroup
+        if kind is None:
+            raise ValueError(f"Invalid tag filter {text!r} at position {position}")
+        value = match.group(kind)
+        if kind == "quoted":
+            kind, value = "word", re.sub(r'\\(["\\])', r"\1", value)
+        elif kind == "word" and value.lower() in ("and", "or", "not"):
+            kind = value.lower()
+        tokens.append((kind, value, match.start(kind)))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    """Recursive-descent parser; ``not`` binds tighter than ``and``, then ``or``."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.position = 0
+
+    def _peek(self) -> Optional[Tuple[str, str, int]]:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def _take(self, kind: Optional[str] = None) -> Tuple[str, str, int]:
+        token = self._peek()
+        if token is None:
+            raise ValueError(f"Unexpected end of tag filter {self.text!r}")
+        if kind is not None and token[0] != kind:
+            raise ValueError(
+                f"Invalid tag filter {self.text!r}: expected {kind} at position {token[2]}"
+            )
+        self.position += 1
+        return token
+
+    def parse(self) -> TagPredicate:
+        predicate = self._or()
+        token = self._peek()
+        if token is not None:
+            raise ValueError(
+                f"Invalid tag filter {self.text!r}: "
+                f"unexpected {token[1]!r} at position {token[2]}"
+            )
+        return predicate
+
+    def _or(self) -> TagPredicate:
+        operands = [self._and()]
+        while True:
+            token = self._peek()
+            if token is None or token[0] != "or":
+                break
+            self._take()
+            operands.append(self._and())
+        return operands[0] if len(operands) == 1 else Or(tuple(operands))
+
+    def _and(self) -> TagPredicate:
+        operands = [self._not()]
+        while True:
+            token = self._peek()
+            if token is None or token[0] == "or" or token[:2] == ("paren", ")"):
+                break
+            if token[0] == "and":
+                self._take()
+            operands.append(self._not())
+        return operands[0] if len(operands) == 1 else And(tuple(operands))
+
+    def _not(self) -> TagPredicate:
+        token = self._peek()
+        if token is not None and token[0] == "not":
+            self._take()
+            return Not(self._not())
+        return self._atom()
+
+    def _atom(self) -> TagPredicate:
+        token = self._take()
+        if token[:2] == ("paren", "("):
+            predicate = self._or()
+            closing = self._take("paren")
+            if closing[1] != ")":
+                raise ValueError(
+                    f"Invalid tag filter {self.text!r}: expected ')' at position {closing[2]}"
+                )
+            return predicate
+        if token[0] != "word":
+            raise ValueError(
+                f"Invalid tag filter {self.text!r}: "
+                f"unexpected {token[1]!r} at position {token[2]}"
+            )
+
+        key = token[1]
+        operator = self._peek()
+        if operator is None or operator[0] != "op":
+            return TagTest(key)
+        self._take()
+        value = self._take("word")[1]
+
+        op = operator[1]
+        if op in ("=", "!="):
+            if value == "*":
+                test = TagTest(key)
+            else:
+                values = tuple(part.strip() for part in value.split(",") if part.strip())
+                if any(";" in part for part in values):
+                    raise ValueError(
+                        f"Invalid tag filter {self.text!r}: values are matched per "
+                        f"';'-separated token, list alternatives with ',' instead"
+                    )
+                test = TagTest(key, "eq", values)
+            return Not(test) if op == "!=" else test
+        if op in ("~", "!~"):
+            test = TagTest(key, "regex", (value,))
+            return Not(test) if op == "!~" else test
+        return TagTest(key, op, (value,))
+
+
+def parse_tag_filter(text: str) -> TagPredicate:
+    """Parse a tag filter expression into a :class:`TagPredicate`."""
+
+    if not text or not text.strip():
+        raise ValueError("Tag filter expression must not be empty")
+    return _Parser(text).parse()
+
+
+def compile_tag_filter(
+    tag_filter: Union[None, str, TagPredicate],
+) -> Optional[TagPredicate]:
+    """Return ``tag_filter`` as a :class:`TagPredicate` (``None`` stays ``None``)."""
+
+    if tag_filter is None or isinstance(tag_filter, TagPredicate):
+        return tag_filter
+    return parse_tag_filter(tag_filter)
+
+
+@lru_cache(maxsize=256)
+def feature_predicate(primary_name: str, feature_names: Tuple[str, ...]) -> TagPredicate:
+    """Predicate for ``primary_name`` matching any of ``feature_names``.
+
+    ``ALL_*`` feature names act as wildcards and only require the key.
+    """
+
+    if any(name.startswith("ALL_") for name in feature_names):
+        return TagTest(primary_name)
+    return TagTest(primary_name, "eq", tuple(feature_names))
+
+
+__all__ = [
+    "And",
+    "BlockStrings",
+    "BoundPredicate",
+    "Not",
+    "Or",
+    "TagPredicate",
+    "TagTest",
+    "compile_tag_filter",
+    "feature_predicate",
+    "normalize_predicate",
+    "parse_tag_filter",
+    "predicate_from_json",
+    "predicate_implies",
+    "predicate_to_json",
+]
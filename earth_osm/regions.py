@@ -8,13 +8,17 @@ small convenience helpers that express common orchestration needs.
 
 from __future__ import annotations
 
+import os
 from datetime import datetime
-from typing import Iterable, List, Optional, Sequence
+from typing import Any, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from shapely.geometry.base import BaseGeometry
 
 from earth_osm.gfk_data import (
     get_all_valid_list as _get_all_valid_list,
     get_children_regions as _gfk_get_children_regions,
     get_region_dict as _gfk_get_region_dict,
+    get_region_geometry as _gfk_get_region_geometry,
     get_region_tuple as _gfk_get_region_tuple,
     get_region_tuple_historical as _gfk_get_region_tuple_historical,
     get_root_list as _gfk_get_root_list,
@@ -139,6 +143,52 @@ def download_region_pbf(
     return download_pbf(pbf_url, update, data_dir, progress_bar=progress_bar)
 
 
+def get_region_geometry(region: Any) -> Optional[BaseGeometry]:
+    """Return the GeoFabrik boundary polygon of ``region`` (``None`` for the planet)."""
+
+    if is_planet_region(region):
+        return None
+    return _gfk_get_region_geometry(region.id)
+
+
+def iter_region_ancestors(region: Any) -> Iterator:
+    """Yield the parent regions of ``region``, nearest first, ending with the planet."""
+
+    if is_planet_region(region):
+        return
+
+    parent_id = getattr(region, "parent", None)
+    while isinstance(parent_id, str) and parent_id:
+        parent = get_region_tuple(parent_id)
+        yield parent
+        parent_id = getattr(parent, "parent", None)
+
+    yield get_region_tuple(PLANET_REGION_ID)
+
+
+def local_pbf_path(region: Any, data_dir: str) -> str:
+    """Return the path where :func:`download_region_pbf` stores ``region``."""
+
+    return os.path.join(data_dir, "pbf", os.path.basename(region.urls["pbf"]))
+
+
+def find_cached_parent_pbf(region: Any, data_dir: str) -> Optional[Tuple[Any, str]]:
+    """Return ``(ancestor, path)`` for the nearest ancestor PBF already in ``data_dir``.
+
+    Historical requests never reuse a parent because the cached parent file is
+    not guaranteed to match the requested snapshot date.
+    """
+
+    if getattr(region, "target_date", None) is not None:
+        return None
+
+    for ancestor in iter_region_ancestors(region):
+        path = local_pbf_path(ancestor, data_dir)
+        if os.path.exists(path):
+            return ancestor, path
+    return None
+
+
 def get_all_valid_codes() -> List[str]:
     """Return all valid region identifiers and short codes."""
 
@@ -170,6 +220,10 @@ __all__ = [
     "iter_region_hierarchy",
     "is_planet_region",
     "download_region_pbf",
+    "get_region_geometry",
+    "iter_region_ancestors",
+    "local_pbf_path",
+    "find_cached_parent_pbf",
     "get_all_valid_codes",
     "get_root_regions",
     "view_regions",
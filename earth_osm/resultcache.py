@@ -0,0 +1,160 @@
+"""Content-addressed cache of finished exports.
+
+An export is identified by a key hashed from the checksums of the PBFs it
+scans, the earth_osm version and every option that shapes its outputs. The
+cache keeps one JSON entry per key pointing at the files the export wrote,
+with their size and modification time. A rerun with the same key reuses those
+files as long as they are unchanged, copying them when the new export writes
+to another directory, instead of scanning the PBFs again.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Any, Dict, Iterable, List, Mapping, Optional
+
+from earth_osm import __version__
+from earth_osm.gfk_download import _parse_md5_file, calculate_md5
+
+logger = logging.getLogger("eo.resultcache")
+
+RESULT_CACHE_VERSION = 1
+
+
+def pbf_checksum(path: str) -> str:
+    """Return the MD5 of the PBF at ``path``.
+
+    The ``.md5`` file stored next to downloaded PBFs is used when present;
+    downloads are verified against it, so this avoids reading the PBF again.
+    """
+
+    md5_path = f"{path}.md5"
+    if os.path.exists(md5_path):
+        try:
+            return _parse_md5_file(md5_path)[0]
+        except (OSError, ValueError) as exc:
+            logger.debug("Ignoring unreadable %s: %s", md5_path, exc)
+    return calculate_md5(path)
+
+
+def result_key(params: Mapping[str, Any], pbf_checksums: Mapping[str, str]) -> str:
+    """Return the cache key of an export with ``params`` over the given PBFs."""
+
+    payload = {
+        "cache_version": RESULT_CACHE_VERSION,
+        "earth_osm": __version__,
+        "params": params,
+        "pbfs": dict(sorted(pbf_checksums.items())),
+    }
+    text = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _stat(path: str) -> Optional[Dict[str, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class ResultCache:
+    """JSON entries ``<key>.json`` in ``directory``, one per cached export."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as source:
+                return json.load(source)
+        except (OSError, ValueError) as exc:
+            logger.warning("Ignoring unreadable result cache entry %s: %s", path, exc)
+            return None
+
+    def restore(self, key: str, out_dir: str) -> Optional[List[str]]:
+        """Provide the outputs of ``key`` in ``out_dir`` and return their paths.
+
+        Returns ``None``, leaving ``out_dir`` untouched, when there is no entry
+        or any file it points to was changed or removed since.
+        """
+
+        entry = self._read(key)
+        if entry is None:
+            return None
+
+        copies = []
+        paths = []
+        for item in entry["files"]:
+            recorded = {"size": item["size"], "mtime_ns": item["mtime_ns"]}
+            target = os.path.join(out_dir, item["name"])
+            paths.append(target)
+            if os.path.abspath(target) == item["path"] and _stat(target) == recorded:
+                continue
+            if _stat(item["path"]) != recorded:
+                logger.info(
+                    "Cached output %s changed since it was written; exporting again",
+                    item["path"],
+                )
+                return None
+            copies.append((item["path"], target))
+
+        for source, target in copies:
+            os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+            shutil.copy2(source, target)
+        return paths
+
+    def save(
+        self,
+        key: str,
+        out_dir: str,
+        paths: Iterable[str],
+        params: Optional[Mapping[str, Any]] = None,
+    ) -> None:
+        """Record the output ``paths`` (inside ``out_dir``) of the export ``key``."""
+
+        files = []
+        for path in sorted(set(paths)):
+            stat = _stat(path)
+            if stat is None:
+                continue
+            files.append(
+                {
+                    "name": os.path.relpath(path, out_dir),
+                    "path": os.path.abspath(path),
+                    **stat,
+                }
+            )
+        entry = {
+            "key": key,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "earth_osm": __version__,
+            "params": params,
+            "files": files,
+        }
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as target:
+            json.dump(entry, target, ensure_ascii=False, sort_keys=True, indent=1, default=str)
+        os.replace(temp_path, path)
+
+
+__all__ = [
+    "RESULT_CACHE_VERSION",
+    "ResultCache",
+    "pbf_checksum",
+    "result_key",
+]
@@ -0,0 +1,247 @@
+"""Spatial helpers for clipping streamed OSM features.
+
+The streaming pipeline expresses spatial restrictions through
+:class:`SpatialFilter`, a small picklable value carrying a bounding box and an
+optional polygon. It is shipped to the block scanning workers so candidate
+nodes can be rejected as early as possible, and it is used again when way
+geometries are assembled.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import os
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import shapely
+from shapely.geometry import box
+from shapely.geometry.base import BaseGeometry
+
+logger = logging.getLogger("eo.spatial")
+
+BBox = Tuple[float, float, float, float]
+EMPTY_BBOX: BBox = (math.inf, math.inf, -math.inf, -math.inf)
+
+
+def bbox_disjoint(first: BBox, second: BBox) -> bool:
+    """Return ``True`` when two ``(min_lon, min_lat, max_lon, max_lat)`` boxes do not touch."""
+
+    return (
+        first[2] < second[0]
+        or second[2] < first[0]
+        or first[3] < second[1]
+        or second[3] < first[1]
+    )
+
+
+@dataclass(frozen=True)
+class SpatialFilter:
+    """Bounding box and optional polygon used to clip streamed features.
+
+    Nodes are kept when they fall inside the filter. Ways are kept when any of
+    their resolved coordinates falls inside, mirroring the ``complete_ways``
+    strategy used to cut the GeoFabrik extracts.
+    """
+
+    bbox: BBox
+    geometry: Optional[BaseGeometry] = None
+
+    @classmethod
+    def from_bbox(cls, bbox: Sequence[float]) -> "SpatialFilter":
+        if len(bbox) != 4:
+            raise ValueError("bbox must contain min_lon, min_lat, max_lon, max_lat")
+        min_lon, min_lat, max_lon, max_lat = (float(value) for value in bbox)
+        if min_lon > max_lon or min_lat > max_lat:
+            raise ValueError(f"Invalid bbox {tuple(bbox)}: minimum exceeds maximum")
+        return cls((min_lon, min_lat, max_lon, max_lat))
+
+    @classmethod
+    def from_geometry(cls, geometry: BaseGeometry) -> "SpatialFilter":
+        if geometry is None or geometry.is_empty:
+            raise ValueError("Spatial filter geometry must not be empty")
+        if geometry.geom_type not in ("Polygon", "MultiPolygon"):
+            raise ValueError(
+                f"Spatial filter geometry must be a (multi)polygon, got {geometry.geom_type}"
+            )
+        bounds = tuple(float(value) for value in geometry.bounds)
+        return cls(bounds, geometry)  # type: ignore[arg-type]
+
+    @property
+    def is_empty(self) -> bool:
+        return self.bbox[0] > self.bbox[2] or self.bbox[1] > self.bbox[3]
+
+    def _prepared(self) -> Optional[BaseGeometry]:
+        geometry = self.geometry
+        if geometry is not None and not shapely.is_prepared(geometry):
+            shapely.prepare(geometry)
+        return geometry
+
+    def disjoint(self, bbox: Optional[BBox]) -> bool:
+        """Return ``True`` when ``bbox`` cannot contain any matching coordinate."""
+
+        if bbox is None:
+            return False
+        return bbox_disjoint(self.bbox, bbox)
+
+    def contains(self, lon: float, lat: float) -> bool:
+        min_lon, min_lat, max_lon, max_lat = self.bbox
+        if lon < min_lon or lon > max_lon or lat < min_lat or lat > max_lat:
+            return False
+        geometry = self._prepared()
+        if geometry is None:
+            return True
+        return bool(shapely.intersects_xy(geometry, lon, lat))
+
+    def contains_any(self, coords: Iterable[Sequence[float]]) -> bool:
+        for lon, lat in coords:
+            if self.contains(lon, lat):
+                return True
+        return False
+
+    def contains_xy(self, lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+        """Vectorised :meth:`contains` returning a boolean mask."""
+
+        min_lon, min_lat, max_lon, max_lat = self.bbox
+        mask = (lons >= min_lon) & (lons <= max_lon) & (lats >= min_lat) & (lats <= max_lat)
+        geometry = self._prepared()
+        if geometry is not None and mask.any():
+            candidates = np.flatnonzero(mask)
+            mask[candidates] = shapely.intersects_xy(
+                geometry, lons[candidates], lats[candidates]
+            )
+        return mask
+
+    def as_geometry(self) -> BaseGeometry:
+        if self.geometry is not None:
+            return self.geometry
+        return box(*self.bbox)
+
+    def intersection(self, other: Optional["SpatialFilter"]) -> "SpatialFilter":
+        """Return a filter accepting only coordinates accepted by both filters."""
+
+        if other is None:
+            return self
+        if self.geometry is None and other.geometry is None:
+            if bbox_disjoint(self.bbox, other.bbox):
+                return SpatialFilter(EMPTY_BBOX)
+            return SpatialFilter(
+                (
+                    max(self.bbox[0], other.bbox[0]),
+                    max(self.bbox[1], other.bbox[1]),
+                    min(self.bbox[2], other.bbox[2]),
+                    min(self.bbox[3], other.bbox[3]),
+                )
+            )
+
+        geometry = shapely.intersection(self.as_geometry(), other.as_geometry())
+        if geometry.geom_type == "GeometryCollection":
+            geometry = shapely.union_all(
+                [
+                    part
+                    for part in geometry.geoms
+                    if part.geom_type in ("Polygon", "MultiPolygon")
+                ]
+            )
+        # Shapes that only touch intersect in lines or points, which enclose no area.
+        if (
+            geometry.is_empty
+            or geometry.geom_type not in ("Polygon", "MultiPolygon")
+            or geometry.area == 0
+        ):
+            return SpatialFilter(EMPTY_BBOX)
+        return SpatialFilter.from_geometry(geometry)
+
+
+def load_polygon(value: Union[str, BaseGeometry]) -> BaseGeometry:
+    """Return a polygon from a geometry, a WKT string or a path to a vector file.
+
+    Files are read with GeoPandas and all their features are merged.
+    """
+
+    if isinstance(value, BaseGeometry):
+        return value
+    if not isinstance(value, str):
+        raise TypeError(f"Unsupported polygon specification: {value!r}")
+
+    if os.path.exists(value):
+        import geopandas as gpd
+
+        frame = gpd.read_file(value)
+        if frame.crs is not None and not frame.crs.equals("EPSG:4326"):
+            frame = frame.to_crs(epsg=4326)
+        return shapely.union_all(frame.geometry.values)
+
+    return shapely.from_wkt(value)
+
+
+def make_spatial_filter(
+    bbox: Optional[Sequence[float]] = None,
+    polygon: Optional[Union[str, BaseGeometry]] = None,
+) -> Optional[SpatialFilter]:
+    """Build a :class:`SpatialFilter` from user supplied ``bbox`` and/or ``polygon``."""
+
+    spatial: Optional[SpatialFilter] = None
+    if bbox is not None:
+        spatial = SpatialFilter.from_bbox(bbox)
+    if polygon is not None:
+        polygon_filter = SpatialFilter.from_geometry(load_polygon(polygon))
+        spatial = polygon_filter.intersection(spatial)
+    return spatial
+
+
+def combine_filters(
+    first: Optional[SpatialFilter],
+    second: Optional[SpatialFilter],
+) -> Optional[SpatialFilter]:
+    """Intersect two optional filters."""
+
+    if first is None:
+        return second
+    return first.intersection(second)
+
+
+class RegionAssigner:
+    """Assign coordinates to the regions whose boundary contains them.
+
+    Boundaries are held in an STRtree so a feature is tested only against the
+    few regions whose envelopes it touches. A way belongs to every region that
+    contains at least one of its vertices, so border-crossing ways are
+    reported for each neighbouring region.
+    """
+
+    def __init__(self, regions: Sequence[Tuple[str, BaseGeometry]]):
+        if not regions:
+            raise ValueError("RegionAssigner requires at least one region")
+        self.codes: List[str] = [code for code, _ in regions]
+        geometries = [geometry for _, geometry in regions]
+        self._tree = shapely.STRtree(geometries)
+        bounds = shapely.total_bounds(geometries)
+        self.bbox: BBox = tuple(float(value) for value in bounds)  # type: ignore[assignment]
+
+    def spatial_filter(self) -> SpatialFilter:
+        """Return a bounding-box filter covering every region."""
+
+        return SpatialFilter.from_bbox(self.bbox)
+
+    def assign(self, coords: Sequence[Sequence[float]]) -> List[str]:
+        """Return the region codes containing any of ``coords``, in region order."""
+
+        if not coords:
+            return []
+        points = shapely.points(np.asarray(coords, dtype=float))
+        _, hits = self._tree.query(points, predicate="intersects")
+        return [self.codes[index] for index in sorted(set(hits.tolist()))]
+
+
+__all__ = [
+    "BBox",
+    "RegionAssigner",
+    "SpatialFilter",
+    "bbox_disjoint",
+    "combine_filters",
+    "load_polygon",
+    "make_spatial_filter",
+]
@@ -0,0 +1,440 @@
+"""Binary spill files for the two-phase export writer.
+
+Export targets cannot write CSV or GeoJSON until every row has been seen,
+because the melted ``other_tags`` columns depend on tag frequencies over the
+whole output. Rows are therefore spilled to a temporary file first and
+replayed once the column layout is known.
+
+Rows are buffered into batches and stored column-wise: ids, coordinates and
+way node references go into numpy arrays, ``Region``/``Type`` are dictionary
+encoded and the remaining columns keep the positions and values of their
+non-null cells. A batch is stored as a JSON header with the dictionaries and
+the cell values, followed by its numpy arrays in ``.npy`` format, and
+optionally compressed; replaying a batch costs a few decode calls instead of
+a JSON parse per row. Nothing is unpickled, so a spill file kept as an export
+checkpoint in the data directory cannot run code when it is replayed.
+
+File layout: the ``MAGIC`` header, one byte naming the codec, then for every
+batch an 8-byte little-endian length followed by the encoded payload.
+
+:class:`SortedSpillWriter` turns the spill into an external merge sort: rows
+are buffered into runs, each run is sorted in memory and appended as a byte
+range of batches, and replaying merges the runs with :func:`heapq.merge`.
+"""
+
+from __future__ import annotations
+
+import bz2
+import heapq
+import io
+import json
+import logging
+import lzma
+import os
+import struct
+import tempfile
+import zlib
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger("eo.spill")
+
+MAGIC = b"EOSPILL2"
+SPILL_BATCH_ROWS = 8192
+DEFAULT_SPILL_COMPRESSION = "zlib"
+# Rows sorted in memory per run of a SortedSpillWriter.
+SORT_RUN_ROWS = 100_000
+
+_LENGTH = struct.Struct("<Q")
+_FIXED_COLUMNS = ("id", "Region", "Type", "lonlat", "refs")
+
+_CODECS: Dict[
+    Optional[str], Tuple[int, Callable[[bytes], bytes], Callable[[bytes], bytes]]
+] = {
+    None: (0, lambda data: data, lambda data: data),
+    "zlib": (1, lambda data: zlib.compress(data, 1), zlib.decompress),
+    "bz2": (2, lambda data: bz2.compress(data, 1), bz2.decompress),
+    "lzma": (3, lambda data: lzma.compress(data, preset=0), lzma.decompress),
+}
+_CODEC_IDS = {codec_id: name for name, (codec_id, _, _) in _CODECS.items()}
+
+
+def _ragged(values: List[Any], dtype: type) -> Tuple[np.ndarray, np.ndarray]:
+    """Return ``(counts, flat)`` for a list of sequences; ``None`` entries get count -1."""
+
+    counts = np.fromiter(
+        (-1 if value is None else len(value) for value in values),
+        dtype=np.int64,
+        count=len(values),
+    )
+    flat = [item for value in values if value is not None for item in value]
+    return counts, np.asarray(flat, dtype=dtype)
+
+
+def _unragged(counts: np.ndarray, flat: List[Any]) -> List[Any]:
+    ends = np.cumsum(np.maximum(counts, 0)).tolist()
+    rows: List[Any] = []
+    start = 0
+    for count, end in zip(counts.tolist(), ends):
+        rows.append(None if count < 0 else flat[start:end])
+        start = end
+    return rows
+
+
+def _dictionary(values: List[Any]) -> Tuple[List[Any], np.ndarray]:
+    lookup: Dict[Any, int] = {}
+    codes = np.fromiter(
+        (lookup.setdefault(value, len(lookup)) for value in values),
+        dtype=np.int32,
+        count=len(values),
+    )
+    return list(lookup), codes
+
+
+def encode_batch(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Convert a list of row dictionaries into a columnar batch."""
+
+    try:
+        ids: Any = np.fromiter((record.get("id") for record in records), dtype=np.int64)
+    except (TypeError, ValueError):
+        ids = [record.get("id") for record in records]
+
+    region_values, region_codes = _dictionary([record.get("Region") for record in records])
+    type_values, type_codes = _dictionary([record.get("Type") for record in records])
+    lonlat_counts, coords = _ragged([record.get("lonlat") for record in records], np.float64)
+    refs_counts: Optional[np.ndarray]
+    refs: Union[np.ndarray, List[Any]]
+    try:
+        refs_counts, refs = _ragged([record.get("refs") for record in records], np.int64)
+    except (TypeError, ValueError):
+        refs_counts, refs = None, [record.get("refs") for record in records]
+
+    columns: Dict[str, Tuple[List[int], List[Any]]] = {}
+    for position, record in enumerate(records):
+        for key, value in record.items():
+            if key in _FIXED_COLUMNS or value is None:
+                continue
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = ([], [])
+            column[0].append(position)
+            column[1].append(value)
+
+    return {
+        "rows": len(records),
+        "id": ids,
+        "Region": (region_values, region_codes),
+        "Type": (type_values, type_codes),
+        "lonlat": (lonlat_counts, coords.reshape(-1, 2) if len(coords) else coords),
+        "refs": (refs_counts, refs),
+        "columns": {
+            key: (np.asarray(positions, dtype=np.int32), values)
+            for key, (positions, values) in columns.items()
+        },
+    }
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot spill a value of type {type(value).__name__}")
+
+
+def _dump_batch(batch: Dict[str, Any]) -> bytes:
+    """Serialize a batch of :func:`encode_batch` without pickling."""
+
+    ids = batch["id"]
+    region_values, region_codes = batch["Region"]
+    type_values, type_codes = batch["Type"]
+    lonlat_counts, coords = batch["lonlat"]
+    refs_counts, refs = batch["refs"]
+    columns = batch["columns"]
+
+    arrays = [region_codes, type_codes, lonlat_counts, coords]
+    if isinstance(ids, np.ndarray):
+        arrays.append(ids)
+    if refs_counts is not None:
+        arrays.extend((refs_counts, refs))
+    arrays.extend(positions for positions, _ in columns.values())
+    header = {
+        "rows": batch["rows"],
+        "id": None if isinstance(ids, np.ndarray) else ids,
+        "Region": region_values,
+        "Type": type_values,
+        "refs": refs if refs_counts is None else None,
+        "columns": [[key, values] for key, (_, values) in columns.items()],
+    }
+
+    buffer = io.BytesIO()
+    text = json.dumps(header, ensure_ascii=False, separators=(",", ":"), default=_json_default)
+    encoded = text.encode("utf-8")
+    buffer.write(_LENGTH.pack(len(encoded)))
+    buffer.write(encoded)
+    for array in arrays:
+        np.lib.format.write_array(buffer, np.ascontiguousarray(array), allow_pickle=False)
+    return buffer.getvalue()
+
+
+def _load_batch(data: bytes) -> Dict[str, Any]:
+    """Rebuild the batch written by :func:`_dump_batch`."""
+
+    buffer = io.BytesIO(data)
+    (length,) = _LENGTH.unpack(buffer.read(_LENGTH.size))
+    header = json.loads(buffer.read(length).decode("utf-8"))
+
+    def read() -> np.ndarray:
+        return np.lib.format.read_array(buffer, allow_pickle=False)
+
+    region_codes, type_codes, lonlat_counts, coords = read(), read(), read(), read()
+    ids = header["id"] if header["id"] is not None else read()
+    refs_counts, refs = (read(), read()) if header["refs"] is None else (None, header["refs"])
+    return {
+        "rows": header["rows"],
+        "id": ids,
+        "Region": (header["Region"], region_codes),
+        "Type": (header["Type"], type_codes),
+        "lonlat": (lonlat_counts, coords),
+        "refs": (refs_counts, refs),
+        "columns": {key: (read(), values) for key, values in header["columns"]},
+    }
+
+
+def decode_batch(batch: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Rebuild the row dictionaries of a batch produced by :func:`encode_batch`."""
+
+    count = batch["rows"]
+    ids = batch["id"]
+    ids = ids.tolist() if isinstance(ids, np.ndarray) else ids
+    region_values, region_codes = batch["Region"]
+    type_values, type_codes = batch["Type"]
+
+    lonlat_counts, coords = batch["lonlat"]
+    lonlats = _unragged(lonlat_counts, coords.tolist())
+    refs_counts, refs = batch["refs"]
+    refs_rows = refs if refs_counts is None else _unragged(refs_counts, refs.tolist())
+
+    records: List[Dict[str, Any]] = []
+    for index, region_code, type_code in zip(
+        range(count), region_codes.tolist(), type_codes.tolist()
+    ):
+        record: Dict[str, Any] = {
+            "id": ids[index],
+            "Region": region_values[region_code],
+            "Type": type_values[type_code],
+        }
+        if lonlats[index] is not None:
+            record["lonlat"] = lonlats[index]
+        if refs_rows[index] is not None:
+            record["refs"] = refs_rows[index]
+        records.append(record)
+
+    for key, (positions, values) in batch["columns"].items():
+        for position, value in zip(positions.tolist(), values):
+            records[position][key] = value
+
+    return records
+
+
+class SpillWriter:
+    """Append rows to a temporary spill file in compressed columnar batches."""
+
+    def __init__(
+        self,
+        spill_dir: Optional[str] = None,
+        compression: Optional[str] = DEFAULT_SPILL_COMPRESSION,
+        batch_rows: int = SPILL_BATCH_ROWS,
+    ):
+        if compression not in _CODECS:
+            raise ValueError(
+                f"Unsupported spill compression {compression!r}; "
+                f"choose from {sorted(str(name) for name in _CODECS)}"
+            )
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+
+        codec_id = _CODECS[compression][0]
+        self.compression = compression
+        self.batch_rows = batch_rows
+        self._buffer: List[Dict[str, Any]] = []
+        spill_file = tempfile.NamedTemporaryFile(
+            mode="wb", prefix="eo-spill-", suffix=".bin", dir=spill_dir, delete=False
+        )
+        self._file: Optional[IO[bytes]] = spill_file
+        self.path = spill_file.name
+        spill_file.write(MAGIC)
+        spill_file.write(bytes([codec_id]))
+        self.rows = 0
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self._buffer.append(record)
+        if len(self._buffer) >= self.batch_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._buffer or self._file is None:
+            return
+        compress = _CODECS[self.compression][1]
+        payload = compress(_dump_batch(encode_batch(self._buffer)))
+        self._file.write(_LENGTH.pack(len(payload)))
+        self._file.write(payload)
+        self.rows += len(self._buffer)
+        self._buffer = []
+
+    def checkpoint(self) -> int:
+        """Write the buffered rows and return the file offset reached."""
+
+        self.flush()
+        if self._file is None:
+            raise RuntimeError(f"Spill file {self.path} is closed")
+        return self._file.tell()
+
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        return iter_spill_records(self.path)
+
+    def close(self) -> None:
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
+        logger.debug(
+            "Spilled %d rows to %s (%d bytes)",
+            self.rows,
+            self.path,
+            os.path.getsize(self.path),
+        )
+
+    def remove(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class SortedSpillWriter:
+    """Spill rows as sorted runs and replay them merged in key order.
+
+    ``sort_key`` maps a list of rows to an array of integer keys. Every
+    ``run_rows`` rows are ordered by key and appended to the spill file as
+    one run; ``iter_records`` merges the runs lazily, holding one decoded
+    batch per run. Rows with equal keys keep their arrival order.
+    """
+
+    def __init__(
+        self,
+        sort_key: Callable[[Sequence[Dict[str, Any]]], np.ndarray],
+        spill_dir: Optional[str] = None,
+        compression: Optional[str] = DEFAULT_SPILL_COMPRESSION,
+        run_rows: int = SORT_RUN_ROWS,
+        batch_rows: int = SPILL_BATCH_ROWS,
+    ):
+        if run_rows < 1:
+            raise ValueError("run_rows must be positive")
+        self.sort_key = sort_key
+        self.run_rows = run_rows
+        self._spill = SpillWriter(spill_dir, compression, batch_rows)
+        self.path = self._spill.path
+        self.compression = compression
+        # (start, end) byte offsets of the runs in the spill file.
+        self.runs: List[Tuple[int, int]] = []
+        self._run: List[Dict[str, Any]] = []
+
+    @property
+    def rows(self) -> int:
+        return self._spill.rows + len(self._run)
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self._run.append(record)
+        if len(self._run) >= self.run_rows:
+            self._write_run()
+
+    def _write_run(self) -> None:
+        if not self._run:
+            return
+        order = np.argsort(np.asarray(self.sort_key(self._run)), kind="stable")
+        start = self._spill.checkpoint()
+        for index in order.tolist():
+            self._spill.write(self._run[index])
+        self.runs.append((start, self._spill.checkpoint()))
+        self._run = []
+
+    def close(self) -> None:
+        if self._spill._file is not None:
+            self._write_run()
+        self._spill.close()
+
+    def remove(self) -> None:
+        self._run = []
+        self._spill.remove()
+
+    def _iter_keyed(
+        self, run: int, start: int, end: int
+    ) -> Iterator[Tuple[Any, int, int, Dict[str, Any]]]:
+        position = 0
+        for batch in iter_spill_batches(self.path, start, end):
+            for key, record in zip(np.asarray(self.sort_key(batch)).tolist(), batch):
+                yield key, run, position, record
+                position += 1
+
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        if len(self.runs) == 1:
+            yield from iter_spill_records(self.path, *self.runs[0])
+            return
+        streams = [
+            self._iter_keyed(run, start, end) for run, (start, end) in enumerate(self.runs)
+        ]
+        for _, _, _, record in heapq.merge(*streams):
+            yield record
+
+
+def iter_spill_batches(
+    path: str,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+) -> Iterator[List[Dict[str, Any]]]:
+    """Yield the rows of a spill file batch by batch.
+
+    ``start``/``end`` restrict the replay to the batches within that byte
+    range, e.g. one run of a :class:`SortedSpillWriter`.
+    """
+
+    with open(path, "rb") as source:
+        if source.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an earth_osm spill file")
+        codec_id = source.read(1)[0]
+        if codec_id not in _CODEC_IDS:
+            raise ValueError(f"{path} uses unknown spill codec {codec_id}")
+        decompress = _CODECS[_CODEC_IDS[codec_id]][2]
+        if start is not None:
+            source.seek(start)
+
+        while end is None or source.tell() < end:
+            header = source.read(_LENGTH.size)
+            if not header:
+                return
+            (length,) = _LENGTH.unpack(header)
+            yield decode_batch(_load_batch(decompress(source.read(length))))
+
+
+def iter_spill_records(
+    path: str,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+) -> Iterator[Dict[str, Any]]:
+    for batch in iter_spill_batches(path, start, end):
+        yield from batch
+
+
+__all__ = [
+    "DEFAULT_SPILL_COMPRESSION",
+    "SORT_RUN_ROWS",
+    "SPILL_BATCH_ROWS",
+    "SortedSpillWriter",
+    "SpillWriter",
+    "decode_batch",
+    "encode_batch",
+    "iter_spill_batches",
+    "iter_spill_records",
+]
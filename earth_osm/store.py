@@ -0,0 +1,495 @@
+"""Persistent SQLite feature store updated incrementally across runs.
+
+Features are keyed by ``(region, primary_name, element, id)`` where
+``element`` is the OSM element type (``node`` or ``way``; areas are ways).
+Each row keeps a content hash of its ``Type``, coordinates, refs and tags,
+so a refresh only rewrites the features whose content changed. Which
+features (``line``, ``substation``, ...) an element was exported for is kept
+in a ``memberships`` table.
+
+A :class:`StoreSync` stages the rows of one run in temporary tables and
+applies them in a single write transaction on :meth:`StoreSync.commit`:
+new keys are inserted, changed rows updated, and for every
+``(region, primary_name, feature)`` written during the run, the elements
+that are no longer exported are removed. An R-tree over the feature
+bounding boxes serves spatial queries through :meth:`FeatureStore.query`.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import math
+import os
+import sqlite3
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger("eo.store")
+
+STORE_VERSION = 1
+STORE_BATCH_SIZE = 10_000
+# Seconds to wait for another process writing to the same store.
+LOCK_TIMEOUT = 3600.0
+
+_FIXED_COLUMNS = ("id", "Region", "Type", "lonlat", "refs")
+_TAG_PREFIX = "tags."
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS features (
+        fid INTEGER PRIMARY KEY,
+        region TEXT NOT NULL,
+        primary_name TEXT NOT NULL,
+        element TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        type TEXT,
+        hash BLOB NOT NULL,
+        min_lon REAL, min_lat REAL, max_lon REAL, max_lat REAL,
+        lonlat TEXT,
+        refs TEXT,
+        tags TEXT NOT NULL,
+        sync_run INTEGER NOT NULL,
+        UNIQUE (region, primary_name, element, id))""",
+    "CREATE INDEX IF NOT EXISTS features_sync_run ON features (sync_run)",
+    """CREATE TABLE IF NOT EXISTS memberships (
+        region TEXT NOT NULL,
+        primary_name TEXT NOT NULL,
+        feature TEXT NOT NULL,
+        element TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        PRIMARY KEY (region, primary_name, feature, element, id)) WITHOUT ROWID""",
+    """CREATE INDEX IF NOT EXISTS memberships_element
+        ON memberships (region, primary_name, element, id)""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS features_rtree
+        USING rtree(fid, min_lon, max_lon, min_lat, max_lat)""",
+    """CREATE TABLE IF NOT EXISTS sync_runs (
+        run INTEGER PRIMARY KEY,
+        started TEXT NOT NULL,
+        finished TEXT NOT NULL,
+        primary_name TEXT NOT NULL,
+        scopes TEXT NOT NULL,
+        inserted INTEGER NOT NULL,
+        updated INTEGER NOT NULL,
+        unchanged INTEGER NOT NULL,
+        deleted INTEGER NOT NULL)""",
+)
+
+_STAGING = (
+    """CREATE TEMP TABLE sync_rows (
+        region TEXT NOT NULL,
+        element TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        type TEXT,
+        hash BLOB NOT NULL,
+        min_lon REAL, min_lat REAL, max_lon REAL, max_lat REAL,
+        lonlat TEXT,
+        refs TEXT,
+        tags TEXT NOT NULL,
+        PRIMARY KEY (region, element, id)) WITHOUT ROWID""",
+    """CREATE TEMP TABLE sync_members (
+        region TEXT NOT NULL,
+        feature TEXT NOT NULL,
+        element TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        PRIMARY KEY (region, feature, element, id)) WITHOUT ROWID""",
+    """CREATE TEMP TABLE sync_scopes (
+        region TEXT NOT NULL,
+        feature TEXT NOT NULL,
+        PRIMARY KEY (region, feature)) WITHOUT ROWID""",
+)
+
+_ROW_COLUMNS = "type, hash, min_lon, min_lat, max_lon, max_lat, lonlat, refs, tags"
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+_dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode
+
+
+def _is_null(value: Any) -> bool:
+    if value is None:
+        return True
+    return isinstance(value, float) and math.isnan(value)
+
+
+def element_type(feature_type: Optional[str]) -> str:
+    """Return the OSM element type (``node`` or ``way``) of a feature ``Type``."""
+
+    return "node" if feature_type == "node" else "way"
+
+
+def _content_hash(
+    feature_type: Optional[str],
+    lonlat_text: Optional[str],
+    refs_text: Optional[str],
+    tags_text: str,
+) -> bytes:
+    payload = "\x1f".join((feature_type or "", lonlat_text or "", refs_text or "", tags_text))
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).digest()
+
+
+def feature_hash(
+    feature_type: Optional[str],
+    lonlat: Optional[Sequence[Sequence[float]]],
+    refs: Optional[Sequence[int]],
+    tags: Dict[str, Any],
+) -> bytes:
+    """Return the 16 byte content hash of a feature, independent of tag order."""
+
+    return _content_hash(
+        feature_type,
+        None if lonlat is None else _dumps(lonlat),
+        None if refs is None else _dumps(refs),
+        _dumps(tags),
+    )
+
+
+def _tag_name(column: str) -> str:
+    if not column.startswith(_TAG_PREFIX):
+        return column
+    prefix_length = len(_TAG_PREFIX)
+    return column[prefix_length:]
+
+
+def _record_tags(record: Dict[str, Any]) -> Dict[str, Any]:
+    tags: Dict[str, Any] = {}
+    for key, value in record.items():
+        if key in _FIXED_COLUMNS or _is_null(value):
+            continue
+        if key == "other_tags" and isinstance(value, dict):
+            for other_key, other_value in value.items():
+                if not _is_null(other_value):
+                    tags[_tag_name(other_key)] = other_value
+            continue
+        tags[_tag_name(key)] = value
+    return tags
+
+
+def _row_values(region: str, record: Dict[str, Any]) -> Tuple:
+    feature_type = record.get("Type")
+    lonlat = record.get("lonlat")
+    refs = record.get("refs")
+    lonlat_text = None if _is_null(lonlat) else _dumps(lonlat)
+    refs_text = None if _is_null(refs) else _dumps(refs)
+    tags_text = _dumps(_record_tags(record))
+
+    bounds: Sequence[Optional[float]] = (None, None, None, None)
+    if lonlat is not None and lonlat_text is not None and len(lonlat):
+        lons = [pair[0] for pair in lonlat]
+        lats = [pair[1] for pair in lonlat]
+        bounds = (min(lons), min(lats), max(lons), max(lats))
+
+    return (
+        region,
+        element_type(feature_type),
+        int(record["id"]),
+        feature_type,
+        _content_hash(feature_type, lonlat_text, refs_text, tags_text),
+        *bounds,
+        lonlat_text,
+        refs_text,
+        tags_text,
+    )
+
+
+class SyncStats(NamedTuple):
+    """Row counts of one :meth:`StoreSync.commit`."""
+
+    run: int
+    inserted: int
+    updated: int
+    unchanged: int
+    deleted: int
+
+
+def _scalar(conn: sqlite3.Connection, sql: str, default: Any = None) -> Any:
+    """Return the first column of the first row of ``sql``, or ``default`` without rows."""
+
+    row = conn.execute(sql).fetchone()
+    return default if row is None else row[0]
+
+
+def connect(path: str, timeout: float = LOCK_TIMEOUT) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+class FeatureStore:
+    """SQLite feature store at ``path``, created on first use."""
+
+    def __init__(self, path: str, timeout: float = LOCK_TIMEOUT):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = connect(path, timeout)
+        version = _scalar(self._conn, "PRAGMA user_version", 0)
+        if version > STORE_VERSION:
+            self._conn.close()
+            raise RuntimeError(
+                f"Feature store {path} has version {version}; "
+                f"this earth_osm supports {STORE_VERSION}"
+            )
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in _SCHEMA:
+                self._conn.execute(statement)
+            self._conn.execute(f"PRAGMA user_version = {STORE_VERSION}")
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            self._conn.close()
+            raise
+
+    def __enter__(self) -> "FeatureStore":
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def begin_sync(self, primary_name: str, batch_size: int = STORE_BATCH_SIZE) -> "StoreSync":
+        """Start staging the rows of one run for ``primary_name``."""
+
+        return StoreSync(self._conn, primary_name, batch_size)
+
+    def runs(self) -> List[Dict[str, Any]]:
+        """Return the log of committed runs, oldest first."""
+
+        cursor = self._conn.execute("SELECT * FROM sync_runs ORDER BY run")
+        names = [column[0] for column in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+    def query(
+        self,
+        primary_name: Optional[str] = None,
+        region: Optional[str] = None,
+        feature: Optional[str] = None,
+        bbox: Optional[Sequence[float]] = None,
+        changed_since: Optional[int] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """Yield stored features as flattened rows (``id``, ``Region``, ``Type``, ...).
+
+        ``bbox`` (``min_lon, min_lat, max_lon, max_lat``) selects features whose
+        bounding box intersects it through the R-tree. ``changed_since``
+        keeps the features inserted or changed by runs after that run number.
+        """
+
+        joins: List[str] = []
+        where: List[str] = []
+        params: List[Any] = []
+        if bbox is not None:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            joins.append("JOIN features_rtree r ON r.fid = f.fid")
+            where.append(
+                "r.max_lon >= ? AND r.min_lon <= ? AND r.max_lat >= ? AND r.min_lat <= ?"
+            )
+            params.extend([min_lon, max_lon, min_lat, max_lat])
+        if feature is not None:
+            where.append("""EXISTS (SELECT 1 FROM memberships m WHERE m.region = f.region
+                AND m.primary_name = f.primary_name AND m.element = f.element
+                AND m.id = f.id AND m.feature = ?)""")
+            params.append(feature)
+        for column, value in (("primary_name", primary_name), ("region", region)):
+            if value is not None:
+                where.append(f"f.{column} = ?")
+                params.append(value)
+        if changed_since is not None:
+            where.append("f.sync_run > ?")
+            params.append(changed_since)
+
+        sql = (
+            "SELECT f.id, f.region, f.type, f.lonlat, f.refs, f.tags FROM features f "
+            + " ".join(joins)
+        )
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        for feature_id, feature_region, feature_type, lonlat, refs, tags in self._conn.execute(
+            sql + " ORDER BY f.fid", params
+        ):
+            row: Dict[str, Any] = {
+                "id": feature_id,
+                "Region": feature_region,
+                "Type": feature_type,
+                "lonlat": None if lonlat is None else json.loads(lonlat),
+            }
+            if refs is not None:
+                row["refs"] = json.loads(refs)
+            for key, value in json.loads(tags).items():
+                row[f"{_TAG_PREFIX}{key}"] = value
+            yield row
+
+
+class StoreSync:
+    """Rows of one run staged for a :class:`FeatureStore`.
+
+    Rows are buffered and staged in temporary tables with ``executemany``;
+    the store itself is only locked for writing by :meth:`commit`.
+    """
+
+    def __init__(
+        self, conn: sqlite3.Connection, primary_name: str, batch_size: int = STORE_BATCH_SIZE
+    ):
+        self._conn = conn
+        self.primary_name = primary_name
+        self.batch_size = batch_size
+        self.started = _now()
+        self._rows: List[Tuple] = []
+        self._members: List[Tuple] = []
+        self._scopes: Set[Tuple[str, str]] = set()
+        self._drop_staging()
+        for statement in _STAGING:
+            self._conn.execute(statement)
+
+    def write(self, region: str, feature: str, record: Dict[str, Any]) -> None:
+        """Stage ``record``, exported for ``feature`` of ``region``."""
+
+        values = _row_values(region, record)
+        self._rows.append(values)
+        self._members.append((region, feature, values[1], values[2]))
+        self._scopes.add((region, feature))
+        if len(self._rows) >= self.batch_size:
+            self._flush()
+
+    def add_scope(self, region: str, feature: str) -> None:
+        """Mark ``feature`` of ``region`` as refreshed even if it had no rows."""
+
+        self._scopes.add((region, feature))
+
+    def _flush(self) -> None:
+        if self._rows:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO temp.sync_rows VALUES ({', '.join('?' * 12)})",
+                self._rows,
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO temp.sync_members VALUES (?, ?, ?, ?)", self._members
+            )
+        self._rows, self._members = [], []
+
+    def _drop_staging(self) -> None:
+        for table in ("sync_rows", "sync_members", "sync_scopes"):
+            self._conn.execute(f"DROP TABLE IF EXISTS temp.{table}")
+
+    def commit(self) -> SyncStats:
+        """Apply the staged rows to the store and return what changed."""
+
+        self._flush()
+        conn = self._conn
+        conn.executemany(
+            "INSERT OR IGNORE INTO temp.sync_scopes VALUES (?, ?)", sorted(self._scopes)
+        )
+        primary = self.primary_name
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            run = _scalar(conn, "SELECT coalesce(max(run), 0) + 1 FROM sync_runs", 1)
+            staged = _scalar(conn, "SELECT count(*) FROM temp.sync_rows", 0)
+
+            inserted = conn.execute(
+                f"""INSERT INTO features
+                (region, primary_name, element, id, {_ROW_COLUMNS}, sync_run)
+                SELECT region, ?, element, id, {_ROW_COLUMNS}, ? FROM temp.sync_rows WHERE true
+                ON CONFLICT (region, primary_name, element, id) DO NOTHING""",
+                (primary, run),
+            ).rowcount
+            # Correlated subqueries rather than UPDATE ... FROM, which needs
+            # SQLite 3.33.
+            updated = conn.execute(
+                f"""UPDATE features SET ({_ROW_COLUMNS}, sync_run) =
+                    (SELECT {_ROW_COLUMNS}, ? FROM temp.sync_rows AS s
+                    WHERE s.region = features.region AND s.element = features.element
+                    AND s.id = features.id)
+                WHERE fid IN (SELECT f.fid FROM temp.sync_rows AS s JOIN features AS f
+                    ON f.region = s.region AND f.primary_name = ?
+                    AND f.element = s.element AND f.id = s.id
+                    WHERE f.hash != s.hash)""",
+                (run, primary),
+            ).rowcount
+            conn.execute(
+                """INSERT OR REPLACE INTO features_rtree
+                SELECT fid, min_lon, max_lon, min_lat, max_lat FROM features
+                WHERE sync_run = ? AND min_lon IS NOT NULL""",
+                (run,),
+            )
+
+            conn.execute(
+                """INSERT OR IGNORE INTO memberships
+                SELECT region, ?, feature, element, id FROM temp.sync_members""",
+                (primary,),
+            )
+            conn.execute(
+                """DELETE FROM memberships
+                WHERE primary_name = ?
+                AND (region, feature) IN (SELECT region, feature FROM temp.sync_scopes)
+                AND NOT EXISTS (SELECT 1 FROM temp.sync_members s
+                    WHERE s.region = memberships.region
+                    AND s.feature = memberships.feature AND s.element = memberships.element
+                    AND s.id = memberships.id)""",
+                (primary,),
+            )
+            vanished = """FROM features WHERE primary_name = ?
+                AND region IN (SELECT region FROM temp.sync_scopes)
+                AND NOT EXISTS (SELECT 1 FROM memberships m WHERE m.region = features.region
+                    AND m.primary_name = features.primary_name AND m.element = features.element
+                    AND m.id = features.id)"""
+            conn.execute(
+                f"DELETE FROM features_rtree WHERE fid IN (SELECT fid {vanished})", (primary,)
+            )
+            deleted = conn.execute(f"DELETE {vanished}", (primary,)).rowcount
+
+            stats = SyncStats(run, inserted, updated, staged - inserted - updated, deleted)
+            conn.execute(
+                "INSERT INTO sync_runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    run,
+                    self.started,
+                    _now(),
+                    primary,
+                    _dumps(sorted(self._scopes)),
+                    stats.inserted,
+                    stats.updated,
+                    stats.unchanged,
+                    stats.deleted,
+                ),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            self._drop_staging()
+
+        logger.info(
+            "Feature store run %d (%s): %d inserted, %d updated, %d unchanged, %d deleted",
+            run,
+            primary,
+            stats.inserted,
+            stats.updated,
+            stats.unchanged,
+            stats.deleted,
+        )
+        return stats
+
+    def rollback(self) -> None:
+        """Discard the staged rows."""
+
+        self._rows, self._members = [], []
+        self._scopes.clear()
+        self._drop_staging()
+
+
+__all__ = [
+    "FeatureStore",
+    "STORE_BATCH_SIZE",
+    "STORE_VERSION",
+    "StoreSync",
+    "SyncStats",
+    "element_type",
+    "feature_hash",
+]
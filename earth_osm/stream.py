@@ -15,13 +15,55 @@ import json
 import logging
 import multiprocessing as mp
 import os
-from dataclasses import dataclass
-from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Union
-
-from earth_osm.extract import primary_entry_filter
-from earth_osm.regions import download_region_pbf
-from earth_osm.osmpbf import Node, Relation, Way, fileformat_pb2, osmformat_pb2
-from earth_osm.osmpbf.file import iter_blocks, iter_primitive_block, read_blob
+from dataclasses import dataclass, replace
+from itertools import accumulate
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Union,
+)
+
+import numpy as np
+from shapely.geometry.base import BaseGeometry
+
+from earth_osm.blockcache import BlockCache, BlockCacheScan, spatial_key
+from earth_osm.blockindex import BlockIndex, BlockStats, load_block_index, save_block_index
+from earth_osm.checkpoint import load_scan_checkpoint, save_scan_checkpoint
+from earth_osm.regions import (
+    download_region_pbf,
+    find_cached_parent_pbf,
+    get_region_geometry,
+    local_pbf_path,
+)
+from earth_osm.osmpbf import Node, Way, fileformat_pb2, osmformat_pb2
+from earth_osm.osmpbf.file import (
+    decode_dense_arrays,
+    decode_strmap,
+    dense_node_tags,
+    iter_blocks,
+    read_blob,
+)
+from earth_osm.predicate import (
+    And,
+    TagPredicate,
+    compile_tag_filter,
+    feature_predicate,
+    normalize_predicate,
+)
+from earth_osm.spatial import (
+    BBox,
+    RegionAssigner,
+    SpatialFilter,
+    combine_filters,
+    make_spatial_filter,
+)
 from earth_osm.utils import tag_value_matches
 
 logger = logging.getLogger("eo.stream")
@@ -95,25 +137,30 @@ def _iter_matching_features(
     primary_name: str,
     feature_names: Sequence[str],
 ) -> Iterator[str]:
-    value = tags.get(primary_name)
-    if value is None:
+    if tags.get(primary_name) is None:
         return
 
     for feature_name in feature_names:
-        if tag_value_matches(value, feature_name):
+        if feature_predicate(primary_name, (feature_name,)).matches(tags):
             yield feature_name
 
 
 def _build_pre_filter(
     primary_name: str,
     feature_selection: Union[str, Sequence[str]],
-) -> Dict[type, Dict[str, List[str]]]:
-    feature_values = _normalize_feature_names(feature_selection)
-    return {
-        Node: {primary_name: feature_values},
-        Way: {primary_name: feature_values},
-        Relation: {primary_name: feature_values},
-    }
+    tag_filter: Optional[TagPredicate] = None,
+) -> TagPredicate:
+    """Return the predicate selecting scan candidates.
+
+    Elements must match one of the requested ``primary_name`` values and,
+    when given, the additional ``tag_filter``.
+    """
+
+    feature_values = tuple(_normalize_feature_names(feature_selection))
+    predicate = feature_predicate(primary_name, feature_values)
+    if tag_filter is not None:
+        predicate = And((predicate, tag_filter))
+    return predicate
 
 
 def _make_progress_callback(description: str, step: int = 5) -> Callable[[int, int], None]:
@@ -151,86 +198,168 @@ def _prepare_block_descriptors(filename: str) -> List[tuple[int, bytes]]:
     return descriptors
 
 
-def _scan_block_worker(
-    task: tuple[str, int, bytes, str, Sequence[str]]
-) -> tuple[List[Node], List[Way], Set[int]]:
-    filename, ofs, header_bytes, primary_name, feature_names = task
+def _read_header_bbox(filename: str) -> Optional[BBox]:
+    """Return the ``(min_lon, min_lat, max_lon, max_lat)`` box declared in the PBF header."""
 
+    with open(filename, "rb") as file:
+        for ofs, header in iter_blocks(file):
+            if header.type != "OSMHeader":
+                continue
+            block = osmformat_pb2.HeaderBlock()
+            block.ParseFromString(read_blob(file, ofs, header))
+            if not block.HasField("bbox"):
+                return None
+            scale = 0.000000001
+            return (
+                block.bbox.left * scale,
+                block.bbox.bottom * scale,
+                block.bbox.right * scale,
+                block.bbox.top * scale,
+            )
+    return None
+
+
+def _read_primitive_block(filename: str, ofs: int, header_bytes: bytes) -> Any:
     header = fileformat_pb2.BlobHeader()
     header.ParseFromString(header_bytes)
 
     primitive = osmformat_pb2.PrimitiveBlock()
     with open(filename, "rb") as file:
         primitive.ParseFromString(read_blob(file, ofs, header))
+    return primitive
+
+
+def _scan_block_worker(
+    task: tuple[
+        str, int, bytes, TagPredicate, Optional[SpatialFilter], Optional[BlockCacheScan]
+    ]
+) -> tuple[List[Node], List[Way], Set[int], tuple[int, BlockStats]]:
+    """Collect candidate elements from one block.
+
+    Dense nodes are decoded into numpy arrays so block statistics and the
+    spatial filter are evaluated without materialising a :class:`Node` per
+    element. The predicate is bound to the block's string table and tested on
+    integer key/value indices; tags are decoded only for matching elements and
+    relations are counted but never decoded. With a block cache the result is
+    read from it when possible and stored in it otherwise.
+    """
+
+    filename, ofs, header_bytes, predicate, spatial, cache = task
+    if cache is not None:
+        cached = cache.load(ofs)
+        if cached is not None:
+            return cached
 
-    pre_filter = _build_pre_filter(primary_name, feature_names)
+    primitive = _read_primitive_block(filename, ofs, header_bytes)
 
     nodes: List[Node] = []
     ways: List[Way] = []
     referenced: Set[int] = set()
+    stats = BlockStats()
+
+    strmap = decode_strmap(primitive)
+    bound = predicate.bind(strmap)
+    anchors = bound.anchors
+
+    for group in primitive.primitivegroup:
+        if len(group.dense.id):
+            ids, lons, lats, tag_starts, tag_ends = decode_dense_arrays(primitive, group)
+            stats.add_nodes(ids, lons, lats)
+
+            if bound.constant is not False:
+                keys_vals = np.asarray(group.dense.keys_vals, dtype=np.int64)
+                if anchors is None:
+                    candidates = np.arange(len(ids))
+                else:
+                    positions = np.flatnonzero(np.isin(keys_vals, list(anchors)))
+                    candidates = np.searchsorted(tag_ends, positions, side="left")
+                    valid = candidates < len(tag_ends)
+                    positions, candidates = positions[valid], candidates[valid]
+                    # Keys sit at even offsets from the start of each node's tags.
+                    candidates = np.unique(
+                        candidates[(positions - tag_starts[candidates]) % 2 == 0]
+                    )
+                if spatial is not None and len(candidates):
+                    inside = spatial.contains_xy(lons[candidates], lats[candidates])
+                    candidates = candidates[inside]
+
+                if len(candidates):
+                    index_list = keys_vals.tolist()
+                    for index in candidates.tolist():
+                        start, end = int(tag_starts[index]), int(tag_ends[index])
+                        value_start = start + 1
+                        keys = index_list[start:end:2]
+                        if not bound(dict(zip(keys, index_list[value_start:end:2]))):
+                            continue
+                        nodes.append(
+                            Node(
+                                int(ids[index]),
+                                dense_node_tags(strmap, index_list, start, end),
+                                (float(lons[index]), float(lats[index])),
+                            )
+                        )
+
+        for way in group.ways:
+            stats.ways += 1
+            if bound.constant is False:
+                continue
+            if anchors is not None and anchors.isdisjoint(way.keys):
+                continue
+            if not bound(dict(zip(way.keys, way.vals))):
+                continue
+            refs = tuple(accumulate(way.refs))
+            tags = {strmap[key]: strmap[value] for key, value in zip(way.keys, way.vals)}
+            ways.append(Way(way.id, tags, refs))
+            referenced.update(refs)
 
-    for entry in iter_primitive_block(primitive):
-        if not primary_entry_filter(entry, pre_filter):
-            continue
-
-        if isinstance(entry, Node):
-            nodes.append(entry)
-        elif isinstance(entry, Way):
-            ways.append(entry)
-            referenced.update(entry.refs)
+        stats.relations += len(group.relations)
 
-    return nodes, ways, referenced
+    result = nodes, ways, referenced, (ofs, stats)
+    if cache is not None:
+        cache.store(result)
+    return result
 
 
-_NODE_TARGETS: Set[int] = set()
+_NODE_TARGETS: np.ndarray = np.empty(0, dtype=np.int64)
 
 
 def _init_node_worker(required_ids: Set[int]) -> None:
     global _NODE_TARGETS
-    _NODE_TARGETS = set(required_ids)
+    _NODE_TARGETS = _sorted_id_array(required_ids)
 
 
-def _collect_nodes_block(task: tuple[str, int, bytes]) -> Dict[int, Node]:
-    filename, ofs, header_bytes = task
+def _sorted_id_array(ids: Iterable[int]) -> np.ndarray:
+    return np.sort(np.fromiter(ids, dtype=np.int64))
 
-    header = fileformat_pb2.BlobHeader()
-    header.ParseFromString(header_bytes)
 
-    primitive = osmformat_pb2.PrimitiveBlock()
-    with open(filename, "rb") as file:
-        primitive.ParseFromString(read_blob(file, ofs, header))
+def _match_block_nodes(primitive: Any, targets: np.ndarray) -> Dict[int, Node]:
+    """Return the nodes of ``primitive`` whose ids appear in the sorted ``targets``."""
 
     captured: Dict[int, Node] = {}
-    targets = _NODE_TARGETS
-    if not targets:
+    if len(targets) == 0:
         return captured
 
-    for entry in iter_primitive_block(primitive):
-        if isinstance(entry, Node) and entry.id in targets:
-            captured[entry.id] = entry
+    for group in primitive.primitivegroup:
+        if not len(group.dense.id):
+            continue
+        ids, lons, lats, _, _ = decode_dense_arrays(primitive, group)
+        positions = np.searchsorted(targets, ids)
+        positions[positions == len(targets)] = 0
+        for index in np.flatnonzero(targets[positions] == ids).tolist():
+            node_id = int(ids[index])
+            captured[node_id] = Node(node_id, {}, (float(lons[index]), float(lats[index])))
 
     return captured
 
 
-def _iter_pbf_entries(
-    filename: str,
-    *,
-    progress_cb: Optional[Callable[[int, int], None]] = None,
-) -> Iterator[object]:
-    file_size = os.path.getsize(filename)
-    processed = 0
+def _collect_nodes_block(task: tuple[str, int, bytes]) -> Dict[int, Node]:
+    filename, ofs, header_bytes = task
 
-    with open(filename, "rb") as file:
-        for ofs, header in iter_blocks(file):
-            primitive = osmformat_pb2.PrimitiveBlock()
-            primitive.ParseFromString(read_blob(file, ofs, header))
-            processed = min(ofs + header.datasize, file_size)
-            if progress_cb is not None:
-                progress_cb(processed, file_size)
-            yield from iter_primitive_block(primitive)
+    if len(_NODE_TARGETS) == 0:
+        return {}
 
-    if progress_cb is not None:
-        progress_cb(file_size, file_size)
+    primitive = _read_primitive_block(filename, ofs, header_bytes)
+    return _match_block_nodes(primitive, _NODE_TARGETS)
 
 
 def _iter_node_rows(
@@ -254,6 +383,7 @@ def _iter_way_rows(
     way_records: Iterable[Way],
     nodes: Dict[int, Node],
     region_code: str,
+    spatial: Optional[SpatialFilter] = None,
 ) -> Iterator[FeatureRow]:
     for way in sorted(way_records, key=lambda item: item.id):
         coords: List[tuple] = []
@@ -270,6 +400,9 @@ def _iter_way_rows(
             logger.debug("Skipping way %s due to insufficient coordinates", way.id)
             continue
 
+        if spatial is not None and not spatial.contains_any(coords):
+            continue
+
         feature_type = "area" if len(coords) >= 4 and coords[0] == coords[-1] else "way"
 
         yield FeatureRow(
@@ -282,17 +415,75 @@ def _iter_way_rows(
         )
 
 
+def _select_scan_blocks(
+    block_descriptors: Sequence[tuple[int, bytes]],
+    block_index: Optional[BlockIndex],
+    spatial: Optional[SpatialFilter],
+) -> List[tuple[int, bytes]]:
+    """Drop node-only blocks that lie outside ``spatial`` according to ``block_index``."""
+
+    if block_index is None or spatial is None:
+        return list(block_descriptors)
+
+    selected = []
+    for ofs, header_bytes in block_descriptors:
+        stats = block_index.get(ofs)
+        if stats is not None and stats.node_only and (
+            stats.nodes == 0 or spatial.disjoint(stats.bbox)
+        ):
+            continue
+        selected.append((ofs, header_bytes))
+    return selected
+
+
+def _select_node_blocks(
+    block_descriptors: Sequence[tuple[int, bytes]],
+    block_index: Optional[BlockIndex],
+    required_node_ids: Set[int],
+) -> List[tuple[int, bytes]]:
+    """Keep only blocks whose node id range overlaps ``required_node_ids``."""
+
+    if block_index is None:
+        return list(block_descriptors)
+
+    sorted_ids = sorted(required_node_ids)
+    selected = []
+    for ofs, header_bytes in block_descriptors:
+        stats = block_index.get(ofs)
+        if stats is not None and not stats.may_contain_node_ids(sorted_ids):
+            continue
+        selected.append((ofs, header_bytes))
+    return selected
+
+
+def _log_skipped_blocks(filename: str, stage: str, total: int, selected: int) -> None:
+    if selected < total:
+        logger.info(
+            "%s %s: block index skips %d of %d blocks",
+            stage,
+            os.path.basename(filename),
+            total - selected,
+            total,
+        )
+
+
 def _collect_targets_sequential(
     filename: str,
     primary_name: str,
     feature_names: Sequence[str],
-) -> tuple[Dict[int, Node], List[Way], Set[int]]:
-    pre_filter = _build_pre_filter(primary_name, feature_names)
+    block_descriptors: Sequence[tuple[int, bytes]],
+    spatial: Optional[SpatialFilter] = None,
+    tag_filter: Optional[TagPredicate] = None,
+    block_cache: Optional[BlockCache] = None,
+) -> tuple[Dict[int, Node], List[Way], Set[int], BlockIndex]:
     feature_desc = _format_feature_descriptor(feature_names)
+    predicate = _build_pre_filter(primary_name, feature_names, tag_filter)
+    cache = None if block_cache is None else block_cache.scan(filename, predicate, spatial)
 
     target_nodes: Dict[int, Node] = {}
     target_ways: List[Way] = []
     required_node_ids: Set[int] = set()
+    block_stats: BlockIndex = {}
 
     logger.info(
         "Scanning %s for %s=%s candidates",
@@ -306,15 +497,17 @@ def _collect_targets_sequential(
         step=1,
     )
 
-    for entry in _iter_pbf_entries(filename, progress_cb=progress_cb):
-        if not primary_entry_filter(entry, pre_filter):
-            continue
-
-        if isinstance(entry, Node):
-            target_nodes[entry.id] = entry
-        elif isinstance(entry, Way):
-            target_ways.append(entry)
-            required_node_ids.update(entry.refs)
+    total_blocks = len(block_descriptors)
+    for idx, (ofs, header_bytes) in enumerate(block_descriptors, start=1):
+        node_chunk, way_chunk, ref_chunk, (_, stats) = _scan_block_worker(
+            (filename, ofs, header_bytes, predicate, spatial, cache)
+        )
+        for node in node_chunk:
+            target_nodes[node.id] = node
+        target_ways.extend(way_chunk)
+        required_node_ids.update(ref_chunk)
+        block_stats[ofs] = stats
+        progress_cb(idx, total_blocks)
 
     logger.info(
         "Completed scan of %s: %d candidate ways, %d candidate nodes, %d referenced nodes",
@@ -324,7 +517,7 @@ def _collect_targets_sequential(
         len(required_node_ids),
     )
 
-    return target_nodes, target_ways, required_node_ids
+    return target_nodes, target_ways, required_node_ids, block_stats
 
 
 def _collect_targets_parallel(
@@ -332,10 +525,13 @@ def _collect_targets_parallel(
     primary_name: str,
     feature_names: Sequence[str],
     block_descriptors: Sequence[tuple[int, bytes]],
-) -> tuple[Dict[int, Node], List[Way], Set[int]]:
+    spatial: Optional[SpatialFilter] = None,
+    tag_filter: Optional[TagPredicate] = None,
+    block_cache: Optional[BlockCache] = None,
+) -> tuple[Dict[int, Node], List[Way], Set[int], BlockIndex]:
     total_blocks = len(block_descriptors)
     if total_blocks == 0:
-        return {}, [], set()
+        return {}, [], set(), {}
 
     worker_count = max(1, mp.cpu_count() - 1 or 1)
     feature_desc = _format_feature_descriptor(feature_names)
@@ -351,17 +547,19 @@ def _collect_targets_parallel(
     target_nodes: Dict[int, Node] = {}
     target_ways: List[Way] = []
     required_node_ids: Set[int] = set()
+    block_stats: BlockIndex = {}
 
     progress_every = max(1, total_blocks * BLOCK_PROGRESS_STEP // 100)
 
-    feature_tuple = tuple(feature_names)
+    predicate = _build_pre_filter(primary_name, feature_names, tag_filter)
+    cache = None if block_cache is None else block_cache.scan(filename, predicate, spatial)
     tasks = (
-        (filename, ofs, header_bytes, primary_name, feature_tuple)
+        (filename, ofs, header_bytes, predicate, spatial, cache)
         for ofs, header_bytes in block_descriptors
     )
 
     with mp.Pool(worker_count) as pool:
-        for idx, (node_chunk, way_chunk, ref_chunk) in enumerate(
+        for idx, (node_chunk, way_chunk, ref_chunk, (ofs, stats)) in enumerate(
             pool.imap_unordered(_scan_block_worker, tasks, chunksize=1),
             start=1,
         ):
@@ -372,6 +570,7 @@ def _collect_targets_parallel(
                 target_ways.extend(way_chunk)
             if ref_chunk:
                 required_node_ids.update(ref_chunk)
+            block_stats[ofs] = stats
 
             if idx % progress_every == 0 or idx == total_blocks:
                 percent = int((idx / total_blocks) * 100)
@@ -395,7 +594,7 @@ def _collect_targets_parallel(
         len(required_node_ids),
     )
 
-    return target_nodes, target_ways, required_node_ids
+    return target_nodes, target_ways, required_node_ids, block_stats
 
 
 def _collect_targets(
@@ -405,20 +604,43 @@ def _collect_targets(
     *,
     multiprocess: bool = False,
     block_descriptors: Optional[Sequence[tuple[int, bytes]]] = None,
+    spatial: Optional[SpatialFilter] = None,
+    tag_filter: Optional[TagPredicate] = None,
+    block_cache: Optional[BlockCache] = None,
 ) -> tuple[Dict[int, Node], List[Way], Set[int]]:
     feature_names = _normalize_feature_names(feature_selection)
+    descriptors = block_descriptors or _prepare_block_descriptors(filename)
+    block_index = load_block_index(filename)
+
+    selected = _select_scan_blocks(descriptors, block_index, spatial)
+    _log_skipped_blocks(filename, "Scanning", len(descriptors), len(selected))
+
     if multiprocess:
-        descriptors = block_descriptors or _prepare_block_descriptors(filename)
-        return _collect_targets_parallel(filename, primary_name, feature_names, descriptors)
-    return _collect_targets_sequential(filename, primary_name, feature_names)
+        collect = _collect_targets_parallel
+    else:
+        collect = _collect_targets_sequential
+    target_nodes, target_ways, required_node_ids, block_stats = collect(
+        filename, primary_name, feature_names, selected, spatial, tag_filter, block_cache
+    )
 
+    if block_index is None and len(block_stats) == len(descriptors):
+        save_block_index(filename, block_stats)
+    if block_cache is not None:
+        block_cache.evict()
+
+    return target_nodes, target_ways, required_node_ids
 
-def _collect_nodes_sequential(filename: str, required_node_ids: Set[int]) -> Dict[int, Node]:
+
+def _collect_nodes_sequential(
+    filename: str,
+    required_node_ids: Set[int],
+    block_descriptors: Sequence[tuple[int, bytes]],
+) -> Dict[int, Node]:
     if not required_node_ids:
         return {}
 
     captured: Dict[int, Node] = {}
-    remaining = set(required_node_ids)
+    targets = _sorted_id_array(required_node_ids)
 
     logger.info(
         "Capturing %d prerequisite nodes from %s",
@@ -431,21 +653,20 @@ def _collect_nodes_sequential(filename: str, required_node_ids: Set[int]) -> Dic
         step=1,
     )
 
-    for entry in _iter_pbf_entries(filename, progress_cb=progress_cb):
-        if not isinstance(entry, Node):
-            continue
-        if entry.id not in remaining:
-            continue
+    total_blocks = len(block_descriptors)
+    for idx, (ofs, header_bytes) in enumerate(block_descriptors, start=1):
+        primitive = _read_primitive_block(filename, ofs, header_bytes)
+        captured.update(_match_block_nodes(primitive, targets))
 
-        captured[entry.id] = entry
-        remaining.remove(entry.id)
-        if not remaining:
+        progress_cb(idx, total_blocks)
+        if len(captured) >= len(targets):
             break
 
-    if remaining:
+    missing = len(targets) - len(captured)
+    if missing > 0:
         logger.info(
             "Finished collecting node coordinates with %d missing nodes",
-            len(remaining),
+            missing,
         )
     else:
         logger.info("Captured coordinates for all referenced nodes")
@@ -526,10 +747,13 @@ def _collect_nodes(
     multiprocess: bool = False,
     block_descriptors: Optional[Sequence[tuple[int, bytes]]] = None,
 ) -> Dict[int, Node]:
+    descriptors = block_descriptors or _prepare_block_descriptors(filename)
+    selected = _select_node_blocks(descriptors, load_block_index(filename), required_node_ids)
+    _log_skipped_blocks(filename, "Collecting nodes from", len(descriptors), len(selected))
+
     if multiprocess:
-        descriptors = block_descriptors or _prepare_block_descriptors(filename)
-        return _collect_nodes_parallel(filename, required_node_ids, descriptors)
-    return _collect_nodes_sequential(filename, required_node_ids)
+        return _collect_nodes_parallel(filename, required_node_ids, selected)
+    return _collect_nodes_sequential(filename, required_node_ids, selected)
 
 
 def _log_stage_progress(
@@ -564,27 +788,99 @@ def _log_stage_progress(
     )
 
 
-def stream_pbf_features(
+def _scan_label(
+    region_code: str,
+    primary_name: str,
+    feature_label: str,
+    tag_filter: Optional[TagPredicate],
+    spatial: Optional[SpatialFilter],
+) -> str:
+    """Name the checkpoint of a scan after everything that decides its result."""
+
+    predicate = None if tag_filter is None else normalize_predicate(tag_filter)
+    return "|".join(
+        (
+            region_code,
+            f"{primary_name}={feature_label}",
+            repr(predicate),
+            str(spatial_key(spatial)),
+        )
+    )
+
+
+def _prepare_stream_inputs(
     filename: str,
     primary_name: str,
-    feature_name: str,
+    feature_selection: Union[str, Sequence[str]],
     region_code: str,
+    feature_label: str,
     *,
-    multiprocess: bool = False,
-) -> Iterator[Dict[str, object]]:
-    block_descriptors: Optional[Sequence[tuple[int, bytes]]] = None
-    if multiprocess:
-        block_descriptors = _prepare_block_descriptors(filename)
+    multiprocess: bool,
+    spatial: Optional[SpatialFilter],
+    tag_filter: Optional[TagPredicate] = None,
+    checkpoint_dir: Optional[str] = None,
+    block_cache: Optional[BlockCache] = None,
+) -> tuple[Dict[int, Node], List[Way], Dict[int, Node]]:
+    """Run both scan passes and return target nodes, target ways and way coordinates.
+
+    With a ``checkpoint_dir`` the result of each pass is saved there, and a
+    scan interrupted earlier continues after its last completed pass.
+    A ``block_cache`` reuses the candidates found in each block by earlier
+    scans of the file (see :mod:`earth_osm.blockcache`).
+    """
 
-    target_nodes, target_ways, referenced_node_ids = _collect_targets(
-        filename,
-        primary_name,
-        feature_name,
-        multiprocess=multiprocess,
-        block_descriptors=block_descriptors,
-    )
+    if spatial is not None and (
+        spatial.is_empty or spatial.disjoint(_read_header_bbox(filename))
+    ):
+        logger.info(
+            "Region %s (%s=%s): spatial filter does not overlap %s, skipping scan",
+            region_code,
+            primary_name,
+            feature_label,
+            os.path.basename(filename),
+        )
+        return {}, [], {}
+
+    scan_label = _scan_label(region_code, primary_name, feature_label, tag_filter, spatial)
+    stage: Optional[str] = None
+    saved: Any = None
+    if checkpoint_dir is not None:
+        stage, saved = load_scan_checkpoint(checkpoint_dir, filename, scan_label)
+        if stage is not None:
+            logger.info(
+                "Region %s (%s=%s): resuming after the %s pass of %s",
+                region_code,
+                primary_name,
+                feature_label,
+                stage,
+                os.path.basename(filename),
+            )
+    if stage == "coordinates":
+        return saved
 
-    feature_label = _format_feature_descriptor((feature_name,))
+    block_descriptors = None
+    if stage == "targets":
+        target_nodes, target_ways, referenced_node_ids = saved
+    else:
+        block_descriptors = _prepare_block_descriptors(filename)
+        target_nodes, target_ways, referenced_node_ids = _collect_targets(
+            filename,
+            primary_name,
+            feature_selection,
+            multiprocess=multiprocess,
+            block_descriptors=block_descriptors,
+            spatial=spatial,
+            tag_filter=tag_filter,
+            block_cache=block_cache,
+        )
+        if checkpoint_dir is not None:
+            save_scan_checkpoint(
+                checkpoint_dir,
+                filename,
+                scan_label,
+                "targets",
+                (target_nodes, target_ways, referenced_node_ids),
+            )
 
     logger.info(
         "Region %s (%s=%s): identified %d target nodes, %d target ways",
@@ -599,6 +895,8 @@ def stream_pbf_features(
 
     missing_node_ids = referenced_node_ids - set(coordinate_nodes.keys())
     if missing_node_ids:
+        if block_descriptors is None:
+            block_descriptors = _prepare_block_descriptors(filename)
         extra_nodes = _collect_nodes(
             filename,
             missing_node_ids,
@@ -617,6 +915,102 @@ def stream_pbf_features(
                 len(unresolved),
             )
 
+    if checkpoint_dir is not None:
+        save_scan_checkpoint(
+            checkpoint_dir,
+            filename,
+            scan_label,
+            "coordinates",
+            (target_nodes, target_ways, coordinate_nodes),
+        )
+    return target_nodes, target_ways, coordinate_nodes
+
+
+def stream_pbf_features(
+    filename: str,
+    primary_name: str,
+    feature_name: str,
+    region_code: str,
+    *,
+    multiprocess: bool = False,
+    spatial: Optional[SpatialFilter] = None,
+    bbox: Optional[Sequence[float]] = None,
+    polygon: Optional[Union[str, BaseGeometry]] = None,
+    tag_filter: Union[None, str, TagPredicate] = None,
+    checkpoint_dir: Optional[str] = None,
+    block_cache: Optional[BlockCache] = None,
+) -> Iterator[Dict[str, object]]:
+    """Yield flattened feature rows of ``filename`` matching ``primary_name=feature_name``.
+
+    ``bbox`` (``min_lon, min_lat, max_lon, max_lat``) and ``polygon`` (a
+    geometry, WKT string or vector file path) restrict the scan spatially and
+    are combined with ``spatial``. Nodes must lie inside the area and ways
+    need at least one vertex inside it. ``tag_filter`` is an additional
+    predicate (see :mod:`earth_osm.predicate`) candidates must satisfy.
+    ``checkpoint_dir`` keeps the result of each scan pass so that an
+    interrupted scan can resume (see :mod:`earth_osm.checkpoint`).
+    ``block_cache`` is a :class:`~earth_osm.blockcache.BlockCache` reusing
+    the first pass results of earlier scans per block.
+    """
+
+    for feature in iter_pbf_feature_rows(
+        filename,
+        primary_name,
+        feature_name,
+        region_code,
+        multiprocess=multiprocess,
+        spatial=spatial,
+        bbox=bbox,
+        polygon=polygon,
+        tag_filter=tag_filter,
+        checkpoint_dir=checkpoint_dir,
+        block_cache=block_cache,
+    ):
+        yield feature.to_dict()
+
+
+def iter_pbf_feature_rows(
+    filename: str,
+    primary_name: str,
+    feature_selection: Union[str, Sequence[str]],
+    region_code: str,
+    *,
+    multiprocess: bool = False,
+    spatial: Optional[SpatialFilter] = None,
+    bbox: Optional[Sequence[float]] = None,
+    polygon: Optional[Union[str, BaseGeometry]] = None,
+    tag_filter: Union[None, str, TagPredicate] = None,
+    checkpoint_dir: Optional[str] = None,
+    block_cache: Optional[BlockCache] = None,
+) -> Iterator[FeatureRow]:
+    """Yield the :class:`FeatureRow` objects behind :func:`stream_pbf_features`.
+
+    ``feature_selection`` may name several features; they are collected in
+    one scan and an element matching more than one of them is yielded once.
+    """
+
+    spatial = combine_filters(spatial, make_spatial_filter(bbox, polygon))
+    tag_filter = compile_tag_filter(tag_filter)
+    if isinstance(feature_selection, str):
+        feature_selection = [feature_selection]
+    feature_selection = _normalize_feature_names(feature_selection)
+    feature_label = _format_feature_descriptor(feature_selection)
+    if len(feature_selection) == 1:
+        feature_selection = feature_selection[0]
+
+    target_nodes, target_ways, coordinate_nodes = _prepare_stream_inputs(
+        filename,
+        primary_name,
+        feature_selection,
+        region_code,
+        feature_label,
+        multiprocess=multiprocess,
+        spatial=spatial,
+        tag_filter=tag_filter,
+        checkpoint_dir=checkpoint_dir,
+        block_cache=block_cache,
+    )
+
     total_count = 0
 
     node_stage = 0
@@ -632,7 +1026,7 @@ def stream_pbf_features(
                 count=node_stage,
                 total=total_count,
             )
-        yield feature.to_dict()
+        yield feature
 
     _log_stage_progress(
         region_code,
@@ -645,7 +1039,7 @@ def stream_pbf_features(
     )
 
     way_stage = 0
-    for feature in _iter_way_rows(target_ways, coordinate_nodes, region_code):
+    for feature in _iter_way_rows(target_ways, coordinate_nodes, region_code, spatial):
         way_stage += 1
         total_count += 1
         if way_stage % PROGRESS_INTERVAL == 0:
@@ -657,7 +1051,7 @@ def stream_pbf_features(
                 count=way_stage,
                 total=total_count,
             )
-        yield feature.to_dict()
+        yield feature
 
     _log_stage_progress(
         region_code,
@@ -685,53 +1079,31 @@ def stream_pbf_features_multi(
     region_code: str,
     *,
     multiprocess: bool = False,
+    spatial: Optional[SpatialFilter] = None,
+    bbox: Optional[Sequence[float]] = None,
+    polygon: Optional[Union[str, BaseGeometry]] = None,
+    tag_filter: Union[None, str, TagPredicate] = None,
+    checkpoint_dir: Optional[str] = None,
+    block_cache: Optional[BlockCache] = None,
 ) -> Iterator[tuple[str, Dict[str, object]]]:
+    spatial = combine_filters(spatial, make_spatial_filter(bbox, polygon))
+    tag_filter = compile_tag_filter(tag_filter)
     normalized_features = _normalize_feature_names(feature_names)
     feature_label = _format_feature_descriptor(normalized_features)
 
-    block_descriptors: Optional[Sequence[tuple[int, bytes]]] = None
-    if multiprocess:
-        block_descriptors = _prepare_block_descriptors(filename)
-
-    target_nodes, target_ways, referenced_node_ids = _collect_targets(
+    target_nodes, target_ways, coordinate_nodes = _prepare_stream_inputs(
         filename,
         primary_name,
         normalized_features,
-        multiprocess=multiprocess,
-        block_descriptors=block_descriptors,
-    )
-
-    logger.info(
-        "Region %s (%s=%s): identified %d target nodes, %d target ways",
         region_code,
-        primary_name,
         feature_label,
-        len(target_nodes),
-        len(target_ways),
+        multiprocess=multiprocess,
+        spatial=spatial,
+        tag_filter=tag_filter,
+        checkpoint_dir=checkpoint_dir,
+        block_cache=block_cache,
     )
 
-    coordinate_nodes: Dict[int, Node] = dict(target_nodes)
-
-    missing_node_ids = referenced_node_ids - set(coordinate_nodes.keys())
-    if missing_node_ids:
-        extra_nodes = _collect_nodes(
-            filename,
-            missing_node_ids,
-            multiprocess=multiprocess,
-            block_descriptors=block_descriptors,
-        )
-        if extra_nodes:
-            coordinate_nodes.update(extra_nodes)
-        unresolved = missing_node_ids - set(coordinate_nodes.keys())
-        if unresolved:
-            logger.warning(
-                "Region %s (%s=%s): %d referenced nodes missing coordinates after collection",
-                region_code,
-                primary_name,
-                feature_label,
-                len(unresolved),
-            )
-
     total_count = 0
 
     node_stage = 0
@@ -770,7 +1142,7 @@ def stream_pbf_features_multi(
 
     way_stage = 0
     way_counts = {name: 0 for name in normalized_features}
-    for feature in _iter_way_rows(target_ways, coordinate_nodes, region_code):
+    for feature in _iter_way_rows(target_ways, coordinate_nodes, region_code, spatial):
         matches = list(_iter_matching_features(feature.tags, primary_name, normalized_features))
         if not matches:
             continue
@@ -822,6 +1194,124 @@ def stream_pbf_features_multi(
         total_count,
         len(normalized_features),
     )
+
+
+def stream_pbf_features_fanout(
+    filename: str,
+    primary_name: str,
+    feature_names: Sequence[str],
+    regions: Sequence[tuple[str, BaseGeometry]],
+    *,
+    multiprocess: bool = False,
+    spatial: Optional[SpatialFilter] = None,
+    tag_filter: Union[None, str, TagPredicate] = None,
+    checkpoint_dir: Optional[str] = None,
+    block_cache: Optional[BlockCache] = None,
+) -> Iterator[tuple[str, str, Dict[str, object]]]:
+    """Scan ``filename`` once and fan features out to several regions.
+
+    ``regions`` is a sequence of ``(region_code, boundary)`` pairs. Every
+    matched feature is assigned to each region whose boundary contains one of
+    its coordinates and yielded as ``(region_code, feature_name, row)`` with the
+    row's ``Region`` set accordingly. ``spatial`` and ``tag_filter`` further
+    restrict the scan.
+    """
+
+    normalized_features = _normalize_feature_names(feature_names)
+    feature_label = _format_feature_descriptor(normalized_features)
+    assigner = RegionAssigner(regions)
+    scan_label = f"{os.path.basename(filename)}[{','.join(sorted(assigner.codes))}]"
+
+    target_nodes, target_ways, coordinate_nodes = _prepare_stream_inputs(
+        filename,
+        primary_name,
+        normalized_features,
+        scan_label,
+        feature_label,
+        multiprocess=multiprocess,
+        spatial=assigner.spatial_filter().intersection(spatial),
+        tag_filter=compile_tag_filter(tag_filter),
+        checkpoint_dir=checkpoint_dir,
+        block_cache=block_cache,
+    )
+
+    region_counts = {code: 0 for code in assigner.codes}
+
+    def _fan_out(
+        features: Iterable[FeatureRow],
+    ) -> Iterator[tuple[str, str, Dict[str, object]]]:
+        for feature in features:
+            matches = list(
+                _iter_matching_features(feature.tags, primary_name, normalized_features)
+            )
+            if not matches:
+                continue
+            for region_code in assigner.assign(feature.lonlat):
+                row_dict = replace(feature, region=region_code).to_dict()
+                for match_index, match in enumerate(matches):
+                    payload = row_dict if match_index == 0 else row_dict.copy()
+                    region_counts[region_code] += 1
+                    yield region_code, match, payload
+
+    yield from _fan_out(_iter_node_rows(target_nodes, scan_label))
+    yield from _fan_out(_iter_way_rows(target_ways, coordinate_nodes, scan_label, spatial))
+
+    for region_code, count in region_counts.items():
+        logger.info(
+            "Region %s (%s=%s): %d rows from single scan of %s",
+            region_code,
+            primary_name,
+            feature_label,
+            count,
+            os.path.basename(filename),
+        )
+
+
+def resolve_region_pbf(
+    region: Any,
+    update: bool,
+    data_dir: str,
+    *,
+    progress_bar: bool = True,
+    from_parent: bool = False,
+    spatial: Optional[SpatialFilter] = None,
+) -> tuple[str, Optional[SpatialFilter]]:
+    """Return the PBF to scan for ``region`` and the spatial filter to apply.
+
+    With ``from_parent`` the region's own extract is only downloaded when no
+    ancestor PBF (continent, parent region or planet) is cached in
+    ``data_dir``. Otherwise the cached ancestor is scanned and cut down to the
+    region's GeoFabrik boundary, which avoids a download entirely. A
+    user-supplied ``spatial`` filter is intersected with that boundary.
+    """
+
+    if from_parent and not update and not os.path.exists(local_pbf_path(region, data_dir)):
+        cached = find_cached_parent_pbf(region, data_dir)
+        if cached is not None:
+            parent, _ = cached
+            try:
+                geometry = get_region_geometry(region)
+            except KeyError:
+                geometry = None
+                logger.warning(
+                    "Region %s has no published boundary; downloading its own extract",
+                    region.short,
+                )
+            if geometry is not None:
+                logger.info(
+                    "Region %s: deriving extract from cached %s PBF",
+                    region.short,
+                    parent.id,
+                )
+                filename = download_region_pbf(
+                    parent, False, data_dir, progress_bar=progress_bar
+                )
+                return filename, SpatialFilter.from_geometry(geometry).intersection(spatial)
+
+    filename = download_region_pbf(region, update, data_dir, progress_bar=progress_bar)
+    return filename, spatial
+
+
 def stream_region_features(
     region,
     primary_name: str,
@@ -831,6 +1321,9 @@ def stream_region_features(
     progress_bar: bool = True,
     multiprocess: bool = True,
     data_source: str = "geofabrik",
+    from_parent: bool = False,
+    spatial: Optional[SpatialFilter] = None,
+    tag_filter: Union[None, str, TagPredicate] = None,
 ) -> Iterator[Dict[str, object]]:
     """Yield flattened feature dictionaries for a region.
 
@@ -845,6 +1338,11 @@ def stream_region_features(
         multiprocess: Currently unused for streaming extraction. Included for
             API compatibility with the legacy pipeline.
         data_source: Must be ``geofabrik``; other values are unsupported.
+        from_parent: When ``True`` cut the region out of a cached ancestor PBF
+            instead of downloading the region's own extract.
+        spatial: Optional bounding box/polygon restricting the extracted
+            features.
+        tag_filter: Optional tag predicate expression candidates must match.
 
     Yields:
         Dictionaries ready to be consumed by the export writers.
@@ -863,7 +1361,14 @@ def stream_region_features(
         feature_name,
         os.path.basename(pbf_url),
     )
-    filename = download_region_pbf(region, update, data_dir, progress_bar=progress_bar)
+    filename, spatial = resolve_region_pbf(
+        region,
+        update,
+        data_dir,
+        progress_bar=progress_bar,
+        from_parent=from_parent,
+        spatial=spatial,
+    )
     logger.debug(
         "Streaming PBF %s for region %s (primary=%s, feature=%s)",
         os.path.basename(filename),
@@ -877,6 +1382,8 @@ def stream_region_features(
         feature_name,
         region.short,
         multiprocess=multiprocess,
+        spatial=spatial,
+        tag_filter=tag_filter,
     )
 
 
@@ -927,6 +1434,7 @@ def _build_primary_cache(
     cache_path: str,
     *,
     multiprocess: bool,
+    spatial: Optional[SpatialFilter] = None,
 ) -> Iterator[Dict[str, object]]:
     temp_path = f"{cache_path}.tmp"
     os.makedirs(os.path.dirname(cache_path), exist_ok=True)
@@ -945,6 +1453,7 @@ def _build_primary_cache(
                 f"ALL_{primary_name}",
                 region_code,
                 multiprocess=multiprocess,
+                spatial=spatial,
             ):
                 cache_file.write(json.dumps(row, ensure_ascii=False))
                 cache_file.write("\n")
@@ -974,6 +1483,7 @@ def stream_cached_primary_features(
     *,
     multiprocess: bool = False,
     rebuild_cache: bool = False,
+    spatial: Optional[SpatialFilter] = None,
 ) -> Iterator[Dict[str, object]]:
     if rebuild_cache and os.path.exists(cache_path):
         os.remove(cache_path)
@@ -994,6 +1504,7 @@ def stream_cached_primary_features(
             region_code,
             cache_path,
             multiprocess=multiprocess,
+            spatial=spatial,
         )
         return
 
@@ -1016,6 +1527,11 @@ def stream_region_features_multi(
     progress_bar: bool = True,
     multiprocess: bool = True,
     data_source: str = "geofabrik",
+    from_parent: bool = False,
+    spatial: Optional[SpatialFilter] = None,
+    tag_filter: Union[None, str, TagPredicate] = None,
+    checkpoint_dir: Optional[str] = None,
+    block_cache: Optional[BlockCache] = None,
 ) -> Iterator[tuple[str, Dict[str, object]]]:
     """Yield feature-tagged rows for multiple features without primary caching."""
 
@@ -1033,7 +1549,14 @@ def stream_region_features_multi(
         feature_label,
         os.path.basename(pbf_url),
     )
-    filename = download_region_pbf(region, update, data_dir, progress_bar=progress_bar)
+    filename, spatial = resolve_region_pbf(
+        region,
+        update,
+        data_dir,
+        progress_bar=progress_bar,
+        from_parent=from_parent,
+        spatial=spatial,
+    )
     logger.debug(
         "Streaming PBF %s for region %s (primary=%s, features=%s)",
         os.path.basename(filename),
@@ -1048,4 +1571,57 @@ def stream_region_features_multi(
         normalized_features,
         region.short,
         multiprocess=multiprocess,
+        spatial=spatial,
+        tag_filter=tag_filter,
+        checkpoint_dir=checkpoint_dir,
+        block_cache=block_cache,
+    )
+
+
+def stream_regions_from_parent(
+    parent: Any,
+    regions: Sequence,
+    primary_name: str,
+    feature_names: Sequence[str],
+    data_dir: str,
+    update: bool = False,
+    progress_bar: bool = True,
+    multiprocess: bool = True,
+    spatial: Optional[SpatialFilter] = None,
+    tag_filter: Union[None, str, TagPredicate] = None,
+    checkpoint_dir: Optional[str] = None,
+    block_cache: Optional[BlockCache] = None,
+) -> Iterator[tuple[str, str, Dict[str, object]]]:
+    """Yield ``(region_code, feature_name, row)`` for ``regions`` from one scan of ``parent``.
+
+    The parent PBF (a continent, parent region or the planet) is downloaded
+    once, or reused when cached, and each row is assigned to its regions with
+    :func:`stream_pbf_features_fanout`.
+    """
+
+    boundaries = []
+    for region in regions:
+        geometry = get_region_geometry(region)
+        if geometry is None:
+            raise ValueError(f"Region {region.short} has no boundary to fan out to")
+        boundaries.append((region.short, geometry))
+
+    logger.info(
+        "Region %s: scanning once for %d regions (%s)",
+        parent.id,
+        len(boundaries),
+        ", ".join(code for code, _ in boundaries),
+    )
+    filename = download_region_pbf(parent, update, data_dir, progress_bar=progress_bar)
+
+    yield from stream_pbf_features_fanout(
+        filename,
+        primary_name,
+        feature_names,
+        boundaries,
+        multiprocess=multiprocess,
+        spatial=spatial,
+        tag_filter=tag_filter,
+        checkpoint_dir=checkpoint_dir,
+        block_cache=block_cache,
     )
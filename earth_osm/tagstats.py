@@ -0,0 +1,217 @@
+"""Tag histograms used to plan export columns before any row is written.
+
+The CSV layout of an export depends on how often each ``tags.<key>`` column is
+filled: rare keys are melted into ``other_tags``. Without prior knowledge the
+writer has to see every row first, which is why the csv/geojson outputs are
+normally spilled and replayed (see :mod:`earth_osm.spill`).
+
+Every export records a :class:`TagHistogram` per source, i.e. per
+``(region, feature)`` pair scanned from one regional PBF, and
+:class:`TagStatsStore` keeps them as small JSON sidecars in
+``<data_dir>/tagstats``. A later run can merge the histograms of the sources
+feeding an output and derive its :class:`ColumnPlan` up front, then write rows
+straight to their final files.
+
+Each histogram records the checksum of the PBF it was counted from, and
+:meth:`TagStatsStore.plan` only uses histograms of the PBFs about to be
+scanned. After an update of a regional extract the writer falls back to the
+two-pass layout until the new statistics are saved.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, Iterable, Mapping, Optional, Tuple
+
+logger = logging.getLogger("eo.tagstats")
+
+MELT_THRESHOLD = 0.95
+BASE_COLUMNS = ("id", "Type", "Region", "lonlat")
+
+
+def _is_null(value: Any) -> bool:
+    if value is None:
+        return True
+    return isinstance(value, float) and math.isnan(value)
+
+
+class TagHistogram:
+    """Row count and per-column non-null counts of a stream of feature rows.
+
+    Columns that occurred only with null values are kept with a count of 0.
+    """
+
+    __slots__ = ("rows", "counts")
+
+    def __init__(self, rows: int = 0, counts: Optional[Mapping[str, int]] = None):
+        self.rows = rows
+        self.counts: Dict[str, int] = dict(counts or {})
+
+    def add(self, record: Mapping[str, Any]) -> None:
+        counts = self.counts
+        for key, value in record.items():
+            counts[key] = counts.get(key, 0) + (not _is_null(value))
+        self.rows += 1
+
+    def update(self, other: "TagHistogram") -> None:
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        self.rows += other.rows
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"rows": self.rows, "counts": dict(sorted(self.counts.items()))}
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "TagHistogram":
+        return cls(
+            int(data["rows"]), {key: int(count) for key, count in data["counts"].items()}
+        )
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, TagHistogram):
+            return NotImplemented
+        return self.rows == other.rows and self.counts == other.counts
+
+    def __repr__(self) -> str:
+        return f"TagHistogram(rows={self.rows}, columns={len(self.counts)})"
+
+
+@dataclass(frozen=True)
+class ColumnPlan:
+    """Ordered output columns and the tag columns melted into ``other_tags``."""
+
+    columns: Tuple[str, ...]
+    melt_columns: FrozenSet[str]
+
+
+def plan_columns(
+    histogram: TagHistogram, melt_threshold: float = MELT_THRESHOLD
+) -> ColumnPlan:
+    """Return the column layout the export writer uses for ``histogram``."""
+
+    melt = set()
+    if histogram.rows:
+        threshold = 1.0 - melt_threshold
+        for column, count in histogram.counts.items():
+            if column.startswith("tags.") and count / histogram.rows <= threshold:
+                melt.add(column)
+
+    columns = list(BASE_COLUMNS)
+    if "refs" in histogram.counts:
+        columns.append("refs")
+
+    reserved = set(columns) | melt
+    columns.extend(
+        sorted(
+            column
+            for column in histogram.counts
+            if column not in reserved and column != "other_tags"
+        )
+    )
+    if melt or "other_tags" in histogram.counts:
+        columns.append("other_tags")
+
+    return ColumnPlan(tuple(columns), frozenset(melt))
+
+
+class TagStatsStore:
+    """JSON sidecars with one histogram per ``(region, primary, feature)``.
+
+    ``pbf`` identifies the PBF a region's rows were scanned from (e.g. its
+    MD5); a histogram saved for another PBF is not loaded.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, region: str) -> str:
+        return os.path.join(self.directory, f"{region}.json")
+
+    def _read(self, region: str) -> Dict[str, Any]:
+        path = self._path(region)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, "r", encoding="utf-8") as source:
+                return json.load(source)
+        except (OSError, ValueError) as exc:
+            logger.warning("Ignoring unreadable tag statistics %s: %s", path, exc)
+            return {}
+
+    def load(
+        self, region: str, primary_name: str, feature_name: str, pbf: str
+    ) -> Optional[TagHistogram]:
+        entry = self._read(region).get(primary_name, {}).get(feature_name)
+        if entry is None:
+            return None
+        if entry.get("pbf") != pbf:
+            logger.debug(
+                "Tag statistics for %s %s=%s were counted from another PBF",
+                region,
+                primary_name,
+                feature_name,
+            )
+            return None
+        return TagHistogram.from_dict(entry)
+
+    def save(
+        self,
+        region: str,
+        primary_name: str,
+        histograms: Mapping[str, TagHistogram],
+        pbf: str,
+    ) -> None:
+        if not histograms:
+            return
+        data = self._read(region)
+        primary = data.setdefault(primary_name, {})
+        for feature_name, histogram in histograms.items():
+            primary[feature_name] = {**histogram.to_dict(), "pbf": pbf}
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(region)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as target:
+            json.dump(data, target, ensure_ascii=False, sort_keys=True)
+        os.replace(temp_path, path)
+
+    def plan(
+        self,
+        primary_name: str,
+        sources: Iterable[Tuple[str, str]],
+        pbfs: Mapping[str, str],
+        melt_threshold: float = MELT_THRESHOLD,
+    ) -> Optional[ColumnPlan]:
+        """Plan the columns of an output fed by ``(region, feature)`` sources.
+
+        ``pbfs`` maps each region to the PBF it is scanned from. Returns
+        ``None`` when any source has no histogram recorded for that PBF.
+        """
+
+        merged = TagHistogram()
+        for region, feature_name in sources:
+            pbf = pbfs.get(region)
+            if pbf is None:
+                logger.debug("No PBF of %s to check the tag statistics against", region)
+                return None
+            histogram = self.load(region, primary_name, feature_name, pbf)
+            if histogram is None:
+                logger.debug(
+                    "No tag statistics for %s %s=%s", region, primary_name, feature_name
+                )
+                return None
+            merged.update(histogram)
+        return plan_columns(merged, melt_threshold)
+
+
+__all__ = [
+    "ColumnPlan",
+    "MELT_THRESHOLD",
+    "TagHistogram",
+    "TagStatsStore",
+    "plan_columns",
+]
@@ -9,7 +9,11 @@ This module contains utilities functions for handling OSM data.
 """
 
 import ast
+import json
 import logging
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
 import pandas as pd
 
 logger = logging.getLogger("eo.utils")
@@ -46,78 +50,208 @@ def tag_value_matches(value, feature_name):
     return False
 
 
-def tags_melt(df_exp, nan_threshold=0.75):
-    # Find columns with high percentage of NaN values
-    high_nan_cols = df_exp.columns[df_exp.isnull().mean() > nan_threshold]
+OTHER_TAGS = "other_tags"
+
+
+def _parse_tags(value: Any) -> Optional[Dict[str, Any]]:
+    """Return ``value`` as a dict when it is a (stringified) tag dict."""
+
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            value = ast.literal_eval(value)
+    return value if isinstance(value, dict) else None
+
+
+def high_nan_columns(df: pd.DataFrame, nan_threshold: float = 0.75) -> List[str]:
+    """Return the columns of ``df`` whose share of missing values exceeds ``nan_threshold``."""
+
+    if not len(df):
+        return []
+    null_share = 1 - df.count() / len(df)
+    return list(df.columns[(null_share > nan_threshold).to_numpy()])
+
+
+def _melt_columns(
+    df: pd.DataFrame, columns: Sequence[str], base: Optional[List[Any]] = None
+) -> Tuple[np.ndarray, Set[str]]:
+    """Collect the non-null values of ``columns`` into one dict per row.
+
+    Values are gathered column by column as ``(row, column, value)`` triples,
+    ordered by row and grouped into dicts, so the cost is proportional to the
+    number of non-null cells rather than rows times columns. ``base`` holds the
+    existing ``other_tags`` dicts the melted values are merged into; rows
+    without melted values keep their ``base`` entry (``None`` if there is none).
+    Returns the object array of dicts and the keys that were already present
+    in a ``base`` dict.
+    """
+
+    count = len(df)
+    result = np.full(count, None, dtype=object)
+    if base is not None:
+        result[:] = base
+
+    position_chunks: List[np.ndarray] = []
+    order_chunks: List[np.ndarray] = []
+    value_chunks: List[np.ndarray] = []
+    for index, column in enumerate(columns):
+        series = df[column]
+        rows = np.flatnonzero(series.notna().to_numpy())
+        if rows.size:
+            position_chunks.append(rows)
+            order_chunks.append(np.full(rows.size, index, dtype=np.int64))
+            value_chunks.append(series.iloc[rows].to_numpy(dtype=object))
+    if not position_chunks:
+        return result, set()
+
+    unsorted = np.concatenate(position_chunks)
+    orders = np.concatenate(order_chunks)
+    order = np.lexsort((orders, unsorted))
+    positions = unsorted[order]
+    keys = np.asarray(columns, dtype=object)[orders[order]].tolist()
+    values = np.concatenate(value_chunks)[order].tolist()
+
+    starts = np.flatnonzero(np.r_[True, positions[1:] != positions[:-1]])
+    ends = np.r_[starts[1:], positions.size]
+    clashes: Set[str] = set()
+    for row, start, end in zip(positions[starts].tolist(), starts.tolist(), ends.tolist()):
+        melted = dict(zip(keys[start:end], values[start:end]))
+        existing = result[row]
+        if existing:
+            clashes.update(melted.keys() & existing.keys())
+            melted = {**existing, **melted}
+        result[row] = melted
+    return result, clashes
+
+
+def tags_melt(df_exp: pd.DataFrame, nan_threshold: float = 0.75) -> pd.DataFrame:
+    """Move the sparse columns of ``df_exp`` into an ``other_tags`` dict column.
+
+    Columns with more than ``nan_threshold`` missing values are melted; rows
+    without any of their values get ``None``. ``df_exp`` is modified in place.
+    """
+
+    high_nan_cols = high_nan_columns(df_exp, nan_threshold)
 
     logger.debug(f"Melting tags from the following columns: {high_nan_cols}")
 
-    df_high_nan = df_exp[high_nan_cols]
-
     # assert other_tags column does not already exist, if it does,
-    assert 'other_tags' not in df_exp.columns, "other_tags column already exists in dataframe"
-    df_exp['other_tags'] = df_high_nan.apply(lambda x: x.dropna().to_dict(), axis=1)
-
-    # drop {} in other tags so that its nan
-    df_exp['other_tags'] = df_exp['other_tags'].apply(lambda x: x if x != {} else None)
+    assert OTHER_TAGS not in df_exp.columns, "other_tags column already exists in dataframe"
+    other_tags, _ = _melt_columns(df_exp, high_nan_cols)
+    df_exp[OTHER_TAGS] = other_tags
 
     df_exp.drop(columns=high_nan_cols, inplace=True)
     return df_exp
 
 
-def columns_melt(df_exp, columns_to_move):
-    def concat_melt(row, col):
-        # check if value to melt is NaN
-        if str(row[col]) == 'nan':
-            return None
-        # if other_tags column does not exist, no need to concat
-        # or if other tags exist, but is empty/none/nan, still no need to concat
-        if (
-            'other_tags' not in row.keys()
-            or row['other_tags'] == {}
-            or row['other_tags'] is None
-            or str(row['other_tags']) == 'nan'
-        ):
-            return {col: row[col]}
-
-        # before concating, check if the column already exists in other_tags
-        if col in row['other_tags']:
-            logger.warning(f"'{col}' already exists in 'row'.")
-        return {**row['other_tags'], col: row[col]}
-
-    # Move specified columns to other_tags
+def _existing_tags(df_exp: pd.DataFrame) -> Optional[List[Any]]:
+    if OTHER_TAGS not in df_exp.columns:
+        return None
+    return [_parse_tags(value) for value in df_exp[OTHER_TAGS].tolist()]
+
+
+def columns_melt(
+    df_exp: pd.DataFrame, columns_to_move: Iterable[str], warn_missing: bool = True
+) -> pd.DataFrame:
+    """Move ``columns_to_move`` into the ``other_tags`` dict column of ``df_exp``.
+
+    Non-null values are merged into the existing ``other_tags`` dict of their
+    row; rows where all moved values are null keep their ``other_tags``.
+    ``df_exp`` is modified in place.
+    """
+
+    present: List[str] = []
     for col in columns_to_move:
         if col in df_exp.columns:
-            df_exp['other_tags'] = df_exp.apply(lambda x: concat_melt(x, col), axis=1)
-            df_exp.drop(columns=col, inplace=True)
-        else:
+            present.append(col)
+        elif warn_missing:
             logger.warning(f"Column '{col}' not found in dataframe.")
+    if not present:
+        return df_exp
+
+    other_tags, clashes = _melt_columns(df_exp, present, _existing_tags(df_exp))
+    df_exp[OTHER_TAGS] = other_tags
+    for col in sorted(clashes, key=present.index):
+        logger.warning(f"'{col}' already exists in 'other_tags'.")
 
+    df_exp.drop(columns=present, inplace=True)
     return df_exp
 
 
-def tags_explode(df_melt):
+def tags_explode(df_melt: pd.DataFrame) -> pd.DataFrame:
+    """Expand the ``other_tags`` dicts of ``df_melt`` back into one column per key.
+
+    New columns follow the order in which their keys first appear and get the
+    same dtypes a DataFrame built from the dicts would have. Stringified dicts
+    (as written to CSV) are parsed first.
+    """
+
     # check if df_melt has column 'other_tags'
-    if 'other_tags' not in df_melt.columns:
+    if OTHER_TAGS not in df_melt.columns:
         logger.warning("df is not melted, but tags_explode was called")
         return df_melt
 
     # check if other_tags is empty
-    if df_melt['other_tags'].isnull().all():
+    if df_melt[OTHER_TAGS].isnull().all():
         logger.debug("nothing to explode, other_tags is empty, returning df with dropped other_tags column")
         # drop other_tags column
-        df_melt.drop(columns=['other_tags'], inplace=True)
+        df_melt.drop(columns=[OTHER_TAGS], inplace=True)
         return df_melt
 
-    # convert stringified dicts to dict
-    df_melt['other_tags'] = df_melt['other_tags'].apply(
-        lambda x: ast.literal_eval(x) if isinstance(x, str) else x
+    count = len(df_melt)
+    columns: Dict[str, np.ndarray] = {}
+    for row, value in enumerate(df_melt[OTHER_TAGS].tolist()):
+        tags = _parse_tags(value)
+        if not tags:
+            continue
+        for key, value in tags.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = np.full(count, np.nan, dtype=object)
+            column[row] = value
+
+    df_exploded = df_melt.drop(columns=[OTHER_TAGS])
+    overlap = df_exploded.columns.intersection(list(columns))
+    if len(overlap):
+        raise ValueError(f"columns overlap with other_tags keys: {list(overlap)}")
+    exploded = pd.DataFrame(
+        {
+            key: pd.Series(column, index=df_melt.index).infer_objects()
+            for key, column in columns.items()
+        },
+        index=df_melt.index,
     )
+    return pd.concat([df_exploded, exploded], axis=1)
+
+
+def iter_tags_melt(
+    chunks: Iterable[pd.DataFrame],
+    columns: Optional[List[str]] = None,
+    nan_threshold: float = 0.75,
+) -> Iterator[pd.DataFrame]:
+    """Melt each DataFrame of ``chunks`` like :func:`tags_melt`, one chunk at a time.
+
+    The melted columns must be the same for every chunk, so they are either
+    given as ``columns`` or picked from the first chunk with ``nan_threshold``.
+    Chunks lacking some of them are melted without warnings.
+    """
+
+    for chunk in chunks:
+        if columns is None:
+            columns = high_nan_columns(chunk, nan_threshold)
+            logger.debug(f"Melting tags from the following columns: {columns}")
+        chunk = columns_melt(chunk, columns, warn_missing=False)
+        if OTHER_TAGS not in chunk.columns:
+            chunk[OTHER_TAGS] = None
+        yield chunk
+
 
-    # explode other_tags column into multiple columns
-    df_exploded = df_melt.join(pd.json_normalize(df_melt['other_tags']))
+def iter_tags_explode(chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """Explode each DataFrame of ``chunks`` like :func:`tags_explode`, one chunk at a time.
 
-    # drop the original other_tags column
-    df_exploded.drop(columns=['other_tags'], inplace=True)
+    Every chunk only gets the columns of the keys it contains.
+    """
 
-    return df_exploded
+    for chunk in chunks:
+        yield tags_explode(chunk)
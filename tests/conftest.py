@@ -22,3 +22,56 @@ def go_to_tmpdir(request):
     # Chdir only for the duration of the test.
     with tmpdir.as_cwd():
         yield
+
+
+@pytest.fixture
+def write_pbf():
+    """Return ``write(path, offset=0, voltage=None)`` writing a tiny power network PBF.
+
+    Nodes 1-3 (node 3 a tower, shifted east by ``offset`` degrees) carry way 10
+    (``power=line``, with ``voltage`` when given) and way 11 (``power=cable``).
+    An existing file is replaced and a ``.md5`` checksum written alongside.
+    """
+    import hashlib
+
+    osmium = pytest.importorskip("osmium")
+
+    def write(path, offset=0, voltage=None):
+        path = str(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(path)
+        line_tags = {"power": "line"}
+        if voltage is not None:
+            line_tags["voltage"] = voltage
+        with osmium.SimpleWriter(path) as writer:
+            mutable = osmium.osm.mutable
+            nodes = ((1, 2.0, 9.0, {}), (2, 2.1, 9.1, {}), (3, 2.2, 9.2, {"power": "tower"}))
+            for node_id, lon, lat, tags in nodes:
+                location = (lon + offset, lat)
+                writer.add_node(mutable.Node(id=node_id, location=location, tags=tags))
+            writer.add_way(mutable.Way(id=10, nodes=[1, 2, 3], tags=line_tags))
+            writer.add_way(mutable.Way(id=11, nodes=[2, 3], tags={"power": "cable"}))
+        with open(path, "rb") as source:
+            checksum = hashlib.md5(source.read()).hexdigest()
+        with open(f"{path}.md5", "w", encoding="ascii") as target:
+            target.write(f"{checksum}  {os.path.basename(path)}\n")
+
+    return write
+
+
+class _Planted:
+    def __reduce__(self):
+        return (pytest.fail, ("a planted pickle was loaded",))
+
+
+@pytest.fixture
+def planted_pickle():
+    """Return pickle bytes that fail the test when they are unpickled.
+
+    Written over a cache or checkpoint file, they show that the file is read
+    without unpickling.
+    """
+    import pickle
+
+    return pickle.dumps(_Planted())
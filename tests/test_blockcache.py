@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+import earth_osm.stream as stream_module
+from earth_osm.blockcache import BlockCache
+from earth_osm.stream import stream_pbf_features
+
+pytest.importorskip("osmium")
+
+
+def _rows(path, feature, cache, **kwargs):
+    rows = stream_pbf_features(str(path), "power", feature, "BJ", block_cache=cache, **kwargs)
+    return sorted((row["Type"], row["id"]) for row in rows)
+
+
+def _forbid_decoding(monkeypatch):
+    def fail(primitive):
+        raise AssertionError("block decompressed despite the block cache")
+
+    monkeypatch.setattr(stream_module, "decode_strmap", fail)
+
+
+def test_exact_and_narrower_scans_reuse_cached_blocks(tmp_path, monkeypatch, write_pbf):
+    pbf = tmp_path / "region.osm.pbf"
+    write_pbf(pbf, voltage="110000")
+    cache = BlockCache(str(tmp_path / "blockcache"))
+
+    everything = _rows(pbf, "ALL_power", cache)
+    assert everything == [("node", 3), ("way", 10), ("way", 11)]
+    lines = _rows(pbf, "line", None, tag_filter="voltage>=110000")
+
+    _forbid_decoding(monkeypatch)
+    assert _rows(pbf, "ALL_power", cache) == everything
+    assert _rows(pbf, "line", cache, tag_filter="voltage>=110000") == lines
+    assert _rows(pbf, "tower", cache, bbox=(2.15, 9.15, 2.3, 9.3)) == [("node", 3)]
+
+
+def test_changed_pbf_drops_its_entries(tmp_path, write_pbf):
+    pbf = tmp_path / "region.osm.pbf"
+    write_pbf(pbf, voltage="110000")
+    cache = BlockCache(str(tmp_path / "blockcache"))
+    assert _rows(pbf, "line", cache, tag_filter="voltage>=110000") == [("way", 10)]
+
+    write_pbf(pbf, voltage="20000")
+    os.utime(pbf, ns=(0, 0))
+    assert _rows(pbf, "line", cache, tag_filter="voltage>=110000") == []
+
+
+def test_evicts_least_recently_used_blocks(tmp_path, write_pbf):
+    pbf = tmp_path / "region.osm.pbf"
+    write_pbf(pbf, voltage="110000")
+    cache = BlockCache(str(tmp_path / "blockcache"))
+    _rows(pbf, "line", cache)
+    _rows(pbf, "cable", cache)
+    entries = sorted(cache._entries(), key=lambda entry: entry.stat().st_mtime_ns)
+    for age, entry in enumerate(entries):
+        os.utime(entry.path, ns=(age, age))
+
+    cache.max_bytes = cache.size() - 1
+    assert cache.evict() == 1
+    assert not os.path.exists(entries[0].path)
+    assert all(os.path.exists(entry.path) for entry in entries[1:])
+
+
+def test_planted_pickles_are_never_loaded(tmp_path, write_pbf, planted_pickle):
+    pbf = tmp_path / "region.osm.pbf"
+    write_pbf(pbf, voltage="110000")
+    cache = BlockCache(str(tmp_path / "blockcache"))
+    expected = _rows(pbf, "line", cache)
+    for entry in cache._entries():
+        with open(entry.path, "wb") as target:
+            target.write(planted_pickle)
+    assert _rows(pbf, "line", cache) == expected
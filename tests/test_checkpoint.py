@@ -0,0 +1,147 @@
+import os
+
+import pytest
+
+import earth_osm.eo as eo_module
+import earth_osm.stream as stream_module
+from earth_osm.checkpoint import load_scan_checkpoint, save_scan_checkpoint
+from earth_osm.eo import save_osm_data
+from earth_osm.gfk_data import get_region_tuple
+from earth_osm.regions import local_pbf_path
+from earth_osm.stream import iter_pbf_feature_rows, stream_pbf_features
+
+pytest.importorskip("osmium")
+
+
+def _export(data_dir, out_dir, resume):
+    save_osm_data(
+        region_list=["benin", "togo"],
+        primary_name="power",
+        feature_list=["line", "tower"],
+        out_format=["csv"],
+        out_aggregate="region",
+        out_dir=str(out_dir),
+        data_dir=str(data_dir),
+        mp=False,
+        progress_bar=False,
+        resume=resume,
+    )
+    out = out_dir / "out"
+    return {path.name: path.read_bytes() for path in sorted(out.iterdir())}
+
+
+def test_resume_replays_finished_regions(tmp_path, monkeypatch, write_pbf):
+    for offset, region in enumerate(("benin", "togo")):
+        write_pbf(local_pbf_path(get_region_tuple(region), str(tmp_path)), offset)
+    expected = _export(tmp_path, tmp_path / "clean", resume=False)
+
+    scanned = []
+    real_scan = eo_module.stream_region_features_multi
+
+    def interrupted_scan(region, *args, **kwargs):
+        scanned.append(region.short)
+        if region.short == "TG" and scanned.count("TG") == 1:
+            raise RuntimeError("preempted")
+        return real_scan(region, *args, **kwargs)
+
+    monkeypatch.setattr(eo_module, "stream_region_features_multi", interrupted_scan)
+    with pytest.raises(RuntimeError, match="preempted"):
+        _export(tmp_path, tmp_path / "resumed", resume=True)
+    assert os.listdir(tmp_path / "checkpoints")
+
+    assert _export(tmp_path, tmp_path / "resumed", resume=True) == expected
+    assert scanned == ["BJ", "TG", "TG"]
+    assert os.listdir(tmp_path / "checkpoints") == []
+
+
+def test_scan_resumes_after_last_completed_pass(tmp_path, monkeypatch, write_pbf):
+    pbf = tmp_path / "sample.osm.pbf"
+    write_pbf(pbf)
+    checkpoint_dir = str(tmp_path / "checkpoint")
+    rows = list(
+        stream_pbf_features(str(pbf), "power", "line", "XX", checkpoint_dir=checkpoint_dir)
+    )
+    assert [row["id"] for row in rows] == [10]
+
+    def fail(*args, **kwargs):
+        raise AssertionError("scan pass should have been skipped")
+
+    monkeypatch.setattr(stream_module, "_collect_targets", fail)
+    monkeypatch.setattr(stream_module, "_collect_nodes", fail)
+    assert (
+        list(
+            stream_pbf_features(str(pbf), "power", "line", "XX", checkpoint_dir=checkpoint_dir)
+        )
+        == rows
+    )
+
+    # Only pass 1 finished: the coordinates are collected again.
+    target_way = stream_module.Way(id=10, tags={"power": "line"}, refs=[1, 2, 3])
+    label = stream_module._scan_label("XX", "power", "line", None, None)
+    save_scan_checkpoint(
+        checkpoint_dir, str(pbf), label, "targets", ({}, [target_way], {1, 2, 3})
+    )
+    monkeypatch.undo()
+    monkeypatch.setattr(stream_module, "_collect_targets", fail)
+    assert (
+        list(
+            stream_pbf_features(str(pbf), "power", "line", "XX", checkpoint_dir=checkpoint_dir)
+        )
+        == rows
+    )
+
+    os.utime(pbf, ns=(0, 0))
+    monkeypatch.undo()
+    assert (
+        list(
+            stream_pbf_features(str(pbf), "power", "line", "XX", checkpoint_dir=checkpoint_dir)
+        )
+        == rows
+    )
+
+
+def test_scan_checkpoint_is_keyed_by_the_filters(tmp_path, write_pbf):
+    pbf = tmp_path / "sample.osm.pbf"
+    write_pbf(pbf, voltage="110000")
+    checkpoint_dir = str(tmp_path / "checkpoint")
+
+    def scan(**kwargs):
+        rows = iter_pbf_feature_rows(
+            str(pbf), "power", ["line", "cable"], "XX", checkpoint_dir=checkpoint_dir, **kwargs
+        )
+        return sorted(row.id for row in rows)
+
+    assert scan() == [10, 11]
+    assert scan(tag_filter="voltage>=110000") == [10]
+    assert scan(bbox=(2.15, 9.15, 2.3, 9.3)) == [10, 11]
+    assert scan(bbox=(2.0, 9.0, 2.05, 9.05)) == [10]
+
+
+def test_scan_checkpoint_round_trips_without_pickle(tmp_path, write_pbf):
+    pbf = tmp_path / "sample.osm.pbf"
+    write_pbf(pbf)
+    checkpoint_dir = str(tmp_path / "checkpoint")
+    tower = stream_module.Node(3, {"power": "tower"}, (2.2, 9.2))
+    line = stream_module.Way(10, {"power": "line", "name": "Ligne é"}, (1, 2, 3))
+    extra = stream_module.Node(1, {}, (2.0, 9.0))
+
+    save_scan_checkpoint(
+        checkpoint_dir, str(pbf), "XX", "targets", ({3: tower}, [line], {1, 2, 3})
+    )
+    assert load_scan_checkpoint(checkpoint_dir, str(pbf), "XX") == (
+        "targets",
+        ({3: tower}, [line], {1, 2, 3}),
+    )
+    coordinates = ({3: tower}, [line], {3: tower, 1: extra})
+    save_scan_checkpoint(checkpoint_dir, str(pbf), "XX", "coordinates", coordinates)
+    assert load_scan_checkpoint(checkpoint_dir, str(pbf), "XX") == ("coordinates", coordinates)
+
+
+def test_scan_checkpoint_never_unpickles(tmp_path, write_pbf, planted_pickle):
+    pbf = tmp_path / "sample.osm.pbf"
+    write_pbf(pbf)
+    checkpoint_dir = tmp_path / "checkpoint"
+    save_scan_checkpoint(str(checkpoint_dir), str(pbf), "XX", "targets", ({}, [], set()))
+    (path,) = checkpoint_dir.iterdir()
+    path.write_bytes(planted_pickle)
+    assert load_scan_checkpoint(str(checkpoint_dir), str(pbf), "XX") == (None, None)
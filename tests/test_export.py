@@ -66,6 +66,32 @@ def test_small_count(shared_data_dir):
     assert "lonlat" in header and "Type" in header
 
 
+def test_geojson_without_csv(shared_data_dir, tmp_path):
+    save_osm_data(
+        region_list=["malta"],
+        primary_name="power",
+        feature_list=["plant"],
+        update=update,
+        mp=False,
+        data_dir=shared_data_dir,
+        out_dir=str(tmp_path),
+        out_format=["geojson", "geojsonseq"],
+        out_aggregate=False,
+        progress_bar=False,
+    )
+    out_dir = tmp_path / "out"
+    assert not (out_dir / "malta_plant.csv").exists()
+
+    with (out_dir / "malta_plant.geojson").open(encoding="utf-8") as fh:
+        collection = json.load(fh)
+    with (out_dir / "malta_plant.geojsonl").open(encoding="utf-8") as fh:
+        sequence = [json.loads(line) for line in fh]
+
+    assert collection["type"] == "FeatureCollection"
+    assert collection["features"]
+    assert collection["features"] == sequence
+
+
 def test_stream_region_features(shared_data_dir):
     region = get_region_tuple("malta")
     feature_iter = stream_region_features(
@@ -145,11 +171,335 @@ def test_primary_cache_streaming(shared_data_dir, monkeypatch):
 
     assert call_counter["count"] == first_count, "cache was rebuilt unexpectedly"
 
+
+def test_parquet_output(shared_data_dir, tmp_path):
+    import geopandas as gpd
+    import pyarrow.parquet as pq
+
+    save_osm_data(
+        region_list=["malta"],
+        primary_name="power",
+        feature_list=["line", "generator"],
+        update=update,
+        mp=False,
+        data_dir=shared_data_dir,
+        out_dir=str(tmp_path),
+        out_format=["csv", "parquet"],
+        out_aggregate=False,
+        progress_bar=False,
+    )
+
+    for feature_name in ("line", "generator"):
+        parquet_path = tmp_path / "out" / f"malta_{feature_name}.parquet"
+        csv_path = tmp_path / "out" / f"malta_{feature_name}.csv"
+        assert parquet_path.exists()
+
+        schema = pq.read_schema(parquet_path)
+        assert str(schema.field("Region").type).startswith("dictionary")
+        assert str(schema.field("tags").type).startswith("map")
+
+        gdf = gpd.read_parquet(parquet_path)
+        with csv_path.open(encoding="utf-8") as fh:
+            csv_ids = sorted(int(line.split(",", 1)[0]) for line in fh.readlines()[1:])
+        assert sorted(gdf["id"].tolist()) == csv_ids
+        assert gdf.geometry.notna().all()
+
+
 # test low resource feature (cable)
 # test high resource feature (substation)
 
 # test aggregation by region (benin, germany)
 # test aggregation by feature (tower, line)
 # test no aggregation
- 
- 
\ No newline at end of file
+
+
+def _synthetic_rows(region, count):
+    for index in range(count):
+        row = {
+            "id": index,
+            "Region": region,
+            "Type": "way",
+            "lonlat": [[index * 0.1, 1.0], [index * 0.1, 1.5]],
+            "refs": [index, index + 1],
+            "tags.power": "line",
+        }
+        if index % 3 == 0:
+            row["tags.voltage"] = "110000"
+        yield row
+
+
+def _write_synthetic(out_dir, finalize_workers):
+    from earth_osm.export import EarthOSMWriter
+
+    with EarthOSMWriter(
+        primary_name, str(out_dir), ["csv", "geojson"], finalize_workers=finalize_workers
+    ) as writer:
+        for region in ("AA", "BB", "CC", "DD"):
+            writer.write([region], ["line"], _synthetic_rows(region, 50))
+    out = Path(out_dir) / "out"
+    return {path.name: path.read_bytes() for path in sorted(out.iterdir())}
+
+
+def test_parallel_finalize_matches_serial(tmp_path):
+    serial = _write_synthetic(tmp_path / "serial", finalize_workers=1)
+    parallel = _write_synthetic(tmp_path / "parallel", finalize_workers=3)
+    assert len(serial) == 8
+    assert parallel == serial
+
+
+def test_shared_geopackage_finalize_matches_serial(tmp_path, monkeypatch):
+    import pyogrio
+
+    from earth_osm import export
+    from earth_osm.export import EarthOSMWriter
+
+    def _no_pool(*args, **kwargs):
+        raise AssertionError("a shared GeoPackage must be finalized serially")
+
+    def _write(out_dir, finalize_workers):
+        with EarthOSMWriter(
+            primary_name,
+            str(out_dir),
+            ["gpkg"],
+            finalize_workers=finalize_workers,
+            gpkg_path="power.gpkg",
+            gpkg_table="lines",
+        ) as writer:
+            for region in ("AA", "BB", "CC", "DD", "EE", "FF"):
+                writer.write([region], ["line"], _synthetic_rows(region, 20))
+        frame = pyogrio.read_dataframe(
+            Path(out_dir) / "out" / "power.gpkg", layer="lines", fid_as_index=True
+        )
+        return list(zip(frame.index, frame["Region"], frame["id"]))
+
+    serial = _write(tmp_path / "serial", finalize_workers=1)
+    monkeypatch.setattr(export.mp, "Pool", _no_pool)
+    parallel = _write(tmp_path / "parallel", finalize_workers=3)
+    assert len(serial) == 120
+    assert [region for _, region, _ in serial[::20]] == ["AA", "BB", "CC", "DD", "EE", "FF"]
+    assert parallel == serial
+
+
+def test_finalize_failure_is_reported_per_target(tmp_path):
+    import pytest
+    from earth_osm.export import EarthOSMWriter, ExportFinalizeError
+
+    writer = EarthOSMWriter(primary_name, str(tmp_path), ["csv"], finalize_workers=2)
+    writer.write(["AA"], ["line"], _synthetic_rows("AA", 5))
+    writer.write(["BB"], ["line"], _synthetic_rows("BB", 5))
+    broken = writer._targets[(("BB",), ("line",))]
+    broken._spill_writer.close()
+    Path(broken._spill_writer.path).write_bytes(b"corrupt")
+
+    with pytest.raises(ExportFinalizeError) as excinfo:
+        writer.close()
+
+    assert list(excinfo.value.failures) == [broken.out_slug]
+    assert sorted(path.suffix for path in (tmp_path / "out").iterdir()) == [".csv"]
+
+
+def test_finalize_requires_an_open_target(tmp_path):
+    import pytest
+    from earth_osm.export import _ExportTarget
+
+    for out_format in (["csv"], ["parquet"]):
+        target = _ExportTarget(
+            ["AA"], primary_name, ["line"], str(tmp_path), out_format, shards=2
+        )
+        with pytest.raises(RuntimeError, match="not open"):
+            target._finalize()
+
+
+def test_flatgeobuf_output_supports_bbox_queries(tmp_path):
+    import pyogrio
+    import shapely
+
+    from earth_osm.export import EarthOSMWriter
+
+    with EarthOSMWriter(primary_name, str(tmp_path), ["fgb"]) as writer:
+        writer.write(["AA"], ["line"], _synthetic_rows("AA", 200))
+
+    path = tmp_path / "out" / "AA_line.fgb"
+    info = pyogrio.read_info(path)
+    assert info["features"] == 200
+    assert info["crs"] == "EPSG:4326"
+    assert info["capabilities"]["fast_spatial_filter"]
+
+    full = pyogrio.read_dataframe(path)
+    window = (5.0, 0.0, 8.0, 2.0)
+    subset = pyogrio.read_dataframe(path, bbox=window)
+    expected = full[full.intersects(shapely.box(*window))]
+    assert 0 < len(subset) < len(full)
+    assert sorted(subset["id"]) == sorted(expected["id"])
+    assert json.loads(full.loc[full["id"] == 0, "refs"].iloc[0]) == [0, 1]
+
+
+def test_geopackage_tables_in_one_file(tmp_path):
+    import pyogrio
+    import shapely
+
+    from earth_osm.export import EarthOSMWriter
+
+    with EarthOSMWriter(
+        primary_name, str(tmp_path), ["gpkg"], gpkg_path="power.gpkg"
+    ) as writer:
+        writer.write(["AA"], ["line"], _synthetic_rows("AA", 200))
+        writer.write(["BB"], ["line"], _synthetic_rows("BB", 20))
+
+    path = tmp_path / "out" / "power.gpkg"
+    assert sorted(name for name, _ in pyogrio.list_layers(path)) == ["AA_line", "BB_line"]
+    info = pyogrio.read_info(path, layer="AA_line")
+    assert info["features"] == 200
+    assert info["crs"] == "EPSG:4326"
+    assert info["capabilities"]["fast_spatial_filter"]
+
+    full = pyogrio.read_dataframe(path, layer="AA_line")
+    window = (5.0, 0.0, 8.0, 2.0)
+    subset = pyogrio.read_dataframe(path, layer="AA_line", bbox=window)
+    expected = full[full.intersects(shapely.box(*window))]
+    assert 0 < len(subset) < len(full)
+    assert sorted(subset["id"]) == sorted(expected["id"])
+    assert full["id"].dtype == "int64"
+    assert json.loads(full.loc[full["id"] == 0, "refs"].iloc[0]) == [0, 1]
+
+    with EarthOSMWriter(
+        primary_name, str(tmp_path), ["gpkg"], gpkg_path="power.gpkg", gpkg_table="lines"
+    ) as writer:
+        writer.write(["AA"], ["line"], _synthetic_rows("AA", 30))
+        writer.write(["BB"], ["line"], _synthetic_rows("BB", 20))
+
+    layers = sorted(name for name, _ in pyogrio.list_layers(path))
+    assert layers == ["AA_line", "BB_line", "lines"]
+    shared = pyogrio.read_dataframe(path, layer="lines")
+    assert shared.groupby("Region").size().to_dict() == {"AA": 30, "BB": 20}
+
+
+def test_sharded_output_manifest(tmp_path):
+    import pandas as pd
+
+    from earth_osm.export import EarthOSMWriter
+
+    with EarthOSMWriter(
+        primary_name,
+        str(tmp_path),
+        ["csv", "geojson"],
+        shards=2,
+        shard_by="cell",
+        max_part_rows=60,
+    ) as writer:
+        writer.write(["AA"], ["line"], _synthetic_rows("AA", 200))
+
+    out = tmp_path / "out"
+    manifest = json.loads((out / "AA_line.manifest.json").read_text())
+    assert manifest["rows"] == 200
+    assert manifest["bbox"] == [0.0, 1.0, 19.900000000000002, 1.5]
+
+    ids = []
+    for part in manifest["parts"]:
+        assert part["rows"] <= 60
+        frame = pd.read_csv(out / part["files"]["csv"])
+        assert len(frame) == part["rows"]
+        lonlat = frame["lonlat"].map(json.loads)
+        xs = [pair[0] for pairs in lonlat for pair in pairs]
+        assert part["bbox"][0] == min(xs) and part["bbox"][2] == max(xs)
+        geojson = json.loads((out / part["files"]["geojson"]).read_text())
+        geojson_ids = [feature["properties"]["id"] for feature in geojson["features"]]
+        assert geojson_ids == frame["id"].tolist()
+        ids.extend(frame["id"])
+
+    assert len(manifest["parts"]) >= 4
+    assert sorted(ids) == list(range(200))
+    assert not (out / "AA_line.csv").exists()
+
+
+def test_spatial_order_sorts_every_format(tmp_path):
+    import numpy as np
+    import pandas as pd
+
+    from earth_osm.export import EarthOSMWriter
+    from earth_osm.geometry import hilbert_values
+
+    def scattered_rows():
+        for row in _synthetic_rows("AA", 100):
+            lon = (row["id"] * 37) % 100 * 0.1
+            row["lonlat"] = [[lon, 1.0], [lon, 1.5]]
+            yield row
+
+    with EarthOSMWriter(
+        primary_name, str(tmp_path), ["csv", "parquet"], spatial_order="hilbert"
+    ) as writer:
+        writer.write(["AA"], ["line"], scattered_rows())
+
+    frame = pd.read_csv(tmp_path / "out" / "AA_line.csv")
+    parquet = pd.read_parquet(tmp_path / "out" / "AA_line.parquet")
+    assert sorted(frame["id"]) == list(range(100))
+    assert parquet["id"].tolist() == frame["id"].tolist()
+
+    centres = np.array([json.loads(value)[0] for value in frame["lonlat"]])
+    keys = hilbert_values(centres[:, 0], centres[:, 1] + 0.25, (-180.0, -90.0, 180.0, 90.0))
+    assert (np.diff(keys.astype(np.int64)) >= 0).all()
+
+
+def test_writer_deduplicates_elements_across_regions(tmp_path):
+    import csv
+
+    from earth_osm.export import EarthOSMWriter
+
+    with EarthOSMWriter(primary_name, str(tmp_path), ["csv"], deduplicate=True) as writer:
+        for region, count in (("AA", 5), ("BB", 8)):
+            rows = _synthetic_rows(region, count)
+            writer.write(["AA", "BB"], ["line"], rows, source=(region, "line"))
+        node = {
+            "id": 1,
+            "Region": "BB",
+            "Type": "node",
+            "lonlat": [[0.0, 0.0]],
+            "tags.power": "tower",
+        }
+        writer.write(["AA", "BB"], ["line"], [node], source=("BB", "line"))
+        writer.write(["AA", "BB"], ["line"], _synthetic_rows("CC", 2), source=("CC", "cable"))
+
+    with open(tmp_path / "out" / "AA_BB_line.csv", newline="") as handle:
+        rows = [(row["Region"], row["Type"], int(row["id"])) for row in csv.DictReader(handle)]
+    assert sorted(rows) == sorted(
+        [("AA", "way", index) for index in range(5)]
+        + [("BB", "way", index) for index in range(5, 8)]
+        + [("BB", "node", 1)]
+        + [("CC", "way", index) for index in range(2)]
+    )
+    # Only the rows written count: BB's ways 0-4 were dropped as duplicates.
+    assert writer.source_histograms[("BB", "line")].rows == 4
+
+
+def _write_dedup_sources(out_dir, column_plan=None):
+    from earth_osm.export import EarthOSMWriter
+
+    sources = [("AA", "line"), ("BB", "line")]
+    with EarthOSMWriter(primary_name, str(out_dir), ["csv"], deduplicate=True) as writer:
+        writer.prepare_target(["AA", "BB"], ["line"], column_plan, sources)
+        writer.write(["AA", "BB"], ["line"], _synthetic_rows("AA", 5), source=sources[0])
+        # BB repeats AA's ways with a tag of its own, then adds two new ways.
+        duplicates = [
+            dict(row, **{"tags.operator": "BB grid"}) for row in _synthetic_rows("BB", 5)
+        ]
+        writer.write(["AA", "BB"], ["line"], duplicates, source=sources[1])
+        fresh = [row for row in _synthetic_rows("BB", 7) if row["id"] >= 5]
+        writer.write(["AA", "BB"], ["line"], fresh, source=sources[1])
+    with open(Path(out_dir) / "out" / "AA_BB_line.csv", encoding="utf-8") as handle:
+        header = handle.readline()
+    return header, writer.source_histograms
+
+
+def test_single_pass_plan_matches_two_pass_with_dedup(tmp_path):
+    from earth_osm.tagstats import TagHistogram, plan_columns
+
+    two_pass_header, histograms = _write_dedup_sources(tmp_path / "two_pass")
+    merged = TagHistogram()
+    for histogram in histograms.values():
+        merged.update(histogram)
+    single_pass_header, _ = _write_dedup_sources(
+        tmp_path / "single_pass", plan_columns(merged)
+    )
+
+    assert "tags.operator" not in two_pass_header
+    assert single_pass_header == two_pass_header
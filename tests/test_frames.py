@@ -0,0 +1,127 @@
+import math
+
+import pandas as pd
+import pytest
+
+from earth_osm.frames import build_feature_frame, build_tag_frame, iter_feature_batches
+from earth_osm.stream import FeatureRow
+
+ROWS = [
+    {"id": 1, "Region": "XX", "Type": "node", "lonlat": [[1.0, 2.0]], "tags.power": "tower"},
+    {
+        "id": 2,
+        "Region": "XX",
+        "Type": "way",
+        "lonlat": [[1.0, 2.0], [3.0, 4.0]],
+        "refs": [10, 11],
+        "tags.power": "line",
+        "tags.voltage": "110000",
+        "tags.name": None,
+    },
+    {
+        "id": 3,
+        "Region": "YY",
+        "Type": "area",
+        "lonlat": [],
+        "tags.voltage": "110000",
+        "tags.unused": math.nan,
+    },
+]
+
+
+def test_tag_frame_promotes_requested_keys():
+    frame = build_tag_frame(ROWS, tag_columns=["power"])
+
+    assert list(frame.features.columns) == [
+        "id",
+        "Region",
+        "Type",
+        "lonlat",
+        "tags.power",
+        "refs",
+    ]
+    assert frame.features["tags.power"].tolist()[:2] == ["tower", "line"]
+    assert frame.features["tags.power"].isna().iloc[2]
+    assert frame.tags["feature"].tolist() == [1, 2]
+    assert frame.tags["key"].tolist() == ["voltage", "voltage"]
+    assert list(frame.tags["key"].cat.categories) == ["voltage"]
+    assert list(frame.tags["value"].cat.categories) == ["110000"]
+
+
+def test_tag_frame_round_trips_to_wide():
+    wide = pd.DataFrame(ROWS).dropna(axis=1, how="all")
+    rebuilt = build_tag_frame(ROWS).to_wide()
+
+    columns = sorted(wide.columns)
+    assert sorted(rebuilt.columns) == columns
+    pd.testing.assert_frame_equal(
+        rebuilt[columns].fillna(math.nan).astype(str),
+        wide[columns].fillna(math.nan).astype(str),
+    )
+    assert list(build_tag_frame(ROWS).to_wide(["tags.power"]).columns)[-1] == "tags.power"
+
+
+def test_feature_frame_matches_row_frame():
+    frame = build_feature_frame(iter(ROWS))
+    wide = pd.DataFrame(ROWS).dropna(axis=1, how="all")
+
+    assert list(frame.columns) == list(wide.columns)
+    assert "tags.name" not in frame.columns and "tags.unused" not in frame.columns
+    assert frame["id"].dtype == "int64"
+    assert isinstance(frame["Type"].dtype, pd.CategoricalDtype)
+    assert frame["Region"].tolist() == ["XX", "XX", "YY"]
+    for column in frame.columns:
+        assert frame[column].astype(object).equals(wide[column].astype(object)), column
+    assert frame["tags.voltage"].dtype == wide["tags.voltage"].dtype
+
+
+def test_feature_frame_falls_back_for_untyped_values():
+    rows = [{"id": 1, "Type": "node"}, {"id": "w2", "Type": ["way"]}, {"Type": "node"}]
+    frame = build_feature_frame(rows)
+
+    assert frame["id"].tolist()[:2] == [1, "w2"] and math.isnan(frame["id"].iloc[2])
+    assert frame["Type"].tolist() == ["node", ["way"], "node"]
+
+
+def test_feature_batches_from_feature_rows():
+    features = [
+        FeatureRow(
+            id=1,
+            region="XX",
+            type="node",
+            lonlat=((1.0, 2.0),),
+            refs=None,
+            tags={"power": "tower"},
+        ),
+        FeatureRow(
+            id=2,
+            region="XX",
+            type="way",
+            lonlat=((1.0, 2.0), (3.0, 4.0)),
+            refs=[10, 11],
+            tags={"power": "line", "voltage": "110000"},
+        ),
+        FeatureRow(
+            id=3,
+            region="YY",
+            type="node",
+            lonlat=((5.0, 6.0),),
+            refs=None,
+            tags={"power": "pole"},
+        ),
+    ]
+    expected = build_feature_frame(feature.to_dict() for feature in features)
+
+    batches = list(iter_feature_batches(features, batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 1]
+    assert list(batches[1].index) == [2]
+    frame = pd.concat(batches)[expected.columns]
+    for column in expected.columns:
+        assert frame[column].astype(object).equals(expected[column].astype(object)), column
+
+    pa = pytest.importorskip("pyarrow")
+    (batch,) = iter_feature_batches(features, as_arrow=True)
+    assert batch.schema.field("Region").type == pa.dictionary(pa.int32(), pa.string())
+    assert batch.column("lonlat").to_pylist() == expected["lonlat"].tolist()
+    assert batch.column("refs").to_pylist() == [None, [10, 11], None]
+    assert batch.column("tags.voltage").to_pylist() == [None, "110000", None]
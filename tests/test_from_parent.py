@@ -0,0 +1,83 @@
+import csv
+import os
+import shutil
+
+from earth_osm.blockindex import block_index_path
+from earth_osm.eo import save_osm_data
+from earth_osm.gfk_data import get_region_tuple
+from earth_osm.regions import download_region_pbf, find_cached_parent_pbf, local_pbf_path
+from earth_osm.stream import stream_pbf_features, stream_region_features
+
+
+def _pose_as_parent(shared_data_dir, data_dir, region):
+    """Copy the region's PBF into ``data_dir`` as if it were its cached parent."""
+
+    region_pbf = download_region_pbf(region, False, shared_data_dir, progress_bar=False)
+    parent = get_region_tuple(region.parent)
+    parent_pbf = local_pbf_path(parent, data_dir)
+    os.makedirs(os.path.dirname(parent_pbf), exist_ok=True)
+    shutil.copyfile(region_pbf, parent_pbf)
+    shutil.copyfile(f"{region_pbf}.md5", f"{parent_pbf}.md5")
+    return region_pbf, parent, parent_pbf
+
+
+def test_from_parent_matches_direct_extract(shared_data_dir, tmp_path):
+    malta = get_region_tuple("malta")
+    data_dir = str(tmp_path / "earth_data")
+    malta_pbf, parent, parent_pbf = _pose_as_parent(shared_data_dir, data_dir, malta)
+
+    cached = find_cached_parent_pbf(malta, data_dir)
+    assert cached is not None
+    assert cached[0].id == parent.id
+
+    direct = list(
+        stream_pbf_features(malta_pbf, "power", "line", malta.short, multiprocess=False)
+    )
+    derived = list(
+        stream_region_features(
+            malta,
+            "power",
+            "line",
+            data_dir,
+            progress_bar=False,
+            multiprocess=False,
+            from_parent=True,
+        )
+    )
+
+    assert derived
+    assert {row["id"] for row in derived} == {row["id"] for row in direct}
+    assert not os.path.exists(local_pbf_path(malta, data_dir)), "child PBF was downloaded"
+    assert os.path.exists(block_index_path(parent_pbf)), "block index was not written"
+
+
+def test_parent_fanout_writes_per_region_outputs(shared_data_dir, tmp_path):
+    malta = get_region_tuple("malta")
+    data_dir = str(tmp_path / "earth_data")
+    malta_pbf, parent, _ = _pose_as_parent(shared_data_dir, data_dir, malta)
+
+    save_osm_data(
+        region_list=["malta"],
+        primary_name="power",
+        feature_list=["line", "substation"],
+        out_format=["csv"],
+        out_aggregate=False,
+        out_dir=str(tmp_path),
+        data_dir=data_dir,
+        mp=False,
+        progress_bar=False,
+        parent_region=parent.id,
+    )
+
+    for feature_name in ("line", "substation"):
+        csv_path = tmp_path / "out" / f"malta_{feature_name}.csv"
+        assert csv_path.exists()
+        with csv_path.open(encoding="utf-8") as fh:
+            fanned_ids = {int(row["id"]) for row in csv.DictReader(fh)}
+        direct_ids = {
+            row["id"]
+            for row in stream_pbf_features(
+                malta_pbf, "power", feature_name, malta.short, multiprocess=False
+            )
+        }
+        assert fanned_ids == direct_ids
@@ -0,0 +1,105 @@
+import json
+
+import numpy as np
+import pytest
+import shapely
+
+from earth_osm.frames import FeatureFrameBuilder
+from earth_osm.stream import FeatureRow
+
+pa = pytest.importorskip("pyarrow")
+
+
+SQUARE = ((0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 0.0))
+
+
+def _table(features):
+    return FeatureFrameBuilder().extend_features(features).build_geoarrow()
+
+
+def _extension(table):
+    metadata = table.schema.field("geometry").metadata
+    assert json.loads(metadata[b"ARROW:extension:metadata"]) == {"crs": "OGC:CRS84"}
+    return metadata[b"ARROW:extension:name"].decode()
+
+
+@pytest.mark.parametrize(
+    "feature_type, lonlat, extension, expected",
+    [
+        ("node", ((1.0, 2.0),), "geoarrow.point", [1.0, 2.0]),
+        ("way", ((1.0, 2.0), (3.0, 4.0)), "geoarrow.linestring", [[1.0, 2.0], [3.0, 4.0]]),
+        ("area", SQUARE, "geoarrow.polygon", [[list(pair) for pair in SQUARE]]),
+    ],
+)
+def test_single_kind_uses_native_encoding(feature_type, lonlat, extension, expected):
+    features = [
+        FeatureRow(
+            id=index,
+            region="XX",
+            type=feature_type,
+            lonlat=lonlat,
+            refs=None,
+            tags={"power": "x"},
+        )
+        for index in range(3)
+    ]
+    table = _table(features)
+
+    assert _extension(table) == extension
+    assert table.column_names == ["id", "Region", "Type", "geometry", "tags"]
+    assert table.column("geometry").to_pylist() == [expected] * 3
+    assert table.column("id").to_pylist() == [0, 1, 2]
+
+
+def test_mixed_kinds_use_wkb_and_tags_map():
+    features = [
+        FeatureRow(
+            id=1,
+            region="XX",
+            type="node",
+            lonlat=((1.0, 2.0),),
+            refs=None,
+            tags={"power": "tower"},
+        ),
+        FeatureRow(
+            id=2,
+            region="XX",
+            type="way",
+            lonlat=((1.0, 2.0), (3.0, 4.0)),
+            refs=[5, 6],
+            tags={"power": "line", "voltage": "110000"},
+        ),
+        FeatureRow(id=3, region="YY", type="way", lonlat=((1.0, 2.0),), refs=[5], tags={}),
+    ]
+    table = _table(features)
+
+    assert _extension(table) == "geoarrow.wkb"
+    geometries = shapely.from_wkb(np.array(table.column("geometry").to_pylist(), dtype=object))
+    assert geometries[0].equals(shapely.Point(1, 2))
+    assert geometries[1].equals(shapely.LineString([(1, 2), (3, 4)]))
+    assert geometries[2] is None
+    assert table.column("refs").to_pylist() == [None, [5, 6], [5]]
+    assert table.column("tags").to_pylist() == [
+        [("power", "tower")],
+        [("power", "line"), ("voltage", "110000")],
+        [],
+    ]
+
+
+def test_geopandas_reads_geoarrow_table():
+    geopandas = pytest.importorskip("geopandas")
+    if not hasattr(geopandas.GeoDataFrame, "from_arrow"):
+        pytest.skip("geopandas without Arrow support")
+
+    features = [
+        FeatureRow(
+            id=1,
+            region="XX",
+            type="way",
+            lonlat=((1.0, 2.0), (3.0, 4.0)),
+            refs=[1, 2],
+            tags={},
+        ),
+    ]
+    gdf = geopandas.GeoDataFrame.from_arrow(_table(features))
+    assert gdf.geometry.iloc[0].equals(shapely.LineString([(1, 2), (3, 4)]))
@@ -0,0 +1,29 @@
+import pandas as pd
+import shapely
+
+from earth_osm.export import convert_pd_to_gdf
+
+
+def test_convert_pd_to_gdf_builds_typed_geometries():
+    df = pd.DataFrame(
+        {
+            "id": [1, 2, 3, 4],
+            "Type": ["node", "way", "area", "way"],
+            "lonlat": [
+                "[[1.0, 2.0]]",
+                [[0.0, 0.0], [1.0, 1.0]],
+                "[[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 0.0]]",
+                None,
+            ],
+        }
+    )
+
+    gdf = convert_pd_to_gdf(df)
+
+    assert list(gdf.columns) == ["id", "Type", "geometry"]
+    assert gdf.crs.to_epsg() == 4326
+    assert gdf.geometry.iloc[0].equals(shapely.Point(1.0, 2.0))
+    assert gdf.geometry.iloc[1].equals(shapely.LineString([(0, 0), (1, 1)]))
+    assert gdf.geometry.iloc[2].equals(shapely.Polygon([(0, 0), (1, 0), (1, 1)]))
+    assert gdf.geometry.iloc[3] is None
+    assert df["lonlat"].iloc[0] == [[1.0, 2.0]]
@@ -0,0 +1,26 @@
+import random
+
+from earth_osm.idset import ARRAY_LIMIT, IdSet, element_key
+
+
+def test_matches_python_set_across_page_kinds():
+    rng = random.Random(0)
+    dense = [rng.randrange(1 << 16) for _ in range(3 * ARRAY_LIMIT)]
+    sparse = [rng.randrange(1 << 40) for _ in range(2000)]
+    values = dense + sparse + [-5, -5, 0]
+
+    ids = IdSet()
+    added = [ids.add(value) for value in values]
+
+    expected = set()
+    assert added == [not (value in expected or expected.add(value)) for value in values]
+    assert len(ids) == len(expected)
+    assert list(ids) == sorted(expected)
+    assert all(value in ids for value in expected)
+    assert (1 << 41) not in ids and 70000 not in ids
+    assert ids.nbytes < 8 * len(expected)
+
+
+def test_element_key_separates_nodes_and_ways():
+    assert element_key("node", 7) != element_key("way", 7)
+    assert element_key("way", 7) == element_key("way", 7)
@@ -1,6 +1,30 @@
+import json
 import os
+
+import numpy as np
+import pandas as pd
+
 from earth_osm.eo import get_osm_data
-from earth_osm.utils import tags_melt, tags_explode, columns_melt
+from earth_osm.utils import (
+    columns_melt,
+    iter_tags_explode,
+    iter_tags_melt,
+    tags_explode,
+    tags_melt,
+)
+
+
+def _sparse_frame():
+    rows = []
+    for i in range(40):
+        row = {"id": i, "Type": "node", "refs": [i, i + 1] if i % 4 == 0 else np.nan}
+        row["tags.power"] = "tower"
+        if i % 5 == 0:
+            row["tags.voltage"] = 110000 + i
+        if i % 7 == 0:
+            row["tags.name"] = f"name {i}"
+        rows.append(row)
+    return pd.DataFrame(rows, index=pd.RangeIndex(100, 140))
 
 def test_column_melt(shared_data_dir):
     region = "nigeria"
@@ -99,6 +123,66 @@ def test_melt(shared_data_dir):
         assert df[col].equals(df_explode[col])
 
 
+def test_melt_explode_round_trip_offline():
+    df = _sparse_frame()
+
+    df_melt = tags_melt(df.copy(), nan_threshold=0.5)
+    assert list(df_melt.columns) == ["id", "Type", "tags.power", "other_tags"]
+    assert df_melt["other_tags"].loc[100] == {
+        "refs": [0, 1],
+        "tags.voltage": 110000,
+        "tags.name": "name 0",
+    }
+    assert df_melt["other_tags"].loc[101] is None
+
+    df_explode = tags_explode(df_melt.copy())
+    assert set(df_explode.columns) == set(df.columns)
+    for col in df.columns:
+        assert df[col].equals(df_explode[col]), col
+
+    # stringified dicts, as read back from a csv, explode the same way
+    df_text = df_melt.copy()
+    df_text["other_tags"] = [
+        None if tags is None else json.dumps(tags) for tags in df_text["other_tags"]
+    ]
+    df_text = tags_explode(df_text)
+    for col in df.columns:
+        assert df[col].equals(df_text[col]), col
+
+
+def test_columns_melt_keeps_existing_tags():
+    df = _sparse_frame()
+    df_melt = columns_melt(df.copy(), ["tags.voltage", "tags.name", "missing"])
+
+    assert "tags.voltage" not in df_melt.columns and "tags.name" not in df_melt.columns
+    assert df_melt["other_tags"].loc[105] == {"tags.voltage": 110005}
+    assert df_melt["other_tags"].loc[101] is None
+
+    df_melt = columns_melt(df_melt, ["refs"])
+    # a row whose moved value is missing keeps the tags melted before
+    assert df_melt["other_tags"].loc[105] == {"tags.voltage": 110005}
+    assert df_melt["other_tags"].loc[100] == {
+        "tags.voltage": 110000,
+        "tags.name": "name 0",
+        "refs": [0, 1],
+    }
+
+
+def test_iter_tags_melt_matches_tags_melt():
+    df = _sparse_frame()
+    expected = tags_melt(df.copy(), nan_threshold=0.5)
+    melted_columns = ["refs", "tags.voltage", "tags.name"]
+
+    chunks = (df.iloc[start:start + 8].copy() for start in range(0, len(df), 8))
+    melted = pd.concat(iter_tags_melt(chunks, melted_columns))
+    assert list(melted.columns) == list(expected.columns)
+    assert melted["other_tags"].tolist() == expected["other_tags"].tolist()
+
+    bounds = zip(range(0, 40, 8), range(8, 48, 8))
+    chunks = (melted.iloc[start:end].copy() for start, end in bounds)
+    exploded = pd.concat(iter_tags_explode(chunks))
+    assert exploded["tags.voltage"].dropna().tolist() == df["tags.voltage"].dropna().tolist()
+
 
 if __name__ == '__main__':
     test_column_melt()
@@ -1,8 +1,15 @@
+import threading
+import time
+from types import SimpleNamespace
+
 import pandas as pd
 import pytest
+import requests
 
+import earth_osm.eo as eo_module
 from earth_osm.eo import get_osm_data
 from earth_osm.gfk_data import get_region_tuple
+from earth_osm.overpass import OverpassScheduler, OverpassStatus, parse_overpass_status
 
 
 TEST_CASES = [
@@ -92,3 +99,128 @@ def test_geofabrik_and_overpass_produce_comparable_results(
         for (geo_lon, geo_lat), (over_lon, over_lat) in zip(geo_coords, over_coords):
             assert geo_lon == pytest.approx(over_lon, abs=1e-9)
             assert geo_lat == pytest.approx(over_lat, abs=1e-9)
+
+
+STATUS_FREE = """Connected as: 1234
+Current time: 2024-05-01T10:00:00Z
+Announced endpoint: none
+Rate limit: 2
+2 slots available now.
+Currently running queries (pid, space limit, time limit, start time):
+"""
+
+STATUS_BUSY = """Connected as: 1234
+Current time: 2024-05-01T10:00:00Z
+Announced endpoint: none
+Rate limit: 2
+Slot available after: 2024-05-01T10:00:09Z, in 9 seconds.
+Slot available after: 2024-05-01T10:00:03Z, in 3 seconds.
+Currently running queries (pid, space limit, time limit, start time):
+"""
+
+
+class _Response:
+    def __init__(self, status_code=200, payload=None, text="", headers=None):
+        self.status_code = status_code
+        self.payload = payload
+        self.text = text
+        self.headers = headers or {}
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error")
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def __call__(self):
+        return self.now
+
+
+def test_parse_overpass_status():
+    assert parse_overpass_status(STATUS_FREE) == OverpassStatus(2, 2, None)
+    assert parse_overpass_status(STATUS_BUSY) == OverpassStatus(2, 0, 3.0)
+    with pytest.raises(ValueError):
+        parse_overpass_status("<html>not found</html>")
+
+
+def test_scheduler_honours_retry_after_and_slot_status():
+    clock = _Clock()
+    statuses = [STATUS_BUSY, STATUS_FREE, STATUS_FREE]
+    answers = [
+        _Response(429, headers={"Retry-After": "7"}),
+        _Response(200, payload={"elements": []}),
+    ]
+    session = SimpleNamespace(
+        get=lambda url, timeout: _Response(text=statuses.pop(0)),
+        post=lambda url, data, timeout: answers.pop(0),
+    )
+    scheduler = OverpassScheduler(2, session=session, sleep=clock.sleep, clock=clock)
+
+    assert scheduler.fetch("query") == {"elements": []}
+    assert clock.sleeps == [3.0, 7.0]
+
+
+def test_scheduler_gives_up_after_max_attempts():
+    clock = _Clock()
+    session = SimpleNamespace(post=lambda url, data, timeout: _Response(504))
+    scheduler = OverpassScheduler(
+        1,
+        status_endpoint=None,
+        max_attempts=3,
+        session=session,
+        sleep=clock.sleep,
+        clock=clock,
+    )
+
+    with pytest.raises(requests.HTTPError):
+        scheduler.fetch("query")
+    assert clock.sleeps == [2.0, 4.0]
+
+
+def test_child_regions_are_fetched_concurrently_and_merged_in_order(monkeypatch):
+    children = [SimpleNamespace(id=f"c{index}", short=f"C{index}") for index in range(6)]
+    parent = SimpleNamespace(id="parent", short="P")
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def fake_backend(region, primary_name, feature_name, *, overpass_scheduler, **kwargs):
+        with lock:
+            running.append(region.short)
+            peak.append(len(running))
+        # Later children answer first.
+        time.sleep(0.01 * (len(children) - int(region.short[1:])))
+        with lock:
+            running.remove(region.short)
+        return "dataframe", pd.DataFrame({"id": [region.short], "Region": [region.short]})
+
+    monkeypatch.setattr(
+        eo_module, "expand_region_to_iso_children", lambda region, require_iso: children
+    )
+    monkeypatch.setattr(eo_module, "fetch_region_backend", fake_backend)
+
+    frame = eo_module._fetch_overpass_region(
+        parent,
+        "power",
+        "line",
+        mp=False,
+        update=False,
+        data_dir="unused",
+        progress_bar=False,
+        cache_primary=False,
+        overpass_slots=3,
+    )
+
+    assert list(frame["id"]) == [child.short for child in children]
+    assert max(peak) == 3
@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+from earth_osm.predicate import (
+    TagTest,
+    feature_predicate,
+    normalize_predicate,
+    parse_tag_filter,
+    predicate_from_json,
+    predicate_implies,
+    predicate_to_json,
+)
+
+
+def _bind_and_match(predicate, tags):
+    """Evaluate ``predicate`` in string-table index space like the scanner does."""
+
+    strmap = ["", "unrelated"] + sorted({text for item in tags.items() for text in item})
+    index = {text: position for position, text in enumerate(strmap)}
+    bound = predicate.bind(strmap)
+    return bound({index[key]: index[value] for key, value in tags.items()})
+
+
+@pytest.mark.parametrize(
+    "expression, tags, expected",
+    [
+        ("power=line,cable", {"power": "line"}, True),
+        ("power=line,cable", {"power": "minor_line"}, False),
+        ("power=line", {"power": "tower;line"}, True),
+        ("power=*", {"power": ""}, True),
+        ("power!=line", {}, True),
+        ("voltage>=110000", {"voltage": "20000;220000"}, True),
+        ("voltage>=110000", {"voltage": "unknown"}, False),
+        ('name~"^Sub\\d"', {"name": "Sub7"}, True),
+        (
+            "power=line & !(location=underground)",
+            {"power": "line", "location": "underground"},
+            False,
+        ),
+        ("power=line and not location=underground", {"power": "line"}, True),
+        ("building | power=tower", {"power": "tower"}, True),
+        ("not power or voltage<1000", {"power": "line", "voltage": "400"}, True),
+    ],
+)
+def test_string_and_index_evaluation_agree(expression, tags, expected):
+    predicate = parse_tag_filter(expression)
+    assert predicate.matches(tags) is expected
+    assert _bind_and_match(predicate, tags) is expected
+
+
+def test_feature_predicate_matches_legacy_semantics():
+    assert feature_predicate("power", ("line",)).matches({"power": " line ; cable"})
+    assert feature_predicate("power", ("ALL_power",)).matches({"power": "anything"})
+    assert not feature_predicate("power", ("line",)).matches({"building": "yes"})
+
+
+def test_list_values_bind_like_matches():
+    predicate = TagTest("power", "eq", ("tower;line",))
+    tags = {"power": "tower;line"}
+    assert predicate.matches(tags) is False
+    assert _bind_and_match(predicate, tags) is False
+
+
+def test_missing_key_binds_to_constant_false():
+    bound = parse_tag_filter("voltage>=110000").bind(["", "power", "line"])
+    assert bound.constant is False
+
+
+@pytest.mark.parametrize(
+    "expression",
+    ["", "power=", "(power=line", "voltage>=high", 'name~"("', "power=tower;line"],
+)
+def test_invalid_expressions_raise(expression):
+    with pytest.raises(ValueError):
+        parse_tag_filter(expression)
+
+
+def test_normalized_spellings_compare_equal():
+    first = normalize_predicate(
+        parse_tag_filter("(power=line | power=cable) & voltage>=110000")
+    )
+    second = normalize_predicate(parse_tag_filter("voltage>=110000 and power=cable,line"))
+    assert first == second
+
+
+@pytest.mark.parametrize(
+    "narrow, broad, expected",
+    [
+        ("power=line", "power", True),
+        ("power=line & voltage>=220000", "power=line,cable & voltage>=110000", True),
+        ("voltage>110000", "voltage>=110000", True),
+        ("voltage>=110000", "voltage>110000", False),
+        ("power=line | power=cable", "power=line", False),
+        ("power=line & !location=underground", "power=line,minor_line", True),
+        ("power=line", "power=line & voltage>1", False),
+    ],
+)
+def test_predicate_implies(narrow, broad, expected):
+    narrow = normalize_predicate(parse_tag_filter(narrow))
+    broad = normalize_predicate(parse_tag_filter(broad))
+    assert predicate_implies(narrow, broad) is expected
+
+
+def test_predicate_json_round_trip():
+    predicate = parse_tag_filter('(power=line,cable | name~"^Ligne") & !location=underground')
+    payload = json.loads(json.dumps(predicate_to_json(predicate)))
+    assert predicate_from_json(payload) == predicate
+    with pytest.raises(ValueError):
+        predicate_from_json({"xor": []})
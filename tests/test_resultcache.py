@@ -0,0 +1,75 @@
+import hashlib
+
+import earth_osm.eo as eo_module
+from earth_osm.eo import save_osm_data
+from earth_osm.gfk_data import get_region_tuple
+from earth_osm.regions import local_pbf_path
+from earth_osm.resultcache import ResultCache, pbf_checksum, result_key
+
+
+def _export(data_dir, out_dir):
+    save_osm_data(
+        region_list=["benin"],
+        primary_name="power",
+        feature_list=["line"],
+        out_format=["csv"],
+        out_dir=str(out_dir),
+        data_dir=str(data_dir),
+        mp=False,
+        progress_bar=False,
+        result_cache=True,
+    )
+    return out_dir / "out" / "BJ_line.csv"
+
+
+def test_rerun_reuses_outputs_until_pbf_changes(tmp_path, monkeypatch, write_pbf):
+    pbf_path = local_pbf_path(get_region_tuple("benin"), str(tmp_path))
+    write_pbf(pbf_path, voltage="110000")
+    output = _export(tmp_path, tmp_path)
+    first = output.read_bytes()
+    assert b"110000" in first
+
+    calls = []
+    real_writer = eo_module.EarthOSMWriter
+    monkeypatch.setattr(
+        eo_module,
+        "EarthOSMWriter",
+        lambda *args, **kwargs: calls.append(1) or real_writer(*args, **kwargs),
+    )
+    mtime = output.stat().st_mtime_ns
+    _export(tmp_path, tmp_path)
+    assert calls == [] and output.stat().st_mtime_ns == mtime
+
+    copied = _export(tmp_path, tmp_path / "elsewhere")
+    assert calls == [] and copied.read_bytes() == first
+
+    write_pbf(pbf_path, voltage="220000")
+    _export(tmp_path, tmp_path)
+    assert calls == [1] and b"220000" in output.read_bytes()
+
+
+def test_changed_output_is_not_restored(tmp_path):
+    output = tmp_path / "out" / "AA_line.csv"
+    output.parent.mkdir()
+    output.write_text("id\n1\n")
+    cache = ResultCache(str(tmp_path / "results"))
+    key = result_key({"regions": ["AA"]}, {"a.osm.pbf": "0" * 32})
+    cache.save(key, str(tmp_path / "out"), [str(output)])
+
+    assert cache.restore(key, str(tmp_path / "out")) == [str(output)]
+    assert (
+        cache.restore(
+            result_key({"regions": ["BB"]}, {"a.osm.pbf": "0" * 32}), str(tmp_path / "out")
+        )
+        is None
+    )
+    output.write_text("id\n2\n")
+    assert cache.restore(key, str(tmp_path / "out")) is None
+
+
+def test_pbf_checksum_prefers_md5_sidecar(tmp_path):
+    path = tmp_path / "sample.osm.pbf"
+    path.write_bytes(b"payload")
+    assert pbf_checksum(str(path)) == hashlib.md5(b"payload").hexdigest()
+    (tmp_path / "sample.osm.pbf.md5").write_text("abc123 sample.osm.pbf\n")
+    assert pbf_checksum(str(path)) == "abc123"
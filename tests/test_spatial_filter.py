@@ -0,0 +1,53 @@
+import pytest
+from shapely.geometry import Point, box
+
+from earth_osm.gfk_data import get_region_tuple
+from earth_osm.regions import download_region_pbf
+from earth_osm.spatial import SpatialFilter
+from earth_osm.stream import stream_pbf_features
+
+
+def test_bbox_pushdown_matches_clipped_extract(shared_data_dir):
+    malta = get_region_tuple("malta")
+    malta_pbf = download_region_pbf(malta, False, shared_data_dir, progress_bar=False)
+    bbox = (14.40, 35.82, 14.56, 35.92)
+    area = box(*bbox)
+
+    full = list(stream_pbf_features(malta_pbf, "power", "ALL_power", malta.short))
+    expected = {
+        row["id"]
+        for row in full
+        if any(area.intersects(Point(lon, lat)) for lon, lat in row["lonlat"])
+    }
+
+    clipped = list(
+        stream_pbf_features(malta_pbf, "power", "ALL_power", malta.short, bbox=bbox)
+    )
+    assert clipped
+    assert {row["id"] for row in clipped} == expected
+
+    polygon = list(
+        stream_pbf_features(malta_pbf, "power", "ALL_power", malta.short, polygon=area.wkt)
+    )
+    assert {row["id"] for row in polygon} == expected
+
+    outside = stream_pbf_features(
+        malta_pbf, "power", "ALL_power", malta.short, bbox=(0.0, 0.0, 1.0, 1.0)
+    )
+    assert list(outside) == []
+
+
+@pytest.mark.parametrize(
+    "bbox",
+    [
+        (2.5, 9.0, 2.9, 9.5),  # shares the polygon's east edge
+        (2.5, 9.5, 2.9, 9.9),  # touches a single corner
+    ],
+)
+def test_intersection_of_touching_shapes_is_empty(bbox):
+    polygon = SpatialFilter.from_geometry(box(2.0, 9.0, 2.5, 9.5))
+
+    clipped = polygon.intersection(SpatialFilter.from_bbox(bbox))
+
+    assert clipped.is_empty
+    assert not clipped.contains(2.5, 9.2)
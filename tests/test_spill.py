@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pytest
+
+from earth_osm.spill import SortedSpillWriter, SpillWriter, iter_spill_records
+
+RECORDS = [
+    {
+        "id": 1,
+        "Region": "XX",
+        "Type": "node",
+        "lonlat": [[1.25, 2.5]],
+        "refs": None,
+        "tags.power": "tower",
+    },
+    {
+        "id": 2,
+        "Region": "XX",
+        "Type": "way",
+        "lonlat": [[1.0, 2.0], [3.0, 4.0]],
+        "refs": [10, 11],
+        "tags.power": "line",
+        "tags.name": "Ünïcode ; name",
+        "other_tags": {"tags.voltage": "110000"},
+    },
+    {"id": 3, "Region": "YY", "Type": "area", "lonlat": [], "refs": [], "tags.power": None},
+]
+
+
+@pytest.mark.parametrize("compression", [None, "zlib", "bz2", "lzma"])
+def test_spill_round_trip(tmp_path, compression):
+    writer = SpillWriter(str(tmp_path / "spill"), compression=compression, batch_rows=2)
+    for record in RECORDS:
+        writer.write(dict(record))
+    writer.close()
+
+    assert os.path.dirname(writer.path) == str(tmp_path / "spill")
+    expected = [
+        {key: value for key, value in record.items() if value is not None}
+        for record in RECORDS
+    ]
+    assert list(iter_spill_records(writer.path)) == expected
+
+    writer.remove()
+    assert not os.path.exists(writer.path)
+
+
+def test_spill_round_trips_fallback_columns(tmp_path):
+    records = [
+        {"id": "n1", "Region": "XX", "Type": "node", "refs": ["a", "b"], "count": np.int64(3)},
+        {"id": "w2", "Region": "XX", "Type": "way", "refs": None, "share": np.float32(0.5)},
+    ]
+    writer = SpillWriter(str(tmp_path))
+    for record in records:
+        writer.write(dict(record))
+    writer.close()
+
+    assert list(iter_spill_records(writer.path)) == [
+        {"id": "n1", "Region": "XX", "Type": "node", "refs": ["a", "b"], "count": 3},
+        {"id": "w2", "Region": "XX", "Type": "way", "share": 0.5},
+    ]
+
+
+def test_unknown_compression_raises(tmp_path):
+    with pytest.raises(ValueError):
+        SpillWriter(str(tmp_path), compression="snappy")
+
+
+def test_sorted_spill_merges_runs(tmp_path):
+    def sort_key(records):
+        return [record["key"] for record in records]
+
+    keys = [(index * 7919) % 50 for index in range(200)]
+    writer = SortedSpillWriter(sort_key, str(tmp_path), run_rows=30, batch_rows=8)
+    for index, key in enumerate(keys):
+        writer.write({"id": index, "key": key})
+    writer.close()
+
+    assert len(writer.runs) == 7
+    merged = [(record["key"], record["id"]) for record in writer.iter_records()]
+    assert merged == sorted(zip(keys, range(200)))
+
+    writer.remove()
+    assert not os.path.exists(writer.path)
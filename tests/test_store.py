@@ -0,0 +1,81 @@
+import pytest
+
+from earth_osm.export import EarthOSMWriter
+from earth_osm.store import FeatureStore
+
+
+def _row(index, region="AA", voltage=None):
+    row = {
+        "id": index,
+        "Region": region,
+        "Type": "way",
+        "lonlat": [[index * 1.0, 0.0], [index * 1.0, 0.5]],
+        "refs": [index, index + 1],
+        "tags.power": "line",
+    }
+    if voltage is not None:
+        row["tags.voltage"] = voltage
+    return row
+
+
+def _sync(out_dir, rows_by_source):
+    with EarthOSMWriter(
+        "power", str(out_dir), ["csv"], feature_store="power.sqlite"
+    ) as writer:
+        for (region, feature), rows in rows_by_source.items():
+            writer.prepare_target([region], [feature], sources=[(region, feature)])
+            writer.write([region], [feature], rows, source=(region, feature))
+    return writer.store_stats
+
+
+def test_rerun_only_touches_deltas(tmp_path):
+    first = _sync(tmp_path, {("AA", "line"): [_row(index) for index in range(5)]})
+    assert first[1:] == (5, 0, 0, 0)
+
+    rows = [_row(index) for index in (0, 1, 2, 4)]
+    rows[1] = _row(1, voltage="110000")
+    rows.append(_row(7))
+    second = _sync(tmp_path, {("AA", "line"): rows})
+    assert second[1:] == (1, 1, 3, 1)
+
+    with FeatureStore(str(tmp_path / "out" / "power.sqlite")) as store:
+        stored = {row["id"]: row for row in store.query(primary_name="power", region="AA")}
+        assert sorted(stored) == [0, 1, 2, 4, 7]
+        assert stored[1]["tags.voltage"] == "110000"
+        assert stored[1]["lonlat"] == [[1.0, 0.0], [1.0, 0.5]]
+        assert sorted(row["id"] for row in store.query(changed_since=first.run)) == [1, 7]
+        assert [row["id"] for row in store.query(bbox=(3.5, -1.0, 4.5, 1.0))] == [4]
+        assert [run["deleted"] for run in store.runs()] == [0, 1]
+
+
+def test_empty_source_and_shared_elements(tmp_path):
+    _sync(
+        tmp_path,
+        {
+            ("AA", "line"): [_row(1), _row(2)],
+            ("AA", "cable"): [_row(2)],
+            ("BB", "line"): [_row(1, region="BB")],
+        },
+    )
+    stats = _sync(tmp_path, {("AA", "line"): [], ("AA", "cable"): [_row(2)]})
+    assert stats[1:] == (0, 0, 1, 1)
+
+    with FeatureStore(str(tmp_path / "out" / "power.sqlite")) as store:
+        assert [(row["Region"], row["id"]) for row in store.query()] == [("AA", 2), ("BB", 1)]
+        assert [row["id"] for row in store.query(feature="line")] == [1]
+        assert [row["id"] for row in store.query(feature="cable")] == [2]
+
+
+def test_failed_run_leaves_store_unchanged(tmp_path):
+    _sync(tmp_path, {("AA", "line"): [_row(index) for index in range(3)]})
+
+    def failing_rows():
+        yield _row(0, voltage="220000")
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        _sync(tmp_path, {("AA", "line"): failing_rows()})
+
+    with FeatureStore(str(tmp_path / "out" / "power.sqlite")) as store:
+        assert len(store.runs()) == 1
+        assert [row.get("tags.voltage") for row in store.query()] == [None] * 3
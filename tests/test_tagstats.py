@@ -0,0 +1,72 @@
+import os
+
+from earth_osm.export import EarthOSMWriter
+from earth_osm.tagstats import TagHistogram, TagStatsStore, plan_columns
+
+
+def _rows():
+    for index in range(40):
+        row = {
+            "id": index,
+            "Region": "XX",
+            "Type": "node",
+            "lonlat": [[float(index), 1.0]],
+            "tags.power": "tower",
+        }
+        if index % 2:
+            row["tags.operator"] = "Grid Co"
+        if index == 7:
+            row["tags.ref"] = "T7"
+        yield row
+
+
+def _export(out_dir, store, single_pass, pbf="md5-1"):
+    with EarthOSMWriter("power", str(out_dir), ["csv", "geojsonseq"]) as writer:
+        plan = store.plan("power", [("XX", "tower")], {"XX": pbf}) if single_pass else None
+        writer.prepare_target(["XX"], ["tower"], plan)
+        writer.write(["XX"], ["tower"], _rows(), source=("XX", "tower"))
+    store.save("XX", "power", {"tower": writer.source_histograms[("XX", "tower")]}, pbf)
+
+    out = os.path.join(str(out_dir), "out")
+    return {
+        name: open(os.path.join(out, name), "rb").read() for name in sorted(os.listdir(out))
+    }
+
+
+def test_plan_melts_rare_tags():
+    histogram = TagHistogram()
+    for row in _rows():
+        histogram.add(row)
+
+    plan = plan_columns(histogram)
+    assert plan.columns == (
+        "id",
+        "Type",
+        "Region",
+        "lonlat",
+        "tags.operator",
+        "tags.power",
+        "other_tags",
+    )
+    assert plan.melt_columns == {"tags.ref"}
+
+
+def test_single_pass_matches_two_pass(tmp_path):
+    store = TagStatsStore(str(tmp_path / "tagstats"))
+    assert store.plan("power", [("XX", "tower")], {"XX": "md5-1"}) is None
+
+    two_pass = _export(tmp_path / "two", store, single_pass=False)
+    single_pass = _export(tmp_path / "single", store, single_pass=True)
+
+    assert single_pass == two_pass
+    assert store.load("XX", "power", "tower", "md5-1").rows == 40
+
+
+def test_histograms_of_another_pbf_are_not_planned(tmp_path):
+    store = TagStatsStore(str(tmp_path / "tagstats"))
+    _export(tmp_path / "first", store, single_pass=False)
+
+    assert store.plan("power", [("XX", "tower")], {"XX": "md5-1"}) is not None
+    assert store.plan("power", [("XX", "tower")], {"XX": "md5-2"}) is None
+    assert store.plan("power", [("XX", "tower")], {}) is None
+    assert store.load("XX", "power", "tower", "md5-2") is None